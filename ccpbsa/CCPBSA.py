@@ -1,45 +1,72 @@
 import sys
 import os
+import copy
 import shutil
 import subprocess
-#from tqdm import tqdm
+import hashlib
+import socket
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import numpy as np
+from .topology import Topology
+from .pbsolver import PBSolver, parse_gropbe, radius, write_log
+from .progress import track
+from .clustering import CLUSTERS, cluster_weights, write_clusters, displace
+from .edr import read_edrs, lj_terms
+from .trajectory import Frame, box_matrix, concatenate, pack_trr, trajectory
+from .minimizer import ForceField, parse_mdp, minimize
+from .spatial import SpatialIndex
 import pymol
 pymol.finish_launching(['pymol', '-Qc'])
 cmd = pymol.cmd
 
-def get_lj(*files):
-    """Get the tail of a list of log files to extract the mean value of the
-    Lennard-Jones Energy.
+def get_edr_lj(*tables, pair='', group=None):
+    """Mean Lennard-Jones energies of energy tables from read_edrs, taken
+    directly from the .edr files instead of the output of gmx energy. With
+    group (e.g. 'Local') the terms of all pairs of energy groups including
+    it are summed up. A missing or unreadable file raises an OSError.
     """
-    for f in files:
-        with open(f, 'r') as ljlog:
-            unparsed = ljlog.readlines()
-            onefour = next(i for i in unparsed if 'LJ-14' in i).split()[1]
-            sr = next(i for i in unparsed if 'LJ (SR)' in i).split()[2]
+    for t in tables:
 
-            yield float(onefour), float(sr)
+        if t is None:
+            raise OSError("Missing or unreadable energy file")
+
+        yield lj_terms(t, pair, group)
 
 
 def get_electro(*files):
     """Get the tail of a list of log files to extract the mean value of the
-    Coulomb Energy.
+    Coulomb Energy. Stops at a log without the energies, e.g. of a gropbe
+    that was killed.
     """
     for f in files:
         with open(f, 'r') as solvlog:
             unparsed = solvlog.readlines()
-            coul = next(i for i in unparsed if 'Coulombic' in i).split()[6]
-            solv = next(i for i in unparsed if 'Solvation' in i).split()[5]
+            coul = next((i for i in unparsed if 'Coulombic' in i), None)
+            solv = next((i for i in unparsed if 'Solvation' in i), None)
+
+            if coul is None or solv is None:
+                return
 
-            yield float(coul), float(solv)
+            yield float(coul.split()[6]), float(solv.split()[5])
 
 
 def get_area(*files):
+    """The area of the last frame of .xvg files of gmx sasa. Stops at a file
+    without data.
+    """
     for f in files:
         with open(f, 'r') as arealog:
-            unparsed = arealog.readlines()
-            area = unparsed[-1].split()[1]
+            unparsed = [l for l in arealog.readlines()
+                if l.strip() and l[0] not in '#@']
+
+            if len(unparsed) == 0:
+                return
+
+#            With an output group (localized mode) its area is the last column.
+            area = unparsed[-1].split()[-1]
 
             yield float(area)
 
@@ -47,15 +74,317 @@ def get_area(*files):
 def log(fname, proc_obj):
     """Write stdout and stderr of a process object to a file.
     """
-    log_file = open(fname, 'a')
+    with open(fname, 'ab') as log_file:
+
+        for out in (proc_obj.stdout, proc_obj.stderr):
+
+            if isinstance(out, bytes):
+                log_file.write(out)
+
+
+TAIL = 4096 # bytes of stderr kept in memory for error messages
+BACKOFF = 5 # seconds before the first retry of a failed program, doubling
+
+
+class ToolError(Exception):
+    """An external program failed, timed out or did not write its output.
+    reason is a one line summary for the failure report, tail the end of
+    its stderr.
+    """
+    def __init__(self, reason, tail=b''):
+        super().__init__(reason)
+        self.reason = reason
+        self.tail = tail.decode('utf-8', 'replace') if tail else ''
+
+
+    def __str__(self):
+        return "\n".join([self.reason, self.tail]).strip()
+
+
+#    Exceptions which quarantine a task instead of stopping the run. Expected
+#    failures, like unreadable output of a program, are raised as ToolError,
+#    everything else is a bug and stops the run.
+FAILURES = (ToolError, OSError, subprocess.TimeoutExpired)
+
+
+def pipes(verbosity=0, logs=False):
+    """Where the output of the external programs goes. With verbosity 1 it is
+    shown in the terminal. With verbosity 0 stdout is discarded by the OS, or
+    appended to tools.log in the working directory of the task if logs is
+    set, and stderr is streamed through run, which only keeps its tail.
+    """
+    if verbosity == 0:
+        return {
+            'stdout': 'tools.log' if logs else subprocess.DEVNULL,
+            'stderr': subprocess.PIPE,
+            'log': 'tools.log' if logs else None
+        }
+
+    elif verbosity == 1:
+        return {
+            'stdout': None,
+            'stderr': None
+        }
+
+    else:
+        raise ValueError
+
+
+def run(args, input=None, stdout=None, stderr=None, log=None, tail=TAIL,
+    timeout=None, **kwargs):
+    """Run a program like subprocess.run, without holding its output in
+    memory. A file name as stdout, stderr or log is opened for appending.
+    stdout=subprocess.PIPE is not supported, programs whose output is parsed
+    write it to a file instead. With stderr=subprocess.PIPE, stderr is read
+    in chunks, copied to log and only its last tail bytes are kept as the
+    stderr of the returned process object, for error messages.
+    A program running longer than timeout seconds is killed and
+    subprocess.TimeoutExpired is raised.
+    """
+    if stdout == subprocess.PIPE:
+        raise ValueError("stdout of %s has to go to a file" % args[0])
+
+    files = {}
+
+    def handle(f):
+        if isinstance(f, str):
+
+            if f not in files:
+                files[f] = open(f, 'ab')
+
+            return files[f]
+
+        return f
+
+    try:
+        proc = subprocess.Popen(
+            args,
+            stdin=None if input is None else subprocess.PIPE,
+            stdout=handle(stdout),
+            stderr=handle(stderr),
+            **kwargs
+        )
+
+        expired = threading.Event()
+
+        def kill():
+            expired.set()
+            proc.kill()
+
+        timer = threading.Timer(timeout, kill) if timeout else None
+
+        if timer is not None:
+            timer.start()
+
+        if input is not None:
+
+            try:
+                proc.stdin.write(input)
+                proc.stdin.close()
+
+            except BrokenPipeError:
+                pass
+
+        err = None
+
+        if proc.stderr is not None:
+            sink = handle(log)
+            err = b''
+
+            for chunk in iter(lambda: proc.stderr.read1(65536), b''):
+
+                if sink is not None:
+                    sink.write(chunk)
+
+                err = (err + chunk)[-tail:]
+
+            proc.stderr.close()
+
+        proc.wait()
+
+        if timer is not None:
+            timer.cancel()
+
+    finally:
+
+        for f in files.values():
+            f.close()
+
+    if expired.is_set():
+        raise subprocess.TimeoutExpired(args, timeout, stderr=err)
+
+    return subprocess.CompletedProcess(args, proc.returncode, None, err)
+
+
+def execute(args, name=None, retries=0, backoff=BACKOFF, timeouts=None,
+    outputs=(), check=True, **kwargs):
+    """Run a program through run and make sure it worked: it has to finish
+    within its timeout (timeouts maps program names to seconds), exit with 0
+    and write all files in outputs. Failed attempts are retried up to retries
+    times, waiting backoff seconds before the first retry and twice as long
+    before each next one. Old outputs are removed before each attempt.
+    Raises ToolError if the last attempt failed.
+    """
+    name = os.path.basename(args[0]) if name is None else name
+    timeout = (timeouts or {}).get(name)
+
+    for attempt in range(retries + 1):
+
+        if attempt > 0:
+            time.sleep(backoff * 2**(attempt-1))
+
+        for o in outputs:
+
+            if os.path.exists(o):
+                os.remove(o)
+
+        try:
+            proc = run(args, timeout=timeout, **kwargs)
+
+        except subprocess.TimeoutExpired as e:
+            error = ToolError(
+                "%s timed out after %g s" % (name, timeout), e.stderr
+            )
+            continue
+
+        if check and proc.returncode != 0:
+            error = ToolError(
+                "%s exited with %d" % (name, proc.returncode), proc.stderr
+            )
+            continue
+
+        missing = [o for o in outputs
+            if not os.path.exists(o) or os.path.getsize(o) == 0]
+
+        if len(missing) > 0:
+            error = ToolError(
+                "%s did not write %s" % (name, ", ".join(missing)), proc.stderr
+            )
+            continue
+
+        return proc
+
+    raise error
+
+
+def timeouts(flags):
+    """Timeouts in seconds per program from the optional [timeouts] section
+    of the flags file, e.g. mdrun=3600. The section is removed from flags.
+    """
+    t = flags.pop('timeouts', [])
+    found = {}
+
+    for prog, seconds in zip(t[::2], t[1::2] + [None]):
+
+        try:
+            found[prog] = float(seconds)
+
+        except (TypeError, ValueError):
+            raise ValueError("Entries of [timeouts] in the flags file have "
+                "to be program=seconds, e.g. mdrun=3600, not: %s" \
+                % " ".join(t)) from None
+
+    return found
+
+
+#    Table of mdrun for the user functions of min.mdp, see ccpbsa-setup.
+TABLE = os.path.dirname(os.path.abspath(__file__)) \
+    + '/parameters/table4r-6-12.xvg'
+
+TIMINGS = 'timings.csv' # durations of the tasks of a run, in its main directory
+
+
+def record_timing(fname, stage, atoms, members, seconds, failed=False):
+    """Append the duration of a task to a timings file, with the number of
+    heavy atoms and the ensemble size. Lines are short enough to be appended
+    atomically by concurrent workers.
+    """
+    with open(fname, 'a') as timings:
+        timings.write("%s,%d,%d,%.3f,%d\n" % (
+            stage, atoms, members, seconds, failed
+        ))
+
+
+def heavy_atoms(pdb):
+    """Number of heavy atoms in a .pdb file, 0 if it does not exist.
+    """
+    if not os.path.exists(pdb):
+        return 0
+
+    return len(read_pdb(pdb)[0])
+
+
+def quarantine(d, error):
+    """Mark the directory d as failed, so it is skipped by the following
+    stages and reported as NaN with the reason. The first line of d/FAILED is
+    the reason, the rest the end of the error output.
+    """
+    if not os.path.isdir(d):
+        return
+
+    with open(d + '/FAILED', 'a') as failed:
+        failed.write(str(error).strip() + "\n")
+
+
+def failure(d):
+    """Reason why the directory d was quarantined, or None if it was not.
+    """
+    if not os.path.isdir(d):
+        return "not generated"
+
+    if not os.path.exists(d + '/FAILED'):
+        return None
+
+    with open(d + '/FAILED', 'r') as failed:
+        return failed.readline().strip()
+
+
+def first(parser, *files, default=(np.nan, np.nan), **kwargs):
+    """First value of one of the log parsers (get_edr_lj, get_electro,
+    get_area).
+    Missing files and files without the values give default instead of an
+    exception, so a failed member ends up as NaN in the tables. Files that
+    have the values in a form the parser does not understand raise.
+    """
+    try:
+        return next(parser(*files, **kwargs))
+
+    except (OSError, StopIteration):
+        return default
+
+
+def average(x, w):
+    """Mean of the values x with the weights w, leaving out missing values.
+    """
+    x = np.atleast_1d(np.asarray(x, dtype=float))
+    w = np.atleast_1d(np.asarray(w, dtype=float)) * ~np.isnan(x)
+
+    if w.sum() == 0:
+        return np.nan
+
+    return np.nansum(w * x) / w.sum()
+
+
+def pairwise(G, i, ref, c, w=None):
+    """Mean and standard error of the differences in column c of G between
+    the members of i and the members of ref with the same number, i.e. of
+    pairs of a mutant and the wildtype structure it was made from. Pairs
+    with a missing value are left out. With the weights w of the members of
+    ref, the mean is weighted and the error uses the effective number of
+    pairs.
+    """
+    diff = (G.loc[i, c] - G.loc[ref, c]).dropna()
 
-    if hasattr(proc_obj.stdout, 'decode'):
-        log_file.write(proc_obj.stdout.decode('utf-8'))
+    if len(diff) < 2:
+        return diff.mean(), np.nan
 
-    if hasattr(proc_obj.stderr, 'decode'):
-        log_file.write(proc_obj.stderr.decode('utf-8'))
+    w = pd.Series(1.0, index=diff.index) if w is None \
+        else w.loc[ref].loc[diff.index].astype(float)
+    mean = (w * diff).sum() / w.sum()
+    n = w.sum()**2 / (w**2).sum()
+    var = (w * (diff - mean)**2).sum() / w.sum() * n / (n - 1)
 
-    log_file.close()
+    return mean, np.sqrt(var / n)
 
 
 def int_in_str(*strings):
@@ -134,23 +463,30 @@ def parse_mutations(file_):
         - new amino acid (Mutation)
     Each new protein stores the information in a new row.
     Multiple mutations extend into the third dimension.
+    Without a file (or mutations in it) the DataFrame is empty.
     """
     aa1 = list("ACDEFGHIKLMNPQRSTVWY")
     aa3 = "ALA CYS ASP GLU PHE GLY HIS ILE LYS LEU \
             MET ASN PRO GLN ARG SER THR VAL TRP TYR".split()
     aa123 = dict(zip(aa1,aa3))
-    raw = open(file_, 'r').readlines()
+    raw = open(file_, 'r').readlines() if file_ is not None else []
     raw = [i for i in raw if i != '\n']
 
+#    Index definition for the DataFrame.
+    headers = ["Chain", "AA", "Residue", "Mutation"]
+
+    if len(raw) == 0:
+        return pd.DataFrame(
+            columns=headers,
+            index=pd.MultiIndex.from_arrays([[]])
+        )
+
 #    Remove whitespaces and empty lines
     raw = [i.replace(" ", "") for i in raw]
     raw = [i[:-1].split(",") for i in raw]
     maxmuts = max([len(i) for i in raw])
     muts = [tuple(i + [""] * (maxmuts - len(i))) for i in raw]
 
-#    Index definition for the DataFrame.
-    headers = ["Chain", "AA", "Residue", "Mutation"]
-
     mut_df = pd.DataFrame(
         columns=headers,
         index=pd.MultiIndex.from_tuples(muts)
@@ -184,16 +520,19 @@ def concoord(pipe, input_, *pdb, **flags):
     """Takes arbitrarily many .pdb files as input to generate structure
     ensembles using CONCOORD. Additional flags can be passed via a dictionary
     with the keys corresponding to the programs, i.e. \"dist\" and \"disco\".
-    Verbosity can be controlled via the keyword \"verbosity\" which takes
-    either 0 (do not show any messages) or 1 (show all messages).
-    Returns the two process objects of dist and disco.
+    Where the output of the programs goes and how they are checked is set by
+    pipe, a dictionary of keyword arguments for execute.
+    Returns the process objects of dist and disco of each structure.
     """
+    procs = []
+    here = os.getcwd()
+
     for p in pdb:
-        os.chdir("/".join([i for i in p.split("/")[:-1]]+["."]))
+        os.chdir(os.path.dirname(p) or '.')
         
         dist_input = [
             'dist',
-            '-p', p,
+            '-p', os.path.basename(p),
         ]
         if 'dist' in flags.keys():
             dist_input.extend(flags['dist'])
@@ -204,22 +543,45 @@ def concoord(pipe, input_, *pdb, **flags):
         if 'disco' in flags.keys():
             disco_input.extend(flags['disco'])
         
-        dist = subprocess.run(
-            dist_input,
-            input=input_,
-            stdout=pipe,
-            stderr=pipe
-        )
-        disco =subprocess.run(disco_input, stdout=pipe, stderr=pipe)
+        try:
+            dist = execute(dist_input, input=input_, **pipe)
+            disco = execute(disco_input, **pipe)
+
+        finally:
+            os.chdir(here)
+
+        procs.append((dist, disco))
+
+    return procs
+
+
+DISCO_SEED = '-s' # flag of disco for the seed of its random number generator
+
+
+def set_flags(flags, **values):
+    """Copy of a list of command line flags with the values of some flags
+    replaced or added. Keys are the flags without the leading dash.
+    """
+    flags = list(flags)
+
+    for k, v in values.items():
+        k = '-' + k
 
-        return dist, disco
+        if k in flags:
+            flags[flags.index(k)+1] = v
+
+        else:
+            flags.extend([k, v])
+
+    return flags
 
 
 def gmx(prog, **kwargs):
     """Run a GROMACS program with its flags by passing them in a list object.
-    kwargs are passed to the subprocess.run method.
+    kwargs are passed to execute, which raises ToolError if the program
+    fails.
     """
-    gmx = subprocess.run(['gmx', '-quiet'] + prog, **kwargs)
+    gmx = execute(['gmx', '-quiet'] + prog, name=prog[0], **kwargs)
 
     return gmx
  
@@ -274,206 +636,1274 @@ def filecheck(*strs):
         os.chdir(start)
 
 
-class DataGenerator:
-    """Main class to make CC/PBSA work. Creates a directory with the name of
-    the wildtype (wt) protein and subdirectories for each structure ensemble.
+def read_gro(fname):
+    """Read a .gro file. Returns the title, a list of the atom records
+    (residue number, residue name, atom name), the coordinates as a numpy
+    array in nm and the box vectors.
     """
-    def __init__(
-        self,
-        wtpdb, # wild type .pdb file
-        mutlist, # list of mutations
-        flags, # file specifying the flags for CONCOORD and GROMACS
-        spmdp,
-        verbosity=0,
-        dummy=False
-    ):
-        if verbosity == 0:
-            self.pipe = {
-                'stdout': subprocess.PIPE,
-                'stderr': subprocess.PIPE
-            }
-
-        elif verbosity == 1:
-            self.pipe = {
-                'stdout': None,
-                'stderr': None
-            }
+    with open(fname, 'r') as gro:
+        title = gro.readline().rstrip('\n')
+        natoms = int(gro.readline())
+        lines = [gro.readline() for i in range(natoms)]
+        box = np.array(gro.readline().split(), dtype=float)
 
-        else:
-            raise ValueError
+    atoms = [(int(l[:5]), l[5:10].strip(), l[10:15].strip()) for l in lines]
+    xyz = np.array(
+        [(l[20:28], l[28:36], l[36:44]) for l in lines],
+        dtype=float
+    ).reshape(-1, 3)
 
-        self.wtpdb = os.getcwd() + "/" + wtpdb
-        wtname = wtpdb.split('/')[-1]
-        self.wt = wtname[:wtname.find(".pdb")]
-        self.flags, self.input = parse_flags(flags)
-        self.n = len(self)
-        self.flags.setdefault("disco", []).extend(["-op", ""])
-        self.mut_df = parse_mutations(mutlist)
-        self.wds = [self.wt]
-        self.wds.extend(["+".join([j for j in i if len(j) > 0]) \
-            for i in self.mut_df.index])
+    return title, atoms, xyz, box
 
-        cmd.load(self.wtpdb)
-        self.chains = cmd.get_chains()
-        cmd.reinitialize()
 
-        if not dummy:
-            self.initdir(spmdp)
-            self.do_mutate()
+def write_gro(fname, title, atoms, xyz, box):
+    """Write a .gro file from the atom records and coordinates as returned by
+    read_gro.
+    """
+    with open(fname, 'w') as gro:
+        gro.write(title + '\n')
+        gro.write('%5d\n' % len(atoms))
 
-        else:
-            self.maindir = os.getcwd() + '/' + self.wt
+        for n, (a, x) in enumerate(zip(atoms, xyz)):
+            gro.write('%5d%-5s%5s%5d%8.3f%8.3f%8.3f\n' % (
+                a[0] % 100000, a[1], a[2], (n+1) % 100000, x[0], x[1], x[2]
+            ))
 
-        self.spmdp = self.maindir + "/" + spmdp.split("/")[-1]
+        gro.write(' '.join('%10.5f' % b for b in box) + '\n')
 
 
-    def initdir(self, spmdp):
-        """Creates the directory and filesystem for the structures, called
-        automatically by __init__ if not surpressed.
-        """
-#        Create the directory for data generation.
-        try:
-            os.mkdir(self.wt)
-            os.chdir(self.wt)
+def read_pdb(fname):
+    """Read the heavy atoms of a .pdb file. Returns a list of the atom
+    records (chain, residue number, residue name, atom name) and the
+    coordinates as a numpy array in nm.
+    """
+    atoms = []
+    xyz = []
 
-        except FileExistsError:
-            newdir = input("Directory already exists. Enter a new name:\n")
-            os.mkdir(newdir)
-            os.chdir(newdir)
+    with open(fname, 'r') as pdb:
 
-        self.maindir = os.getcwd()
-        os.mkdir(self.wt)
-        shutil.copy(self.wtpdb, self.wt)
+        for l in pdb:
 
-        for k, v in self.flags.items():
-            files = list(i for i in filecheck(*v))
+            if l[:6] not in ('ATOM  ', 'HETATM'):
+                continue
 
-            for ori, abs_ in files:
-                shutil.copy(abs_, self.maindir)
-                v[v.index(ori)] = self.maindir+"/"+abs_.split("/")[-1]
-                self.flags[k] = v
+            name = l[12:16].strip()
+            element = l[76:78].strip()
 
-#        Copy all parameter files into the main directory. And update new file
-#        locations.
-        os.chdir('..')
+            if element == 'H' or (not element and name.lstrip('0123456789')[0] == 'H'):
+                continue
 
-        shutil.copy(spmdp, self.maindir)
+            atoms.append((l[21], l[22:27].strip(), l[17:20].strip(), name))
+            xyz.append((l[30:38], l[38:46], l[46:54]))
 
-        os.chdir(self.maindir)
+    return atoms, np.array(xyz, dtype=float).reshape(-1, 3) / 10
 
 
-    def __len__(self):
-        """Returns the number of structures that should be generated by
-        CONCOORD.
-        """
-        try:
-            n_idx = self.flags['disco'].index('-n')
-            return int(self.flags['disco'][n_idx+1])
+def split_pdb(pdb, chains, out):
+    """Write the atoms of a .pdb file that belong to any of the chains (a
+    string of chain identifiers) into a new .pdb file.
+    """
+    with open(pdb, 'r') as full, open(out, 'w') as part:
 
-        except ValueError:
-            return 300
+        for l in full:
 
+            if l[:6] in ('ATOM  ', 'HETATM', 'TER   ', 'ANISOU') \
+                or l.startswith('TER'):
 
-    def do_mutate(self):
-        """Create directories for each mutation and save the .pdb file in
-        there. Requires the mut_df attribute.
-        """
-        for i in range(len(self.mut_df.index)):
-            cmd.load(self.wtpdb)
-            cmd.wizard('mutagenesis')
+                if len(l) > 21 and l[21] in chains:
+                    part.write(l)
 
-            for j in range(len(self.mut_df["Residue"][i])):
-                cmd.get_wizard().do_select('///%s/%s' % (
-                    self.mut_df["Chain"][i][j],
-                    self.mut_df["Residue"][i][j],
-                ))
-                cmd.get_wizard().set_mode(self.mut_df["Mutation"][i][j])
-                cmd.get_wizard().apply()
+            elif l[:6] in ('CRYST1', 'MODEL ', 'ENDMDL'):
+                part.write(l)
 
-            os.mkdir(self.wds[i+1])
-            cmd.save(self.wds[i+1] + "/" + self.wds[i+1] + ".pdb")
-            cmd.reinitialize()
+        part.write('END\n')
 
 
-    def do_concoord(self, d):
-        """Goes into the directories listed in self.wds and generates
-        structure ensembles using CONCOORD. Each generated structure has its on
-        directory one level down the directoy tree. Updates self.wds with the
-        new structures
-        """
-        pdb = d.split("/")[-1] + ".pdb"
-        concoord(self.pipe['stdout'], self.input['dist'], pdb, **self.flags)
+def topology_key(pdb, *args):
+    """Hash the heavy atoms of a .pdb file together with the flags passed to
+    pdb2gmx. Structures sharing the key share the same topology.
+    """
+    atoms, _ = read_pdb(pdb)
+    key = hashlib.sha1(repr(atoms).encode('utf-8'))
 
-        for i in range(1, len(self)+1):
-            os.mkdir(str(i))
-            shutil.move(str(i) + '.pdb', str(i))
+    for a in args:
+        key.update(repr(a).encode('utf-8'))
 
+    return key.hexdigest()
 
-    def do_minimization(self, d):
-        """Do energy minimization on the structures in self.wds. If the
-        affinity is to be calculated, then an index file for the chains will be
-        made and the chains specified in self.chains are minimized.
-        """
-        pdb = d.split("/")[-1] + ".pdb"
-        gmx(
-            ['pdb2gmx'] + self.flags['pdb2gmx'] + ['-f', pdb],
-            **self.pipe,
-            input=self.input['pdb2gmx']
-        )
-        gmx(
-            ['editconf'] + self.flags['editconf'],
-            **self.pipe,
-            input=self.input['editconf']
-        )
-        gmx(
-            ['grompp'] + self.flags['grompp'] + ['-c', 'out.gro'],
-            **self.pipe,
-            input=self.input['grompp']
-        )
-        gmx(
-            ['mdrun'] + self.flags['mdrun'],
-            **self.pipe,
-            input=self.input['mdrun']
-        )
 
+def stale(d, wait):
+    """Whether the cache directory d, which has no done file, was left by a
+    process that is gone: the one named in d/owner is no longer running on
+    this host, or, for other hosts and a missing owner, d is older than wait
+    seconds.
+    """
+    try:
 
-    def update_structs(self):
-        """Use gro2pdb to convert (minimized) confout.gro files into .pdb files
-        with the same name as the directory.
-        """
-        for d in self.wds:
-            os.chdir(d)
-            pdb = d.split("/")[-1] + ".pdb"
-            gro2pdb(
-                'confout.gro',
-                'topol.tpr',
-                pdb,
-                **self.pipe,
-                input=b'0'
-            )
-#            Remove hydrogens for CONCOORD.
-            cmd.load(pdb)
-            cmd.remove('hydrogens')
-            cmd.save(pdb)
-            cmd.reinitialize()
+        with open(d + '/owner', 'r') as owner:
+            host, pid = owner.read().split()
 
-            os.chdir(self.maindir)
+        if host == socket.gethostname():
 
+            try:
+                os.kill(int(pid), 0)
 
-    def single_point(self):
-        """Creates a single point .tpr file.
-        """
-        gromppflags = self.flags['grompp'].copy()
-        idx = gromppflags.index('-f')
-        gromppflags.pop(idx)
-        gromppflags.pop(idx)
-        gmx(
-            [
-                'grompp', '-f', self.spmdp,
-                '-c', 'confout.gro',
+            except ProcessLookupError:
+                return True
+
+            except PermissionError:
+                pass
+
+            return False
+
+        return time.time() - os.path.getmtime(d + '/owner') > wait
+
+    except (OSError, ValueError):
+
+        try:
+            return time.time() - os.path.getmtime(d) > wait
+
+        except OSError:
+            return False
+
+
+def editconf(xyz, flags):
+    """Reproduce the box and centering options of gmx editconf (-bt, -d,
+    -box, -c) without launching it. Returns the coordinates and the box.
+    Raises a ValueError for any other flag so the caller can fall back to
+    GROMACS.
+    """
+    flags = list(flags)
+    bt = 'triclinic'
+    dist = None
+    box = None
+    center = False
+
+    while flags:
+        f = flags.pop(0)
+
+        if f == '-bt':
+            bt = flags.pop(0)
+
+        elif f == '-d':
+            dist = float(flags.pop(0))
+
+        elif f == '-box':
+            box = [float(flags.pop(0))]
+
+            while flags and not flags[0].startswith('-'):
+                box.append(float(flags.pop(0)))
+
+        elif f == '-c':
+            center = True
+
+        else:
+            raise ValueError("editconf flag %s is not supported" % f)
+
+    if bt not in ('cubic', 'triclinic'):
+        raise ValueError("editconf box type %s is not supported" % bt)
+
+    if dist is not None:
+
+        if bt == 'cubic':
+#            Diameter of the system, like GROMACS does for cubic boxes.
+            diam = 0.0
+
+            for i in range(0, len(xyz), 1024):
+                d = xyz[i:i+1024, None, :] - xyz[None, :, :]
+                diam = max(diam, np.sqrt((d**2).sum(axis=2).max()))
+
+            box = [diam + 2*dist] * 3
+
+        else:
+            box = list(xyz.max(axis=0) - xyz.min(axis=0) + 2*dist)
+
+        center = True
+
+    elif box is None:
+        box = list(xyz.max(axis=0) - xyz.min(axis=0))
+
+    box = np.array(box * 3 if len(box) == 1 else box, dtype=float)
+
+    if center:
+        xyz = xyz - xyz.mean(axis=0) + box/2
+
+    return xyz, box
+
+
+def frames(a, b, c):
+    """Orthonormal frames spanned by the atom positions a, b and c (arrays of
+    shape (n, 3)). Returns an array of shape (n, 3, 3) with the axes as rows.
+    """
+    e1 = b - a
+    e1 /= np.linalg.norm(e1, axis=1)[:, None]
+    e2 = c - a
+    e2 -= (e2*e1).sum(axis=1)[:, None] * e1
+    e2 /= np.linalg.norm(e2, axis=1)[:, None]
+    e3 = np.cross(e1, e2)
+
+    return np.stack([e1, e2, e3], axis=1)
+
+
+def make_template(pdb, gro, fname):
+    """Relate the heavy atoms of a .pdb file to the atoms of the .gro file
+    pdb2gmx made out of it and save the result to a .npz file. Atoms added by
+    pdb2gmx are stored relative to a frame of three bonded heavy atoms, so
+    they can be rebuilt on other conformations of the same structure.
+    Returns False if the structures can not be related.
+    """
+    _, pdbxyz = read_pdb(pdb)
+    title, atoms, xyz, box = read_gro(gro)
+
+#    Heavy atom coordinates are copied by pdb2gmx, so they are matched on
+#    the 0.001 nm grid of the .gro file.
+    lookup = dict(
+        (tuple(k), n) for n, k in enumerate(np.rint(pdbxyz*1000).astype(int))
+    )
+    shifts = [(i, j, k) for i in (0, -1, 1) for j in (0, -1, 1) \
+        for k in (0, -1, 1)]
+    perm = np.full(len(atoms), -1)
+
+    for n, k in enumerate(np.rint(xyz*1000).astype(int)):
+
+        for s in shifts:
+            idx = lookup.get((k[0]+s[0], k[1]+s[1], k[2]+s[2]))
+
+            if idx is not None:
+                perm[n] = idx
+                break
+
+    heavy = np.where(perm >= 0)[0]
+
+    if len(set(perm[heavy])) != len(heavy) or len(heavy) != len(pdbxyz):
+        return False
+
+#    Sequential residue index, since residue numbers repeat between chains.
+    resid = np.cumsum([0] + [
+        int(atoms[i][:2] != atoms[i-1][:2]) for i in range(1, len(atoms))
+    ])
+
+    def neighbours(i, exclude=()):
+        cand = heavy[np.abs(resid[heavy] - resid[i]) <= 1]
+        cand = np.array([j for j in cand if j != i and j not in exclude])
+
+        if len(cand) == 0:
+            return cand
+
+        d = np.linalg.norm(xyz[cand] - xyz[i], axis=1)
+
+        return cand[np.argsort(d)][np.sort(d) < 0.2]
+
+    hydrogens = np.where(perm < 0)[0]
+    refs = np.zeros((len(hydrogens), 3), dtype=int)
+
+    for n, h in enumerate(hydrogens):
+        cand = heavy[resid[heavy] == resid[h]]
+        p = cand[np.argmin(np.linalg.norm(xyz[cand] - xyz[h], axis=1))]
+        nb = neighbours(p)
+
+        if len(nb) >= 2:
+            refs[n] = p, nb[0], nb[1]
+
+        elif len(nb) == 1 and len(neighbours(nb[0], exclude=(p,))) > 0:
+            refs[n] = p, nb[0], neighbours(nb[0], exclude=(p,))[0]
+
+        else:
+            return False
+
+    axes = frames(xyz[refs[:, 0]], xyz[refs[:, 1]], xyz[refs[:, 2]])
+    local = np.einsum('nij,nj->ni', axes, xyz[hydrogens] - xyz[refs[:, 0]])
+
+    np.savez(
+        fname,
+        perm=perm,
+        hydrogens=hydrogens,
+        refs=refs,
+        local=local,
+        resnr=np.array([a[0] for a in atoms]),
+        resname=np.array([a[1] for a in atoms]),
+        name=np.array([a[2] for a in atoms]),
+        title=np.array(title)
+    )
+
+    return True
+
+
+_templates = {}
+_solvers = {}
+_forcefields = {}
+
+def rebuild(template, pdb):
+    """The full coordinates of a .pdb file from a template made by
+    make_template, in the order of the .gro file. Returns None if the .pdb
+    file does not fit the template.
+    """
+    if template not in _templates:
+        _templates[template] = dict(np.load(template))
+
+    t = _templates[template]
+    _, pdbxyz = read_pdb(pdb)
+    heavy = t['perm'] >= 0
+
+    if len(pdbxyz) != heavy.sum():
+        return None
+
+    xyz = np.zeros((len(t['perm']), 3))
+    xyz[heavy] = pdbxyz[t['perm'][heavy]]
+    refs = t['refs']
+    axes = frames(xyz[refs[:, 0]], xyz[refs[:, 1]], xyz[refs[:, 2]])
+    xyz[t['hydrogens']] = xyz[refs[:, 0]] \
+        + np.einsum('nij,ni->nj', axes, t['local'])
+
+    return xyz
+
+
+def from_template(template, pdb, gro, editconf_flags):
+    """Build the full coordinates of a .pdb file from a template made by
+    make_template, set the box as editconf would and write them to a .gro
+    file. Returns False if the .pdb file does not fit the template.
+    """
+    xyz = rebuild(template, pdb)
+
+    if xyz is None:
+        return False
+
+    try:
+        xyz, box = editconf(xyz, editconf_flags)
+
+    except ValueError:
+        return False
+
+    t = _templates[template]
+    atoms = list(zip(t['resnr'], t['resname'], t['name']))
+    write_gro(gro, str(t['title']), atoms, xyz, box)
+
+    return True
+
+
+def residues(atoms):
+    """Returns the residues in order of appearance, given atom records which
+    start with (chain, residue number).
+    """
+    seen = []
+
+    for a in atoms:
+
+        if len(seen) == 0 or seen[-1] != a[:2]:
+            seen.append(a[:2])
+
+    return seen
+
+
+def residue_index(groatoms):
+    """Index of the residue of each atom record of a .gro file, counting
+    from 0 in order of appearance.
+    """
+    return np.cumsum([0] + [int(groatoms[i][:2] != groatoms[i-1][:2]) \
+        for i in range(1, len(groatoms))])
+
+
+def neighbourhood(pdb, sites, radius):
+    """Find the residues of a .pdb file with any heavy atom within radius
+    (nm) of the residues listed in sites as (chain, residue number). An empty
+    chain matches all chains. Returns a set of (chain, residue number).
+    """
+    atoms, xyz = read_pdb(pdb)
+    index = SpatialIndex(xyz, atoms)
+    site = index.select(residues=sites)
+
+    return index.residues_of(index.within(xyz[site], radius))
+
+
+def write_index(pdb, gro, groups, fname):
+    """Write a GROMACS index file for the .gro file that was made from pdb.
+    groups is a list of group names and functions, which decide for each
+    (chain, residue number) whether the residue belongs to the group. A
+    System group with all atoms comes first. Residues are related by their
+    order, since .gro files have no chains.
+    Returns a dictionary of boolean atom masks of the groups.
+    """
+    atoms, _ = read_pdb(pdb)
+    res = residues(atoms)
+    _, groatoms, _, _ = read_gro(gro)
+    resid = residue_index(groatoms)
+
+    if resid[-1] + 1 != len(res):
+        raise Exception("Residues of %s and %s do not match" % (pdb, gro))
+
+    masks = {'System': np.ones(len(groatoms), dtype=bool)}
+
+    for name, member in groups:
+        inres = np.array([member(r) for r in res])
+        masks[name] = inres[resid]
+
+    with open(fname, 'w') as ndx:
+
+        for name, mask in masks.items():
+            idx = np.where(mask)[0] + 1
+            ndx.write('[ %s ]\n' % name)
+
+            for i in range(0, len(idx), 15):
+                ndx.write(' '.join(str(j) for j in idx[i:i+15]) + '\n')
+
+    return masks
+
+
+def write_local_index(pdb, gro, region, fname):
+    """Write the index file of the localized mode, with the groups System,
+    Local (residues in region) and Frozen (the rest).
+    """
+    masks = write_index(pdb, gro, [
+        ('Local', lambda r: r in region),
+        ('Frozen', lambda r: r not in region),
+    ], fname)
+
+    return masks['Local']
+
+
+def read_index(fname):
+    """Read a GROMACS index file into a dictionary of group names and numpy
+    arrays of (0 based) atom indices.
+    """
+    groups = {}
+
+    with open(fname, 'r') as ndx:
+
+        for l in ndx:
+            l = l.strip()
+
+            if l.startswith('['):
+                name = l[1:-1].strip()
+                groups[name] = []
+
+            elif l:
+                groups[name].extend(int(i) - 1 for i in l.split())
+
+    return dict((k, np.array(v, dtype=int)) for k, v in groups.items())
+
+
+class DataGenerator:
+    """Main class to make CC/PBSA work. Creates a directory with the name of
+    the wildtype (wt) protein and subdirectories for each structure ensemble.
+    """
+    def __init__(
+        self,
+        wtpdb, # wild type .pdb file
+        mutlist, # list of mutations
+        flags, # file specifying the flags for CONCOORD and GROMACS
+        spmdp,
+        verbosity=0,
+        dummy=False,
+        pb='gropbe',
+        local=None,
+        logs=False,
+        retries=0,
+        disco_split=1,
+        paired=False,
+        rmsd_cutoff=None,
+        minimizer='mdrun'
+    ):
+        self.pipe = pipes(verbosity, logs)
+        self.disco_split = disco_split
+        self.paired = paired
+        self.rmsd_cutoff = rmsd_cutoff
+        self.minimizer = minimizer
+
+        self.wtpdb = os.getcwd() + "/" + wtpdb
+        wtname = wtpdb.split('/')[-1]
+        self.wt = wtname[:wtname.find(".pdb")]
+        self.flags, self.input = parse_flags(flags)
+        self.pipe.update(timeouts=timeouts(self.flags), retries=retries)
+        self.pb = pb
+        self.n = len(self)
+        self.flags.setdefault("disco", []).extend(["-op", ""])
+        self.mut_df = parse_mutations(mutlist)
+        self.wds = [self.wt]
+        self.wds.extend(["+".join([j for j in i if len(j) > 0]) \
+            for i in self.mut_df.index])
+        self.rows = dict((v, i) for i, v in enumerate(self.wds[1:]))
+
+        cmd.load(self.wtpdb)
+        self.chains = cmd.get_chains()
+        cmd.reinitialize()
+
+        if not dummy:
+            self.initdir(spmdp)
+            self.do_mutate()
+
+        else:
+            self.maindir = os.getcwd() + '/' + self.wt
+
+        self.topologies = self.maindir + '/.topologies'
+        self.spmdp = self.maindir + "/" + spmdp.split("/")[-1]
+        self.local = local
+
+        if local is not None:
+            self.localize(dummy)
+
+
+    def localize(self, dummy=False):
+        """Prepare the localized mode: the residues within self.local nm of
+        any mutated residue of the wildtype form the Local group, which is the
+        only one that moves during minimization and the only one whose
+        energies are evaluated. The same residues are used for all structures,
+        so wildtype and mutants stay comparable. Writes the region to
+        region.txt and .mdp files that freeze and exclude the rest.
+        """
+        sites = set()
+
+        for i in range(len(self.mut_df.index)):
+
+            for j in range(len(self.mut_df["Residue"][i])):
+
+                if len(self.mut_df["Residue"][i][j]) > 0:
+                    sites.add((
+                        self.mut_df["Chain"][i][j],
+                        self.mut_df["Residue"][i][j]
+                    ))
+
+        self.region = neighbourhood(self.wtpdb, sites, self.local)
+        minmdp = self.flags['grompp'][self.flags['grompp'].index('-f')+1]
+        local_mdps = [
+            (minmdp, [
+                'freezegrps = Frozen',
+                'freezedim = Y Y Y',
+                'energygrps = Local Frozen',
+                'energygrp-excl = Frozen Frozen',
+            ]),
+            (self.spmdp, [
+                'energygrps = Local Frozen',
+                'energygrp-excl = Frozen Frozen',
+            ]),
+        ]
+        new = []
+
+        for mdp, extra in local_mdps:
+            local_mdp = self.maindir + '/local_' + mdp.split('/')[-1]
+            new.append(local_mdp)
+
+            if not dummy:
+
+                with open(mdp, 'r') as ori, open(local_mdp, 'w') as out:
+                    out.write(ori.read() + '\n' + '\n'.join(extra) + '\n')
+
+        self.flags['grompp'][self.flags['grompp'].index('-f')+1] = new[0]
+        self.spmdp = new[1]
+
+        if not dummy:
+
+            with open(self.maindir + '/region.txt', 'w') as reg:
+
+                for c, r in sorted(self.region):
+                    reg.write('%s %s\n' % (c, r))
+
+
+    def index(self, pdb, fn):
+        """In localized mode write the index file fn.ndx for fn.gro and return
+        the flags for grompp to use it. Returns no flags otherwise.
+        """
+        if getattr(self, 'local', None) is None:
+            return []
+
+        write_local_index(pdb, fn+'.gro', self.region, fn+'.ndx')
+
+        return ['-n', fn+'.ndx']
+
+
+    def initdir(self, spmdp):
+        """Creates the directory and filesystem for the structures, called
+        automatically by __init__ if not surpressed.
+        """
+#        Create the directory for data generation.
+        try:
+            os.mkdir(self.wt)
+            os.chdir(self.wt)
+
+        except FileExistsError:
+            newdir = input("Directory already exists. Enter a new name:\n")
+            os.mkdir(newdir)
+            os.chdir(newdir)
+
+        self.maindir = os.getcwd()
+        os.mkdir(self.wt)
+        shutil.copy(self.wtpdb, self.wt)
+
+        for k, v in self.flags.items():
+            files = list(i for i in filecheck(*v))
+
+            for ori, abs_ in files:
+                shutil.copy(abs_, self.maindir)
+                v[v.index(ori)] = self.maindir+"/"+abs_.split("/")[-1]
+                self.flags[k] = v
+
+#        Copy all parameter files into the main directory. And update new file
+#        locations.
+        os.chdir('..')
+
+        shutil.copy(spmdp, self.maindir)
+
+        os.chdir(self.maindir)
+
+
+    def __len__(self):
+        """Returns the number of structures that should be generated by
+        CONCOORD.
+        """
+        try:
+            n_idx = self.flags['disco'].index('-n')
+            return int(self.flags['disco'][n_idx+1])
+
+        except ValueError:
+            return 300
+
+
+    def mutate(self, i, pdb, out):
+        """Apply the mutations in row i of mut_df to the structure in pdb and
+        save the mutant to out. Only the mutated side chains are placed.
+        """
+        cmd.load(pdb)
+        cmd.wizard('mutagenesis')
+
+        for j in range(len(self.mut_df["Residue"][i])):
+
+            if len(self.mut_df["Residue"][i][j]) == 0:
+                continue
+
+            cmd.get_wizard().do_select('///%s/%s' % (
+                self.mut_df["Chain"][i][j],
+                self.mut_df["Residue"][i][j],
+            ))
+            cmd.get_wizard().set_mode(self.mut_df["Mutation"][i][j])
+            cmd.get_wizard().apply()
+
+        cmd.save(out)
+        cmd.reinitialize()
+
+
+    def do_mutate(self):
+        """Create directories for each mutation and save the .pdb file in
+        there. Requires the mut_df attribute.
+        """
+        for i in range(len(self.mut_df.index)):
+            os.mkdir(self.wds[i+1])
+            self.mutate(i, self.wtpdb,
+                self.wds[i+1] + "/" + self.wds[i+1] + ".pdb")
+
+
+    def mutate_members(self, d):
+        """Paired mode: make the members of the variant d by mutating the
+        members of the wildtype ensemble, instead of running CONCOORD for it.
+        Member i of d is member i of the wildtype with the mutated side chains
+        placed, so the two can be compared pairwise.
+        The raw CONCOORD members are mutated, not the minimized ones: both
+        members of a pair start from the same CONCOORD structure and are
+        then minimized the same way in the energy stage, and the wildtype
+        members are not minimized twice.
+        """
+        made = 0
+        wt = self.maindir + '/' + self.wt
+
+        for i, _ in cluster_weights(wt, len(self)):
+            member = wt + '/' + str(i)
+
+            if failure(member) is None:
+                os.makedirs(str(i), exist_ok=True)
+                self.mutate(self.rows[d], member + '/%d.pdb' % i,
+                    '%d/%d.pdb' % (i, i))
+                made += 1
+
+        if made == 0:
+            raise ToolError("No wildtype members to mutate")
+
+#        The variant shares the clusters of the wildtype, so the pairs keep
+#        their weights.
+        if os.path.exists(wt + '/' + CLUSTERS):
+            shutil.copy(wt + '/' + CLUSTERS, CLUSTERS)
+
+
+    def do_concoord(self, d):
+        """Goes into the directories listed in self.wds and generates
+        structure ensembles using CONCOORD. Each generated structure has its on
+        directory one level down the directoy tree. If disco produced fewer
+        structures than requested, only these get a directory, the missing
+        ones are reported as not generated.
+        With self.disco_split > 1, disco is split into that many seeded runs
+        over the same dist output, which run concurrently.
+        """
+        pdb = d.split("/")[-1] + ".pdb"
+        k = max(1, min(self.disco_split, len(self)))
+        seeds = self.seeds(pdb, k)
+        sizes = [len(self)//k + (j < len(self) % k) for j in range(k)]
+
+        if k == 1 and seeds[0] is None:
+            concoord(self.pipe, self.input['dist'], pdb, **self.flags)
+
+        elif k == 1:
+            concoord(
+                self.pipe,
+                self.input['dist'],
+                pdb,
+                **dict(self.flags, disco=set_flags(
+                    self.flags['disco'], **{DISCO_SEED[1:]: str(seeds[0])}
+                ))
+            )
+
+        else:
+            execute(
+                ['dist', '-p', pdb] + self.flags.get('dist', []),
+                input=self.input['dist'],
+                **self.pipe
+            )
+            self.disco(seeds, sizes)
+
+        made = [i for i in range(1, len(self)+1)
+            if os.path.exists(str(i) + '.pdb')]
+
+        if k == 1:
+            self.record_seeds(seeds, sizes, [len(made)])
+
+        if len(made) == 0:
+            raise ToolError("disco did not generate any structures")
+
+        for i in made:
+            os.makedirs(str(i), exist_ok=True)
+            shutil.move(str(i) + '.pdb', str(i) + '/' + str(i) + '.pdb')
+
+
+    def seeds(self, pdb, k):
+        """Seeds of k disco runs for a structure. They start from the seed
+        given in the disco flags. Without one, a single run is left to seed
+        itself (the seed is None), while split runs start from a seed derived
+        from the structure, so that they do not give the same structures and
+        the same structure always gives the same ensemble.
+        """
+        flags = self.flags['disco']
+
+        if DISCO_SEED in flags:
+            base = int(flags[flags.index(DISCO_SEED)+1])
+
+        elif k == 1:
+            return [None]
+
+        else:
+            with open(pdb, 'rb') as f:
+                base = int(hashlib.sha1(f.read()).hexdigest()[:7], 16)
+
+        return [base + j for j in range(k)]
+
+
+    def disco(self, seeds, sizes):
+        """Run one disco per seed with the given number of structures, each
+        in its own subdirectory disco_<j> over the dist output of the current
+        directory, concurrently. Their structures are moved back and numbered
+        contiguously from 1, in the order of the runs. A failing run only
+        leaves out its structures.
+        """
+        dist = [f for f in os.listdir('.')
+            if f.startswith('dist') and os.path.isfile(f)]
+
+        def run_disco(j):
+            sub = 'disco_%d' % j
+            os.makedirs(sub, exist_ok=True)
+
+            for f in dist:
+
+                if not os.path.exists(sub + '/' + f):
+                    os.symlink('../' + f, sub + '/' + f)
+
+            flags = set_flags(self.flags['disco'], n=str(sizes[j]), op='',
+                **{DISCO_SEED[1:]: str(seeds[j])})
+
+            try:
+                execute(['disco'] + flags, cwd=sub, **self.pipe)
+
+            except ToolError:
+                pass
+
+            return sub
+
+        with ThreadPoolExecutor(len(seeds)) as threads:
+            subs = list(threads.map(run_disco, range(len(seeds))))
+
+        made = []
+        i = 0
+
+        for j, sub in enumerate(subs):
+            count = 0
+
+            for m in range(1, sizes[j]+1):
+
+                if os.path.exists('%s/%d.pdb' % (sub, m)):
+                    i += 1
+                    count += 1
+                    shutil.move('%s/%d.pdb' % (sub, m), '%d.pdb' % i)
+
+            made.append(count)
+            shutil.rmtree(sub)
+
+        self.record_seeds(seeds, sizes, made)
+
+
+    def record_seeds(self, seeds, sizes, made):
+        """Write the seeds of the disco runs of an ensemble to
+        concoord_seeds.txt, with the structures requested from and made by
+        each run and the members they became. An unseeded run is written
+        with the seed -.
+        """
+        with open('concoord_seeds.txt', 'w') as out:
+            out.write("seed requested made first last\n")
+            first = 1
+
+            for seed, size, m in zip(seeds, sizes, made):
+                out.write("%s %d %d %d %d\n" % ('-' if seed is None else seed,
+                    size, m, first, first + m - 1))
+                first += m
+
+
+    def cluster(self, d):
+        """Cluster the members of the ensemble in d by their RMSD after
+        superposition, with self.rmsd_cutoff (nm) as in gmx cluster -method
+        gromos. Only the center of each cluster is evaluated afterwards,
+        weighted by the size of its cluster. The clusters are saved in
+        clusters.csv.
+        """
+        made = [i for i in range(1, len(self)+1)
+            if os.path.exists('%d/%d.pdb' % (i, i)) and failure(str(i)) is None]
+
+        if len(made) == 0:
+            raise ToolError("No members to cluster")
+
+        try:
+            X = np.stack([read_pdb('%d/%d.pdb' % (i, i))[1] for i in made])
+
+        except ValueError as e:
+            raise ToolError("Unreadable members of %s: %s" % (d, e))
+
+        write_clusters(made, X, self.rmsd_cutoff)
+
+
+    def members(self, ensembles):
+        """Directories of the generated structures of the ensembles which did
+        not fail, to be processed by the following stages. Of clustered
+        ensembles only the centers of the clusters.
+        """
+        return [d+'/'+str(i) for d in ensembles if failure(d) is None
+            for i, _ in cluster_weights(d, len(self))
+            if failure(d+'/'+str(i)) is None]
+
+
+    def cost(self, d, stage, rates):
+        """Estimated duration of a task of stage on the structure in d: its
+        heavy atoms, as recorded in the timings, times the seconds per atom
+        of the stage in rates (see planner.calibrate), which include the
+        ensemble size for the stages that grow with it. Structures not made
+        yet count with the structure of their ensemble.
+        """
+        if not hasattr(self, '_atoms'):
+            self._atoms = {}
+
+        ensemble = d.split('/')[0]
+
+        for s in (d, ensemble):
+
+            if s not in self._atoms:
+                self._atoms[s] = heavy_atoms(
+                    self.maindir + '/' + s + '/' + s.split('/')[-1] + '.pdb'
+                )
+
+        return rates[stage] * (self._atoms[d] or self._atoms[ensemble])
+
+
+    def attempt(self, d, func, *args, stage=None):
+        """Call func with args inside the directory d. If it fails with one of
+        FAILURES, d is quarantined instead of stopping the whole run.
+        The duration is appended to the timings file of the run under the
+        name stage (func.__name__ by default), for `ccpbsa plan`.
+        Returns None on success, else the reason.
+        """
+        os.chdir(self.maindir)
+        start = time.time()
+
+        try:
+            os.chdir(d)
+            func(*args)
+            reason = None
+
+        except FAILURES as e:
+            os.chdir(self.maindir)
+            quarantine(d, e)
+            reason = failure(d) or str(e)
+
+        os.chdir(self.maindir)
+        record_timing(
+            self.maindir + '/' + TIMINGS,
+            stage or func.__name__,
+            heavy_atoms(d + '/' + d.split('/')[-1] + '.pdb'),
+            len(self),
+            time.time() - start,
+            reason is not None
+        )
+
+        return reason
+
+
+    def topology(self, pdb, wait=600):
+        """Returns the directory of the cached topology for a .pdb file. The
+        topology is made by pdb2gmx the first time a structure with the same
+        atoms and pdb2gmx flags is seen, i.e. once per ensemble and chain
+        group. Other processes wait for it to be finished, at most wait
+        seconds. A directory left unfinished by a process that is gone, e.g.
+        of an interrupted run, is taken over and made again.
+        """
+        key = topology_key(pdb, self.flags['pdb2gmx'], self.input['pdb2gmx'])
+        top = self.topologies + '/' + key
+        start = time.time()
+
+        while True:
+
+            try:
+                os.makedirs(top)
+                break
+
+            except FileExistsError:
+                pass
+
+            if os.path.exists(top + '/done'):
+                return top
+
+#            Only one process gets to move a stale directory away.
+            if stale(top, wait):
+
+                try:
+                    os.rename(top, '%s.stale.%d' % (top, os.getpid()))
+                    shutil.rmtree('%s.stale.%d' % (top, os.getpid()))
+
+                except OSError:
+                    pass
+
+                continue
+
+            if time.time() - start > wait:
+                raise ToolError("Timed out waiting for topology %s" % top)
+
+            time.sleep(0.5)
+
+        with open(top + '/owner', 'w') as owner:
+            owner.write('%s %d\n' % (socket.gethostname(), os.getpid()))
+
+#        If pdb2gmx fails here, prepare falls back to running it for the
+#        structure itself, which reports the error of that task. done is
+#        written in any case, so no one waits for a topology that never
+#        comes.
+        try:
+
+            try:
+                gmx(
+                    ['pdb2gmx'] + self.flags['pdb2gmx'] + [
+                        '-f', os.path.abspath(pdb), '-o', 'conf.gro',
+                        '-p', 'topol.top'
+                    ],
+                    **self.pipe,
+                    input=self.input['pdb2gmx'],
+                    cwd=top
+                )
+
+            except FAILURES:
+                pass
+
+            if os.path.exists(top + '/conf.gro'):
+                make_template(
+                    os.path.abspath(pdb),
+                    top + '/conf.gro',
+                    top + '/template.npz'
+                )
+
+        finally:
+            open(top + '/done', 'w').close()
+
+        return top
+
+
+    def prepare(self, pdb, gro, top=None):
+        """Write the coordinates of a .pdb file, including hydrogens and box,
+        to a .gro file that fits the cached topology. Only if the structure
+        can not be related to the cached topology pdb2gmx and editconf are run
+        for it, as it was done before the cache. pdb2gmx runs in a directory
+        of its own, fn_pdb2gmx, as it names some of its files itself and the
+        bound complex and the chain groups of a member are prepared
+        concurrently.
+        Returns the topology file to use with grompp.
+        """
+        fn = gro[:-len('.gro')]
+        own = fn + '_pdb2gmx'
+
+        if top is None:
+            top = self.topology(pdb)
+
+        if os.path.exists(top + '/template.npz') and from_template(
+            top + '/template.npz', pdb, gro, self.flags['editconf']
+        ):
+            return top + '/topol.top'
+
+        os.makedirs(own, exist_ok=True)
+        gmx(
+            ['pdb2gmx'] + self.flags['pdb2gmx'] + [
+                '-f', os.path.abspath(pdb), '-o', 'conf.gro',
+                '-p', 'topol.top', '-i', 'posre.itp'
+            ],
+            **self.pipe,
+            input=self.input['pdb2gmx'],
+            outputs=[own+'/conf.gro', own+'/topol.top'],
+            cwd=own
+        )
+        gmx(
+            ['editconf'] + self.flags['editconf'] + [
+                '-f', own+'/conf.gro', '-o', fn+'.gro'
+            ],
+            **self.pipe,
+            input=self.input['editconf']
+        )
+
+        return own + '/topol.top'
+
+
+    def topol(self, pdb, fn):
+        """Returns the topology file that prepare chose for the .pdb file
+        whose coordinates were written to fn.gro.
+        """
+        if os.path.exists(fn + '_pdb2gmx/topol.top'):
+            return fn + '_pdb2gmx/topol.top'
+
+        return self.topology(pdb) + '/topol.top'
+
+
+    def do_minimization(self, d):
+        """Do energy minimization on the structures in self.wds. If the
+        affinity is to be calculated, then an index file for the chains will be
+        made and the chains specified in self.chains are minimized.
+        The topology is taken from the cache, so only the coordinates are
+        prepared for each structure.
+        With self.minimizer set to 'internal' the in-process minimizer is used
+        instead of mdrun; grompp still runs for the structures CONCOORD starts
+        from, whose topol.tpr is needed later. Members already minimized in a
+        batch (see minimize_members) are skipped. With 'both' mdrun runs and
+        the internal minimizer is compared to it in minimization.csv.
+        """
+        if self.minimizer == 'internal' and '/' in d \
+            and os.path.exists('confout.gro'):
+            return
+
+        pdb = d.split("/")[-1] + ".pdb"
+        top = self.prepare(pdb, 'out.gro')
+        ndx = self.index(pdb, 'out')
+
+        if self.minimizer != 'internal' or '/' not in d:
+            gmx(
+                ['grompp'] + self.flags['grompp'] \
+                    + ['-c', 'out.gro', '-p', top] + ndx,
+                **self.pipe,
+                input=self.input['grompp']
+            )
+
+        if self.minimizer == 'internal':
+            self.minimize_batch(top, ['.'])
+            return
+
+        gmx(
+            ['mdrun'] + self.flags['mdrun'],
+            **self.pipe,
+            input=self.input['mdrun'],
+            outputs=[] if '-c' in self.flags['mdrun'] \
+                or '-deffnm' in self.flags['mdrun'] else ['confout.gro']
+        )
+
+        if self.minimizer == 'both':
+            self.compare_minimization(top)
+
+
+    def forcefield(self, top, natoms, ndx):
+        """The ForceField of the in-process minimizer for a topology, with the
+        minimization .mdp and the tables given to mdrun, TABLE if there are
+        none, like ccpbsa-setup gives mdrun by default. In localized mode the
+        Frozen group of the index file ndx is held in place. Force fields are
+        kept per topology and frozen atoms, like the solvers of pbsolve.
+        """
+        frozen = np.zeros(natoms, dtype=bool)
+
+        if getattr(self, 'local', None) is not None:
+            frozen[read_index(ndx)['Frozen']] = True
+
+        key = (os.path.abspath(top), frozen.tobytes())
+
+        if key not in _forcefields:
+            mdrun = self.flags['mdrun']
+            _forcefields[key] = ForceField(
+                key[0],
+                self.mdp(),
+                *[mdrun[mdrun.index(t)+1] if t in mdrun else TABLE
+                    for t in ('-table', '-tablep')],
+                frozen=frozen
+            )
+
+        return _forcefields[key]
+
+
+    def mdp(self):
+        """The settings of the minimization .mdp file.
+        """
+        grompp = self.flags['grompp']
+
+        return parse_mdp(grompp[grompp.index('-f')+1])
+
+
+    def minimize_batch(self, top, dirs, confout='confout.gro'):
+        """Minimize the structures out.gro of the directories dirs, which
+        share the topology top, together with the in-process minimizer.
+        Writes the minimized coordinates to confout in each directory and, in
+        place of the trajectory of mdrun, the last frame to traj.trr.
+        Returns the energy terms of the minimized structures.
+        """
+        structures = [read_gro(d + '/out.gro') for d in dirs]
+        mdp = self.mdp()
+        nsteps = int(mdp.get('nsteps', -1))
+        X, E, steps = minimize(
+            self.forcefield(top, len(structures[0][2]), dirs[0] + '/out.ndx'),
+            np.stack([s[2] for s in structures]),
+            nsteps if nsteps >= 0 else sys.maxsize,
+            float(mdp.get('emtol', 10))
+        )
+
+        for d, (title, atoms, _, box), x, n in zip(dirs, structures, X, steps):
+            write_gro(d + '/' + confout, title, atoms, x, box)
+
+            if confout == 'confout.gro':
+
+                with open(d + '/traj.trr', 'wb') as trr:
+                    trr.write(pack_trr(Frame(int(n), float(n),
+                        box_matrix(box), x)))
+
+        return E
+
+
+    def compare_minimization(self, top):
+        """Minimize the structure in the current directory with the in-process
+        minimizer as well and compare it to the one of mdrun: the potential
+        energy of both with the internal force field, next to the one mdrun
+        reported, and their RMSD. Written to minimization.csv.
+        """
+        self.minimize_batch(top, ['.'], 'internal_confout.gro')
+        structures = [read_gro(f)[2]
+            for f in ('confout.gro', 'internal_confout.gro')]
+        ff = self.forcefield(top, len(structures[0]), 'out.ndx')
+        E, _ = ff.energy(np.stack(structures))
+        edr = read_edrs(['ener.edr'])['ener.edr']
+        table = pd.DataFrame(E, index=['mdrun', 'internal'])
+        table['POTENTIAL'] = table.sum(axis=1)
+        table['EDR'] = [np.nan, np.nan]
+
+        if edr is not None and 'Potential' in edr.dtype.names and len(edr):
+            table.loc['mdrun', 'EDR'] = edr['Potential'][-1]
+
+        table['RMSD'] = [0.0, np.sqrt(
+            ((structures[1] - structures[0])**2).sum(axis=1).mean())]
+        table.to_csv('minimization.csv')
+
+
+    def minimize_members(self, en):
+        """Minimize the members of the ensemble en with the in-process
+        minimizer, all members with the same topology in one batch. Members
+        that can not be prepared or whose batch fails are left to the energy
+        stage, which minimizes them on their own.
+        """
+        batches = {}
+
+        for i, _ in cluster_weights('.', len(self)):
+            d = str(i)
+
+            if failure(d) is not None:
+                continue
+
+            here = os.getcwd()
+
+            try:
+                os.chdir(d)
+                top = os.path.abspath(self.prepare(d + '.pdb', 'out.gro'))
+                self.index(d + '.pdb', 'out')
+                batches.setdefault(top, []).append(d)
+
+            except FAILURES:
+                pass
+
+            os.chdir(here)
+
+        for top, dirs in batches.items():
+
+            try:
+                self.minimize_batch(top, dirs)
+
+            except FAILURES:
+                pass
+
+
+    def structure(self, d):
+        """Absolute paths of the minimized coordinates, the topology and the
+        .pdb file of the structure in d.
+        """
+        pdb = d.split("/")[-1] + ".pdb"
+        os.chdir(self.maindir + '/' + d)
+        top = os.path.abspath(self.topol(pdb, 'out'))
+        os.chdir(self.maindir)
+        path = self.maindir + '/' + d + '/'
+
+        return path + 'confout.gro', top, path + pdb
+
+
+    def update_struct(self, d):
+        """Use gro2pdb to convert the (minimized) confout.gro file of d into
+        the .pdb file with the same name as the directory.
+        """
+        pdb = d.split("/")[-1] + ".pdb"
+        gro2pdb(
+            'confout.gro',
+            'topol.tpr',
+            pdb,
+            **self.pipe,
+            input=b'0'
+        )
+#        Remove hydrogens for CONCOORD.
+        cmd.load(pdb)
+        cmd.remove('hydrogens')
+        cmd.save(pdb)
+        cmd.reinitialize()
+
+
+    def update_structs(self):
+        """Update the .pdb files of all structures in self.wds that did not
+        fail.
+        """
+        for d in self.wds:
+
+            if failure(d) is None:
+                self.attempt(d, self.update_struct, d, stage='update')
+
+
+    def single_point(self, mdp=None):
+        """Creates a single point .tpr file. By default with self.spmdp.
+        """
+        pdb = os.getcwd().split("/")[-1] + ".pdb"
+        gromppflags = self.flags['grompp'].copy()
+        idx = gromppflags.index('-f')
+        gromppflags.pop(idx)
+        gromppflags.pop(idx)
+        gmx(
+            [
+                'grompp', '-f', self.spmdp if mdp is None else mdp,
+                '-c', 'confout.gro',
+                '-p', self.topol(pdb, 'out'),
                 '-o', 'sp.tpr',
-            ] + gromppflags,
-            **self.pipe
+            ] + gromppflags + self.index(pdb, 'out'),
+            **self.pipe,
+            outputs=['sp.tpr']
         )
 
 
@@ -483,7 +1913,21 @@ class DataGenerator:
         should be named sp (Single Point).
         Parameters for this are stored in a separate file for gropbe. Reference
         it through the main parameter file for CC/PBSA.
+        With self.pb set to 'internal' the in-process solver is used instead of
+        gropbe, with 'both' its results go to pb_solvation.log for comparison.
         """
+        if self.pb != 'gropbe':
+            pdb = os.getcwd().split("/")[-1] + ".pdb"
+            self.pbsolve(
+                self.topol(pdb, 'out'),
+                'confout.gro',
+                'solvation.log' if self.pb == 'internal' else 'pb_solvation.log',
+                'out.ndx'
+            )
+
+            if self.pb == 'internal':
+                return
+
         chainselec = ",".join(str(i) for i in range(len(self.chains)))
 
         shutil.copy(self.flags['gropbe'][0], 'gropbe.prm')
@@ -491,21 +1935,44 @@ class DataGenerator:
         with open('gropbe.prm', 'a') as params:
             params.write("in(tpr,sp.tpr)")
 
-        gropbe = subprocess.run(
+        execute(
             ["gropbe", 'gropbe.prm'],
             input=bytes(chainselec, 'utf-8'),
-            stdout=subprocess.PIPE,
-            stderr=self.pipe['stderr']
+            **self.output("solvation.log")
         )
-        gropbe.stderr = None
-        log("solvation.log", gropbe)
+        self.echo("solvation.log")
+
+
+    def pbsolve(self, top, gro, fname, ndx=None):
+        """Calculate the Coulomb and Solvation Energies of a .gro file with
+        PBSolver and write them to fname in the format of gropbe. Solvers are
+        kept per topology, so the members of an ensemble share their setup.
+        In localized mode the grids are focused on the Local group of the
+        index file ndx.
+        """
+        top = os.path.abspath(top)
+
+        if top not in _solvers:
+            atoms = Topology(top).atoms()
+            _solvers[top] = PBSolver(
+                [a['charge'] for a in atoms],
+                [radius(a['name']) for a in atoms],
+                **parse_gropbe(self.flags['gropbe'][0])
+            )
 
-        if self.pipe['stdout'] == None:
-            print(gropbe.stdout.decode('utf-8'))
+        _, _, xyz, _ = read_gro(gro)
+        sel = None
+
+        if getattr(self, 'local', None) is not None:
+            sel = np.zeros(len(xyz), dtype=bool)
+            sel[read_index(ndx)['Local']] = True
+
+        write_log(fname, *_solvers[top].solve(xyz, sel))
 
 
     def lj(self):
-        """Calculate the Lennard-Jones Energy based on a sp.tpr
+        """Calculate the Lennard-Jones Energy based on a sp.tpr. The terms are
+        read from sp.edr by the collectors.
         """
         gmx(
             [
@@ -514,19 +1981,37 @@ class DataGenerator:
                 '-deffnm', 'sp',
                 '-nt', '1'
             ],
-            **self.pipe
-        )
-        lj = gmx(
-            ['energy', '-f', 'sp.edr', '-sum', 'yes'],
-            input=b'5 7',
-            stdout=subprocess.PIPE,
-            stderr=self.pipe['stderr']
+            **self.pipe,
+            outputs=['sp.edr']
         )
-        lj.stderr = None
-        log("lj.log", lj)
 
-        if self.pipe['stdout'] == None:
-            print(lj.stdout.decode('utf-8'))
+
+    def output(self, fname):
+        """self.pipe with stdout written to the file fname, for programs
+        whose output is parsed later. stderr stays where self.pipe puts it.
+        The program fails if it does not write anything to fname.
+        """
+        return dict(self.pipe, stdout=fname, outputs=[fname])
+
+
+    def echo(self, fname):
+        """Show a file written through self.output() in verbose mode.
+        """
+        if self.pipe['stdout'] is None:
+
+            with open(fname, 'r') as f:
+                shutil.copyfileobj(f, sys.stdout)
+
+
+    def sasa(self, fn):
+        """Flags for gmx sasa and its interactive input. In localized mode the
+        surface of the whole structure is calculated, but only the area of the
+        Local group is written out.
+        """
+        if getattr(self, 'local', None) is None:
+            return [], b'0'
+
+        return ['-n', fn+'.ndx', '-surface', 'System', '-output', 'Local'], None
 
 
     def area(self):
@@ -535,35 +2020,119 @@ class DataGenerator:
         ensemble will be used and the values for the interaction surface will
         be written into the .xvg file
         """
-        gmx(['sasa', '-s', 'confout.gro'], input=b'0', **self.pipe)
+        flags, input_ = self.sasa('out')
+        gmx(
+            ['sasa', '-s', 'confout.gro'] + flags,
+            input=input_,
+            **self.pipe,
+            outputs=['area.xvg']
+        )
 
 
-    def schlitter(self, en):
-        """Calculates an upper limit of the entropy according to Schlitter's
-        formula. Used in .fullrun() if the mode is stability
-        """
-        trjcat = ['trjcat', '-cat', 'yes', '-f']
-        covar = ['covar', '-f', 'trajout.xtc', '-nopbc', '-s']
-        anaeig = ['anaeig', '-v', 'eigenvec.trr', '-entropy', '-s']
+    def schlitter(self, en):
+        """Calculates an upper limit of the entropy according to Schlitter's
+        formula. Used in .fullrun() if the mode is stability. Quarantined
+        members are left out. The trajectories of the members are joined in
+        process, at full precision. -TS holds the entropy of all members of
+        the ensemble, also if it was clustered (see cluster_frames).
+        """
+        covar = ['covar', '-f', 'trajout.trr', '-nopbc', '-s']
+        anaeig = ['anaeig', '-v', 'eigenvec.trr', '-entropy', '-s']
+
+        ensemble = self.maindir + '/' + en
+        made = [i for i, _ in cluster_weights(ensemble, len(self))
+            if failure(ensemble+'/%d' % i) is None]
+
+        try:
+
+            if os.path.exists(ensemble + '/' + CLUSTERS):
+                frames = self.cluster_frames(ensemble, made, 'trajout.trr')
+
+            else:
+                frames = concatenate(
+                    [ensemble+'/%d/traj.trr' % i for i in made],
+                    'trajout.trr'
+                )
+
+        except (ValueError, IndexError) as e:
+            raise ToolError("Unreadable trajectory in %s: %s" % (en, e))
 
-        trrs = [self.maindir+'/'+en+'/%d/traj.trr' % (n+1)
-            for n in range(len(self))]
+        if frames == 0:
+            raise ToolError("No coordinates to calculate the entropy of %s"
+                % en)
 
-        gmx(trjcat+trrs, **self.pipe)
         gmx(
             covar+[self.maindir+'/'+en+"/topol.tpr"],
             input=self.input['covar'],
             **self.pipe
         )
-        entropy = gmx(
+        gmx(
             anaeig + [self.maindir+'/'+en+"/topol.tpr"],
-            stdout=subprocess.PIPE,
-            stderr=self.pipe['stderr']
+            **self.output('entropy.log')
         )
-        log('entropy.log', entropy)
+        self.echo('entropy.log')
+
+
+    def cluster_frames(self, ensemble, centers, fname):
+        """Write one frame per member of a clustered ensemble to the .trr file
+        fname, so the covariance is that of all members: the minimized
+        structure of the center of its cluster, displaced by the deviation of
+        the member from the center as CONCOORD made them. Hydrogens are
+        placed by the template of the topology. Without a template that fits,
+        the center stands in for each member of its cluster, which leaves out
+        the spread within the clusters.
+        Returns the number of frames.
+        """
+        clusters = pd.read_csv(ensemble + '/' + CLUSTERS, index_col=0) \
+            ['CLUSTER']
+        pdb = lambda i: ensemble + '/%d/%d.pdb' % (i, i)
+        n = 0
+
+        with open(fname, 'wb') as trr:
+
+            for c in centers:
+                t = trajectory(ensemble + '/%d/traj.trr' % c)
+                frame = next((f for f in map(t.frame, reversed(range(len(t))))
+                    if f.x is not None), None)
+
+                if frame is None:
+                    continue
+
+                members = [int(m) for m in clusters.index[clusters == c]]
+                template = self.topology(pdb(c)) + '/template.npz'
+                X = None
+
+                if os.path.exists(template):
+                    X = [rebuild(template, pdb(i)) for i in [c] + members]
+
+                if X is None or any(x is None or x.shape != frame.x.shape
+                    for x in X):
+                    X = [frame.x] * (len(members) + 1)
+
+                for x in displace(frame.x, X[0], np.stack(X[1:])):
+                    trr.write(pack_trr(Frame(frame.step, frame.time,
+                        frame.box, x)))
+                    n += 1
+
+        return n
+
 
-        if self.pipe['stdout'] == None:
-            print(entropy.stdout.decode('utf-8'))
+    def energy(self, d):
+        """All energy terms of the structure in d, starting from its .pdb
+        file.
+        """
+        self.do_minimization(d)
+        self.terms()
+
+
+    def terms(self):
+        """The energy terms of the minimized structure in the current
+        directory, for structures minimized before (see ccpbsa.sweep).
+        """
+        self.single_point()
+        self.electrostatics()
+        self.lj()
+        self.area()
 
 
     def fullrun(self):
@@ -571,7 +2140,7 @@ class DataGenerator:
         by multiprocessing. Just for quick tests within the library code.
         """
         print("Minimizing starting structures")
-        for d in tqdm(self.wds):
+        for d in track(self.wds, 'minimization'):
             os.chdir(d)
 
             try:
@@ -586,7 +2155,7 @@ class DataGenerator:
         self.update_structs()
 
         print("Generating CONCOORD structure ensembles.")
-        for d in tqdm(self.wds):
+        for d in track(self.wds, 'concoord'):
             os.chdir(d)
 
             try:
@@ -602,7 +2171,7 @@ class DataGenerator:
                 for i in range(1, len(self)+1)]
 
         print("Minimizing structures and extract values.")
-        for d in tqdm(self.wds):
+        for d in track(self.wds, 'energy'):
             os.chdir(d)
             self.do_minimization(d)
             self.single_point()
@@ -612,7 +2181,7 @@ class DataGenerator:
             os.chdir(self.maindir)
 
         print("Calculating Entropy of structure ensembles.") 
-        for en in tqdm(ensembles):
+        for en in track(ensembles, 'entropy'):
             os.chdir(en)
             self.schlitter(en)
             os.chdir(self.maindir)
@@ -625,7 +2194,7 @@ class DataGenerator:
         """
         self.n = 0
         print("Minimizing structures and extract values.")
-        for d in tqdm(self.wds):
+        for d in track(self.wds, 'energy'):
             os.chdir(d)
             self.do_minimization(d)
             self.single_point()
@@ -647,8 +2216,21 @@ class AffinityGenerator(DataGenerator):
         chaingrp,
         spmdp,
         verbosity=0,
-        dummy=False
+        dummy=False,
+        pb='gropbe',
+        local=None,
+        energygroups=False,
+        logs=False,
+        retries=0,
+        disco_split=1,
+        paired=False,
+        rmsd_cutoff=None,
+        minimizer='mdrun'
     ):
+        if energygroups and local is not None:
+            raise ValueError("Energy groups can not be combined with the \
+                localized mode")
+
         self.grp1 = chaingrp
         cmd.load(wtpdb)
         self.chains = cmd.get_chains()
@@ -660,240 +2242,252 @@ class AffinityGenerator(DataGenerator):
            flags=flags,
            spmdp=spmdp,
            verbosity=verbosity,
-           dummy=dummy
+           dummy=dummy,
+           pb=pb,
+           local=local,
+           logs=logs,
+           retries=retries,
+           disco_split=disco_split,
+           paired=paired,
+           rmsd_cutoff=rmsd_cutoff,
+           minimizer=minimizer
         )
+        self.energygroups = energygroups
+
+        if energygroups:
+            self.groups_mdp = self.maindir + '/groups_' \
+                + self.spmdp.split('/')[-1]
+
+            if not dummy:
+
+                with open(self.spmdp, 'r') as ori, \
+                    open(self.groups_mdp, 'w') as out:
+                    out.write(ori.read() + '\nenergygrps = %s %s\n' % (
+                        self.group_name(self.grp1), self.group_name(self.grp2)
+                    ))
+
+
+    def group_name(self, grp):
+        """Name of the energy group of a chain group.
+        """
+        return 'chains_' + grp
+
+
+    def index(self, pdb, fn):
+        """With energy groups, the bound complex gets an index file with a
+        group for each of the chain groups. Otherwise as in DataGenerator.
+        """
+        if not getattr(self, 'energygroups', False) or fn != 'out':
+            return super().index(pdb, fn)
+
+        write_index(pdb, fn+'.gro', [
+            (self.group_name(g), lambda r, g=g: r[0] in g) \
+                for g in (self.grp1, self.grp2)
+        ], fn+'.ndx')
 
+        return ['-n', fn+'.ndx']
 
-    def split_chains(self, d):
+
+    def single_point(self):
+        """Creates the single point .tpr file of the complex. With energy
+        groups it resolves the interactions within and between the chain
+        groups.
+        """
+        if getattr(self, 'energygroups', False):
+            super().single_point(self.groups_mdp)
+
+        else:
+            super().single_point()
+
+
+    def groups(self, grp):
+        """The chain groups a method of the unbound proteins works on: grp if
+        given, else both of them.
+        """
+        return (self.grp1, self.grp2) if grp is None else (grp,)
+
+
+    def split_chains(self, d, grp=None):
         """Split the .pdb file into two new .pdb files as specified in the
         chaingrp argument. only one group needs to be specified. The leftover
         chains automatically form the second group.
+        Works on the .pdb text directly, so it is safe to use in workers.
         """
         pdb = d.split('/')[-1]
-        cmd.load(pdb+'.pdb')
-        cmd.split_chains()
-        save1 = ', '.join([pdb+'_'+i for i in self.grp1])
-        save2 = ', '.join([pdb+'_'+i for i in self.grp2])
-        cmd.save(self.grp1+'.pdb', save1)
-        cmd.save(self.grp2+'.pdb', save2)
-        cmd.reinitialize()
 
+        for fn in self.groups(grp):
+            split_pdb(pdb+'.pdb', fn, fn+'.pdb')
 
-    def do_minimization_chains(self):
-        """Go into all the directories and minimize the .pdb files of the
-        unbounded proteins instead.
-        """
-        fn = self.grp1
-        gmx(
-            ['pdb2gmx'] + self.flags['pdb2gmx'] + [
-                '-f', fn+'.pdb', '-o', fn+'.gro', '-p', fn + '_topol.top'
-            ],
-            **self.pipe
-        )
-        gmx(
-            ['editconf'] + self.flags['editconf'] + [
-                '-f', fn+'.gro', '-o', fn+'.gro'
-            ],
-            **self.pipe,
-            input=self.input['editconf']
-        )
-        gmx(
-            ['grompp'] + self.flags['grompp'] + [
-                '-c', fn+'.gro', '-o', fn+'.tpr', '-p', fn + '_topol.top'
-            ],
-            **self.pipe,
-            input=self.input['grompp']
-        )
-#        gmx(
-#            ['mdrun'] + self.flags['mdrun'] + ['-deffnm', fn],
-#            **self.pipe,
-#            input=self.input['mdrun']
-#        )
 
-        fn = self.grp2
-        gmx(
-            ['pdb2gmx'] + self.flags['pdb2gmx'] + [
-                '-f', fn+'.pdb', '-o', fn+'.gro', '-p', fn + '_topol.top'
-            ],
-            **self.pipe
-        )
-        gmx(
-            ['editconf'] + self.flags['editconf'] + [
-                '-f', fn+'.gro', '-o', fn+'.gro'
-            ],
-            **self.pipe,
-            input=self.input['editconf']
-        )
-        gmx(
-            ['grompp'] + self.flags['grompp'] + [
-                '-c', fn+'.gro', '-o', fn+'.tpr', '-p', fn + '_topol.top'
-            ],
-            **self.pipe,
-            input=self.input['grompp']
-        )
-#        gmx(
-#            ['mdrun'] + self.flags['mdrun'] + ['-deffnm', fn],
-#            **self.pipe,
-#            input=self.input['mdrun']
-#        )
+    def do_minimization_chains(self, grp=None):
+        """Go into all the directories and prepare the .pdb files of the
+        unbounded proteins instead. Topologies come from the cache.
+        """
+        for fn in self.groups(grp):
+            top = self.prepare(fn+'.pdb', fn+'.gro')
+            gmx(
+                ['grompp'] + self.flags['grompp'] + [
+                    '-c', fn+'.gro', '-o', fn+'.tpr', '-p', top,
+                    '-po', fn+'_mdout.mdp'
+                ] + self.index(fn+'.pdb', fn),
+                **self.pipe,
+                input=self.input['grompp']
+            )
+#            gmx(
+#                ['mdrun'] + self.flags['mdrun'] + ['-deffnm', fn],
+#                **self.pipe,
+#                input=self.input['mdrun']
+#            )
 
 
-    def single_point_chains(self):
+    def single_point_chains(self, grp=None):
         """Creates a single point .tpr file of the single groups.
         """
         gromppflags = self.flags['grompp'].copy()
         idx = gromppflags.index('-f')
         gromppflags.pop(idx)
         gromppflags.pop(idx)
-        gmx(
-            [
-                'grompp', '-f', self.spmdp,
-                '-c', self.grp1+'.gro',
-                '-p', self.grp1+'_topol.top',
-                '-o', self.grp1+'_sp.tpr',
-            ] + gromppflags,
-            **self.pipe
-        )
-        gmx(
-            [
-                'grompp', '-f', self.spmdp,
-                '-c', self.grp2+'.gro',
-                '-p', self.grp2+'_topol.top',
-                '-o', self.grp2+'_sp.tpr',
-            ] + gromppflags,
-            **self.pipe
-        )
+
+        for fn in self.groups(grp):
+            gmx(
+                [
+                    'grompp', '-f', self.spmdp,
+                    '-c', fn+'.gro',
+                    '-p', self.topol(fn+'.pdb', fn),
+                    '-o', fn+'_sp.tpr',
+                    '-po', fn+'_mdout.mdp',
+                ] + gromppflags + self.index(fn+'.pdb', fn),
+                **self.pipe
+            )
 
 
-    def electrostatics_chains(self):
+    def electrostatics_chains(self, grp=None):
         """Calcutlate the Coulomb and Solvation Energy based on the single
         point .tpr files of the chain groups. Parameters are stored in a
         separate file for gropbe. Reference it through the main parameter file
         for CC/PBSA.
         """
-        chainselec = ",".join(str(i) for i in range(len(self.grp1)))
+        for fn in self.groups(grp):
+
+            if self.pb != 'gropbe':
+                self.pbsolve(
+                    self.topol(fn+'.pdb', fn),
+                    fn+'.gro',
+                    fn + ('_solvation.log' if self.pb == 'internal' \
+                        else '_pb_solvation.log'),
+                    fn+'.ndx'
+                )
 
-        shutil.copy(self.flags['gropbe'][0], 'gropbe.prm')
+                if self.pb == 'internal':
+                    continue
 
-        with open('gropbe.prm', 'a') as params:
-            params.write("in(tpr,%s_sp.tpr)" % self.grp1)
+            chainselec = ",".join(str(i) for i in range(len(fn)))
+            prm = fn + '_gropbe.prm'
 
-        gropbe = subprocess.run(
-            ["gropbe", 'gropbe.prm'],
-            input=bytes(chainselec, 'utf-8'),
-            stdout=subprocess.PIPE,
-            stderr=self.pipe['stderr']
-        )
-        log("%s_solvation.log" % self.grp1, gropbe)
+            shutil.copy(self.flags['gropbe'][0], prm)
 
-        if self.pipe['stdout'] == None:
-            print(gropbe.stdout.decode('utf-8'))
-        
-        chainselec = ",".join(str(i) for i in range(len(self.grp2)))
+            with open(prm, 'a') as params:
+                params.write("in(tpr,%s_sp.tpr)" % fn)
 
-        shutil.copy(self.flags['gropbe'][0], 'gropbe.prm')
+            execute(
+                ["gropbe", prm],
+                input=bytes(chainselec, 'utf-8'),
+                **self.output("%s_solvation.log" % fn)
+            )
+            self.echo("%s_solvation.log" % fn)
 
-        with open('gropbe.prm', 'a') as params:
-            params.write("in(tpr,%s_sp.tpr)" % self.grp2)
 
-        gropbe = subprocess.run(
-            ["gropbe", 'gropbe.prm'],
-            input=bytes(chainselec, 'utf-8'),
-            stdout=subprocess.PIPE,
-            stderr=self.pipe['stderr']
-        )
-        log("%s_solvation.log" % self.grp2, gropbe)
+    def lj_chains(self, grp=None):
+        """Calculate the Lennard-Jones Energy based on the sp.tpr of the
+        unbound proteins, read from <group>_sp.edr by the collector.
+        """
+        for fn in self.groups(grp):
+            gmx(
+                [
+                    'mdrun', '-s', fn+'_sp.tpr',
+                    '-rerun', fn+'.gro',
+                    '-deffnm', fn+'_sp',
+                    '-nt', '1'
+                ],
+                **self.pipe,
+                outputs=[fn+'_sp.edr']
+            )
 
-        if self.pipe['stdout'] == None:
-            print(gropbe.stdout.decode('utf-8'))
 
+    def unbound(self, d, grp):
+        """The whole pipeline of one unbound chain group of a structure. Runs
+        independently of the bound complex and of the other group, so all
+        three can be processed concurrently.
+        """
+        self.split_chains(d, grp)
+        self.do_minimization_chains(grp)
+        self.single_point_chains(grp)
+        self.electrostatics_chains(grp)
+
+#        With energy groups the Lennard-Jones terms come from the complex.
+        if not getattr(self, 'energygroups', False):
+            self.lj_chains(grp)
+
+
+    def energy(self, d, grp=None):
+        """The energy terms of the bound complex in d, or of the unbound chain
+        group grp of it.
+        """
+        if grp is None:
+            self.do_minimization(d)
+            self.terms()
+
+        else:
+            self.unbound(d, grp)
 
-    def lj_chains(self):
-        """Calculate the Lennard-Jones Energy based on the sp.tpr of the
-        unbound proteins
-        """
-        gmx([
-            'mdrun', '-s', self.grp1+'_sp.tpr',
-            '-rerun', self.grp1+'.gro',
-            '-deffnm', self.grp1+'_sp',
-            '-nt', '1'
-        ])
-        lj = gmx(
-            ['energy', '-f', self.grp1+'_sp.edr', '-sum', 'yes'],
-            input=b'5 7',
-            stdout=subprocess.PIPE,
-            stderr=self.pipe['stderr']
-        )
-        lj.stderr = None
-        log(self.grp1+"_lj.log", lj)
-
-        if self.pipe['stdout'] == None:
-            print(lj.stdout.decode('utf-8'))
-
-        gmx([
-            'mdrun', '-s', self.grp2+'_sp.tpr',
-            '-rerun', self.grp2+'.gro',
-            '-deffnm', self.grp2+'_sp',
-            '-nt', '1'
-        ])
-        lj = gmx(
-            ['energy', '-f', self.grp2+'_sp.edr', '-sum', 'yes'],
-            input=b'5 7',
-            stdout=subprocess.PIPE,
-            stderr=self.pipe['stderr']
-        )
-        lj.stderr = None
-        log("".join(self.grp2)+"_lj.log", lj)
 
-        if self.pipe['stdout'] == None:
-            print(lj.stdout.decode('utf-8'))
+    def terms(self):
+        """The energy terms of the minimized bound complex in the current
+        directory. The interaction area is done for the wildtype by area.
+        """
+        self.single_point()
+        self.electrostatics()
+        self.lj()
 
 
     def area(self):
-        """Calculate the interaction area of the wildtype protein.
+        """Calculate the interaction area of the wildtype protein. Members
+        that fail are quarantined.
         """
         sasa = ['sasa', '-s']
 
-        os.chdir(self.wt)
-
-        if self.n > 0:
+        def areas():
+            flags, input_ = self.sasa('out')
+            gmx(
+                sasa + ['confout.gro'] + flags,
+                input=input_,
+                **self.pipe,
+                outputs=['area.xvg']
+            )
 
-            for i in range(1, len(self)+1):
-                os.chdir(str(i))
-                gmx(sasa + ['confout.gro'], input=b'0')
-                gmx(
-                    sasa + [self.grp1 + '.gro', '-o', self.grp1+'_area.xvg'],
-                    input=b'0',
-                    **self.pipe
-                )
+            for fn in (self.grp1, self.grp2):
+                flags, input_ = self.sasa(fn)
                 gmx(
-                    sasa + [self.grp2 + '.gro', '-o', self.grp2+'_area.xvg'],
-                    input=b'0',
-                    **self.pipe
+                    sasa + [fn + '.gro', '-o', fn+'_area.xvg'] + flags,
+                    input=input_,
+                    **self.pipe,
+                    outputs=[fn+'_area.xvg']
                 )
-                os.chdir('..')
 
-        else: 
-            gmx(sasa + ['confout.gro'], input=b'0')
-            gmx(
-                sasa + [self.grp1 + '.gro', '-o', self.grp1+'_area.xvg'],
-                input=b'0',
-                **self.pipe
-            )
-            gmx(
-                sasa + [self.grp2 + '.gro', '-o', self.grp2+'_area.xvg'],
-                input=b'0',
-                **self.pipe
-            )
+        if self.n > 0:
 
-        os.chdir(self.maindir)
+            for d in self.members([self.wt]):
+                self.attempt(d, areas, stage='area')
+
+        else: 
+            self.attempt(self.wt, areas, stage='area')
 
 
     def fullrun(self):
         """Generate all the data for DataCollector.
         """
         print("Minimizing starting structures")
-        for d in tqdm(self.wds):
+        for d in track(self.wds, 'minimization'):
             os.chdir(d)
             super().do_minimization(d)
             os.chdir(self.maindir)
@@ -901,7 +2495,7 @@ class AffinityGenerator(DataGenerator):
         super().update_structs()
 
         print("Generating CONCOORD structure ensembles.")
-        for d in tqdm(self.wds):
+        for d in track(self.wds, 'concoord'):
             os.chdir(d)
             self.do_concoord(d)
             os.chdir(self.maindir)
@@ -910,22 +2504,24 @@ class AffinityGenerator(DataGenerator):
                 for i in range(1, len(self)+1)]
 
         print("Minimizing structures and extract values of bounded proteins")
-        for d in tqdm(self.wds):
+        for d in track(self.wds, 'energy'):
             os.chdir(d)
             super().do_minimization(d)
-            super().single_point()
+            self.single_point()
             super().electrostatics()
             super().lj()
             os.chdir(self.maindir)
 
         print("Minimizing structures and extract values of unbounded proteins")
-        for d in tqdm(self.wds):
+        for d in track(self.wds, 'unbound'):
             os.chdir(d)
             self.split_chains(d)
             self.do_minimization_chains()
             self.single_point_chains()
             self.electrostatics_chains()
-            self.lj_chains()
+
+            if not self.energygroups:
+                self.lj_chains()
             os.chdir(self.maindir)
         
         self.area()
@@ -936,22 +2532,24 @@ class AffinityGenerator(DataGenerator):
         contribution to the energy term. Very fast alternative.
         """
         print("Minimizing structures and extract values of bounded proteins")
-        for d in tqdm(self.wds):
+        for d in track(self.wds, 'energy'):
             os.chdir(d)
             super().do_minimization(d)
-            super().single_point()
+            self.single_point()
             super().electrostatics()
             super().lj()
             os.chdir(self.maindir)
 
         print("Minimizing structures and extract values of unbounded proteins")
-        for d in tqdm(self.wds):
+        for d in track(self.wds, 'unbound'):
             os.chdir(d)
             self.split_chains(d)
             self.do_minimization_chains()
             self.single_point_chains()
             self.electrostatics_chains()
-            self.lj_chains()
+
+            if not self.energygroups:
+                self.lj_chains()
             os.chdir(self.maindir)
         
         self.area()
@@ -968,17 +2566,22 @@ class DataCollector:
     aa123 = dict(zip(aa1,aa3))
     aa321 = dict(zip(aa3,aa1))
 
-    def __init__(self, data_obj):
+    def __init__(self, data_obj, wds=None):
         """Pass the DataGenerator object to initialize. This way all the
         directories that contains the data is known without much searching.
+        The tables can be restricted to the ensembles in wds, which have to
+        include the wildtype.
         """
         self.maindir = data_obj.maindir
         self.wds = data_obj.wds
         os.chdir(self.maindir)
 
         self.n = data_obj.n
-        self.mut_df = data_obj.mut_df
+        self.paired = getattr(data_obj, 'paired', False) and self.n > 0
+        self.mut_df = copy.deepcopy(data_obj.mut_df) # translated below
         self.wt = data_obj.wt
+        self.lj_group = None if getattr(data_obj, 'local', None) is None \
+            else 'Local'
 
         for i, k in enumerate(self.mut_df["Mutation"].index):
  
@@ -988,22 +2591,21 @@ class DataCollector:
                 if len(mut) > 0:
                     self.mut_df["Mutation"][i][j] = self.aa321[mut]
 
-        idx = next(os.walk('.'))[1]
+        idx = [i for i in next(os.walk('.'))[1] if not i.startswith('.')] \
+            if wds is None else list(wds)
         self.G_mean = pd.DataFrame(0.0, 
             columns=['SOLV', 'COUL', 'LJ (1-4)', 'LJ (SR)', 'SAS', '-TS'],
             index=idx
         )
 
-        if self.n > 0:
-            idx = pd.MultiIndex.from_tuples(
-                [(i, j) for i in idx for j in range(1, len(self)+1)]
-            )
-
+        idx, self.weights = self.ensembles(idx)
         self.G = pd.DataFrame(0.0, 
             columns=['SOLV', 'COUL', 'LJ (1-4)', 'LJ (SR)', 'SAS'],
             index=idx
         )
         self.dG = self.G_mean.drop(self.wt)
+        self.dG_err = pd.DataFrame(np.nan, columns=self.G.columns,
+            index=self.dG.index)
         self.ddG = pd.DataFrame(0.0,
             columns=['CALC', 'SOLV', 'COUL', 'LJ (1-4)', 'LJ (SR)', 'SAS', '-TS'],
             index=self.dG.index
@@ -1014,56 +2616,80 @@ class DataCollector:
         """Returns the number of structures generated by CONCOORD
         """
         return self.n
-        
 
-    def search_lj(self):
-        """Find the files in which the Lennard-Jones energies are supposed to
-        be written in and save the parsed values in self.G.
+
+    def ensembles(self, idx):
+        """Index of the member tables of the ensembles idx, with the weight of
+        each member: the members evaluated of each ensemble, only the
+        centers of the clusters if it was clustered.
         """
-        for i in self.G.index:
+        if self.n == 0:
+            return idx, pd.Series(1.0, index=idx)
 
-            if self.n > 0:
-                d = "/".join([str(j) for j in i])
-                os.chdir(d)
+        members = [(i, j, w) for i in idx
+            for j, w in cluster_weights(self.maindir + '/' + i, len(self))]
+        idx = pd.MultiIndex.from_tuples([m[:2] for m in members])
 
-            else:
-                os.chdir(i)
+        return idx, pd.Series([float(m[2]) for m in members], index=idx)
 
-            try:
-                LJ = next(get_lj('lj.log'))
-                
-            except:
-                LJ = [np.NaN, np.NaN]
 
-            self.G['LJ (1-4)'][i] = LJ[0]
-            self.G['LJ (SR)'][i] = LJ[1]
+    def member(self, i):
+        """Directory of an entry of the self.G index, relative to maindir.
+        """
+        if self.n > 0:
+            return self.maindir + "/" + "/".join([str(j) for j in i])
 
-            os.chdir(self.maindir)
+        return self.maindir + "/" + i
 
 
-    def search_electro(self):
-        """Find the file in which the Coulomb energies are supposed to be
-        written in and save the parsed values in G.
+    def search_failures(self, tables=None):
+        """Collect the structures with missing values and the reason, i.e. the
+        error recorded when they were quarantined, "not generated" if CONCOORD
+        did not produce them or "incomplete output" if a file is missing
+        without an error. Saved in self.failures.
         """
-        for i in self.G.index:
+        tables = [self.G] if tables is None else tables
+        failed = tables[0].index[
+            np.any([t.isna().any(axis=1).values for t in tables], axis=0)
+        ]
+        reasons = []
+
+        for i in failed:
+            d = self.member(i)
+            ensemble = d if self.n == 0 else os.path.dirname(d)
+            reasons.append(failure(ensemble) or failure(d) \
+                or "incomplete output")
+
+        self.failures = pd.DataFrame(
+            {'REASON': reasons},
+            index=[i if self.n == 0 else "/".join([str(j) for j in i])
+                for i in failed]
+        )
 
-            if self.n > 0:
-                d = "/".join([str(j) for j in i])
-                os.chdir(d)
+        return self.failures
 
-            else:
-                os.chdir(i)
 
-            try:
-                vals = next(get_electro('solvation.log'))
+    def search_lj(self):
+        """Find the files in which the Lennard-Jones energies are supposed to
+        be written in and save the parsed values in self.G.
+        """
+        files = [self.member(i) + '/sp.edr' for i in self.G.index]
+        energies = read_edrs(files)
 
-            except RuntimeError:
-                vals = [np.NaN, np.NaN]
+        for i, f in zip(self.G.index, files):
+            LJ = first(get_edr_lj, energies[f], group=self.lj_group)
+            self.G.loc[i, 'LJ (1-4)'] = LJ[0]
+            self.G.loc[i, 'LJ (SR)'] = LJ[1]
 
-            self.G['COUL'][i] = vals[0]
-            self.G['SOLV'][i] = vals[1]
 
-            os.chdir(self.maindir)
+    def search_electro(self):
+        """Find the file in which the Coulomb energies are supposed to be
+        written in and save the parsed values in G.
+        """
+        for i in self.G.index:
+            vals = first(get_electro, self.member(i) + '/solvation.log')
+            self.G.loc[i, 'COUL'] = vals[0]
+            self.G.loc[i, 'SOLV'] = vals[1]
 
 
     def search_area(self):
@@ -1072,21 +2698,9 @@ class DataCollector:
         G.
         """
         for i in self.G.index:
-
-            if self.n > 0:
-                d = "/".join([str(j) for j in i])
-                os.chdir(d)
-
-            else:
-                os.chdir(i)
-
-            try:
-                self.G['SAS'][i] = next(get_area('area.xvg'))
-
-            except:
-                self.G['SAS'][i] = np.NaN
-
-            os.chdir(self.maindir)
+            self.G.loc[i, 'SAS'] = first(
+                get_area, self.member(i) + '/area.xvg', default=np.nan
+            )
 
 
     def search_entropy(self):
@@ -1094,13 +2708,13 @@ class DataCollector:
         formula are supposed to be written in and save the parsed values in
         self.G.
         """
-        head = "head -n 1 entropy.log".split()
         for i in self.G_mean.index:
             os.chdir(i)
 
             try:
-                entropy = subprocess.run(head, stdout=subprocess.PIPE)
-                entropy = entropy.stdout.decode('utf-8')
+                with open('entropy.log', 'r') as entropylog:
+                    entropy = entropylog.readline()
+
                 valstart = entropy.index('is ')+3
                 valend = entropy.index(' J/mol K')
                 entropy = float(entropy[valstart:valend])/1000 # J/mol K-->kJ/mol K
@@ -1112,27 +2726,40 @@ class DataCollector:
             os.chdir(self.maindir)
 
 
-    def search_data(self):
+    def search_data(self, entropy=True):
         """Use all of the searching methods to fill out the energy table.
+        Without entropy (no ensembles) the -TS column is left at 0.
         Returns the DataFrame object.
         """
         self.search_lj()
         self.search_electro()
         self.search_area()
-        self.search_entropy()
 
+        if entropy:
+            self.search_entropy()
+
+        self.search_failures()
+        self.means()
+
+        return self.G_mean, self.G
+
+
+    def means(self):
+        """Weighted means of the members of each ensemble in self.G_mean.
+        """
         for c in self.G.columns:
             
             for i in self.G_mean.index:
-                self.G_mean.loc[i, c] = self.G.loc[i, c].mean()
-
-        return self.G_mean, self.G
+                self.G_mean.loc[i, c] = average(self.G.loc[i, c],
+                    self.weights.loc[i])
 
 
     def dstability(self, gxg_table):
         """Calculate the free energy difference between folded and unfolded
         state based on the energy table passed. ddstability operates
         independent of this function. This is just used for additional info.
+        In paired mode the folded terms are the mean differences of the
+        pairs of members, with their standard error in self.dG_err.
         """
         gxgtable = pd.read_csv(gxg_table, index_col=0)
         self.dG_unfld = pd.DataFrame(0.0,
@@ -1155,7 +2782,13 @@ class DataCollector:
                 self.dG_unfld.to_csv("dG_unfold.csv")
 
             for i in self.dG.index:
-                self.dG.loc[i, c] = self.G_mean.loc[i, c] - self.G_mean.loc[self.wt, c]
+
+                if self.paired and c in self.G.columns:
+                    self.dG.loc[i, c], self.dG_err.loc[i, c] = \
+                        pairwise(self.G, i, self.wt, c, self.weights)
+
+                else:
+                    self.dG.loc[i, c] = self.G_mean.loc[i, c] - self.G_mean.loc[self.wt, c]
 
         return self.dG, self.dG_unfld
 
@@ -1178,18 +2811,19 @@ class DataCollector:
 
     def fitstability(self, alpha, beta, gamma, tau):
         """Multiply the column of each energy contribution by a certain value.
+        The fitted values are stored in self.ddG_fit, self.ddG stays unfitted
+        so fits can be reapplied.
         """
-        self.ddG["SOLV"] *= alpha
-        self.ddG["COUL"] *= alpha
-        self.ddG["LJ (1-4)"] *= beta
-        self.ddG["LJ (SR)"] *= beta
-        self.ddG["SAS"] *= gamma
-        self.ddG["-TS"] *= tau
+        self.ddG_fit = self.ddG.copy()
+        self.ddG_fit["SOLV"] *= alpha
+        self.ddG_fit["COUL"] *= alpha
+        self.ddG_fit["LJ (1-4)"] *= beta
+        self.ddG_fit["LJ (SR)"] *= beta
+        self.ddG_fit["SAS"] *= gamma
+        self.ddG_fit["-TS"] *= tau
+        self.ddG_fit["CALC"] = self.ddG_fit.loc[:, "SOLV":].sum(axis=1)
 
-        for i in self.ddG.index:
-            self.ddG["CALC"][i] = sum(self.ddG.loc[i, "SOLV":])
-
-        return self.ddG
+        return self.ddG_fit
 
 
 class AffinityCollector:
@@ -1203,17 +2837,23 @@ class AffinityCollector:
     aa123 = dict(zip(aa1,aa3))
     aa321 = dict(zip(aa3,aa1))
 
-    def __init__(self, data_obj):
-        """Pass a AffinityGenerator object to initialize.
+    def __init__(self, data_obj, wds=None):
+        """Pass a AffinityGenerator object to initialize. The tables can be
+        restricted to the ensembles in wds, which have to include the
+        wildtype.
         """
         self.maindir = data_obj.maindir
         os.chdir(self.maindir)
 
         self.n = data_obj.n
-        self.mut_df = data_obj.mut_df
+        self.paired = getattr(data_obj, 'paired', False) and self.n > 0
+        self.mut_df = copy.deepcopy(data_obj.mut_df) # translated below
         self.wt = data_obj.wt
+        self.lj_group = None if getattr(data_obj, 'local', None) is None \
+            else 'Local'
         self.grp1 = data_obj.grp1
         self.grp2 = data_obj.grp2
+        self.energygroups = getattr(data_obj, 'energygroups', False)
 
         for i, k in enumerate(self.mut_df["Mutation"].index):
 
@@ -1223,7 +2863,8 @@ class AffinityCollector:
                 if len(mut) > 0:
                     self.mut_df["Mutation"][i][j] = self.aa321[mut]
 
-        idx = next(os.walk('.'))[1]
+        idx = [i for i in next(os.walk('.'))[1] if not i.startswith('.')] \
+            if wds is None else list(wds)
         self.G_bound_mean = pd.DataFrame(0.0,
             columns=['SOLV', 'COUL', 'LJ (1-4)', 'LJ (SR)', 'PPIS'],
             index=idx
@@ -1237,11 +2878,7 @@ class AffinityCollector:
             index=idx
         )
 
-        if self.n > 0:
-            idx = pd.MultiIndex.from_tuples(
-                [(i, j) for i in idx for j in range(1, len(self)+1)]
-            )
-
+        idx, self.weights = self.ensembles(idx)
         self.G_bound = pd.DataFrame(0.0,
             columns=['SOLV', 'COUL', 'LJ (1-4)', 'LJ (SR)', 'PPIS'],
             index=idx
@@ -1264,93 +2901,102 @@ class AffinityCollector:
             columns=['CALC', 'SOLV', 'COUL', 'LJ (1-4)', 'LJ (SR)', 'PPIS', 'PKA'],
             index=self.dG_bound.index
         )
+        self.ddG_err = pd.DataFrame(np.nan,
+            columns=['SOLV', 'COUL', 'LJ (1-4)', 'LJ (SR)'],
+            index=self.dG_bound.index
+        )
 
     def __len__(self):
         return self.n
 
+#    Locating the structures and reporting failures works as for stability.
+    ensembles = DataCollector.ensembles
+    member = DataCollector.member
+    search_failures = DataCollector.search_failures
+
+
     def search_lj(self):
         """Find the files in which the Lennard-Jones energies are supposed to
         be written in and save the parsed values in the respective self.G table.
+        Missing values are NaN.
         """
-        for i in self.G_bound.index:
+        names = ['sp.edr'] if self.energygroups \
+            else ['sp.edr', '%s_sp.edr' % self.grp1, '%s_sp.edr' % self.grp2]
+        energies = read_edrs([self.member(i) + '/' + n
+            for i in self.G_bound.index for n in names])
+        group = self.lj_group
 
-            if self.n > 0:
-                d = "/".join([str(j) for j in i])
-                os.chdir(d)
+        for i in self.G_bound.index:
+            d = self.member(i) + '/'
+            vals = first(get_edr_lj, energies[d+'sp.edr'], group=group)
+            self.G_bound.loc[i, 'LJ (1-4)'] = vals[0]
+            self.G_bound.loc[i, 'LJ (SR)'] = vals[1]
+
+#            With energy groups the unbound values are the terms within
+#            each chain group of the complex.
+            if self.energygroups:
+                vals1 = first(get_edr_lj, energies[d+'sp.edr'],
+                    pair='chains_%s-chains_%s' % (self.grp1, self.grp1))
+                vals2 = first(get_edr_lj, energies[d+'sp.edr'],
+                    pair='chains_%s-chains_%s' % (self.grp2, self.grp2))
 
             else:
-                os.chdir(i)
-
-            vals = next(get_lj('lj.log'))
-            self.G_bound['LJ (1-4)'][i] = vals[0]
-            self.G_bound['LJ (SR)'][i] = vals[1]
-
-            vals = next(get_lj('%s_lj.log' % self.grp1))
-            self.G_grp1['LJ (1-4)'][i] = vals[0]
-            self.G_grp1['LJ (SR)'][i] = vals[1]
+                vals1 = first(get_edr_lj, energies[d+'%s_sp.edr' % self.grp1],
+                    group=group)
+                vals2 = first(get_edr_lj, energies[d+'%s_sp.edr' % self.grp2],
+                    group=group)
 
-            vals = next(get_lj('%s_lj.log' % self.grp2))
-            self.G_grp2['LJ (1-4)'][i] = vals[0]
-            self.G_grp2['LJ (SR)'][i] = vals[1]
-
-            os.chdir(self.maindir)
+            self.G_grp1.loc[i, 'LJ (1-4)'] = vals1[0]
+            self.G_grp1.loc[i, 'LJ (SR)'] = vals1[1]
+            self.G_grp2.loc[i, 'LJ (1-4)'] = vals2[0]
+            self.G_grp2.loc[i, 'LJ (SR)'] = vals2[1]
 
 
     def search_electro(self):
         """Find the files in which the Solvation energies are supposed to be
         written in and save the parsed values in the respective self.G table.
+        Missing values are NaN.
         """
         for i in self.G_bound.index:
+            d = self.member(i) + '/'
 
-            if self.n > 0:
-                d = "/".join([str(j) for j in i])
-                os.chdir(d)
-
-            else:
-                os.chdir(i)
-
-            vals = next(get_electro('solvation.log'))
-            self.G_bound['COUL'][i] = vals[0]
-            self.G_bound['SOLV'][i] = vals[1]
+            vals = first(get_electro, d+'solvation.log')
+            self.G_bound.loc[i, 'COUL'] = vals[0]
+            self.G_bound.loc[i, 'SOLV'] = vals[1]
 
-            vals = next(get_electro('%s_solvation.log' % self.grp1))
-            self.G_grp1['COUL'][i] = vals[0]
-            self.G_grp1['SOLV'][i] = vals[1]
+            vals = first(get_electro, d+'%s_solvation.log' % self.grp1)
+            self.G_grp1.loc[i, 'COUL'] = vals[0]
+            self.G_grp1.loc[i, 'SOLV'] = vals[1]
 
-            vals = next(get_electro('%s_solvation.log' % self.grp2))
-            self.G_grp2['COUL'][i] = vals[0]
-            self.G_grp2['SOLV'][i] = vals[1]
-
-            os.chdir(self.maindir)
+            vals = first(get_electro, d+'%s_solvation.log' % self.grp2)
+            self.G_grp2.loc[i, 'COUL'] = vals[0]
+            self.G_grp2.loc[i, 'SOLV'] = vals[1]
 
 
     def search_area(self):
         """Get the protein-protein interaction surface (PPIS) of the wildtype
         and store it in the ddG table since mutant values are not required.
+        Missing values are NaN.
         """
-        os.chdir(self.wt)
-
-        if self.n > 0:
-
-            for i in range(len(self)):
-                os.chdir(str(i+1))
+        def ppis(d):
+            cmplx, grp1, grp2 = [
+                first(get_area, d+f, default=np.nan) for f in (
+                    "area.xvg",
+                    "%s_area.xvg" % self.grp1,
+                    "%s_area.xvg" % self.grp2
+                )
+            ]
 
-                cmplx = next(get_area("area.xvg"))
-                grp1 = next(get_area("%s_area.xvg" % self.grp1))
-                grp2 = next(get_area("%s_area.xvg" % self.grp2))
+            return grp1 + grp2 - cmplx
 
-                self.G_bound['PPIS'][i] = grp1 + grp2 - cmplx
+        if self.n > 0:
 
-                os.chdir('..')
+            for i in self.G_bound.loc[self.wt].index:
+                self.G_bound.loc[(self.wt, i), 'PPIS'] = \
+                    ppis(self.member((self.wt, i)) + '/')
 
         else:
-            cmplx = next(get_area("area.xvg"))
-            grp1 = next(get_area("%s_area.xvg" % self.grp1))
-            grp2 = next(get_area("%s_area.xvg" % self.grp2))
-
-            self.G_bound_mean['PPIS'] = grp1 + grp2 - cmplx
- 
-        os.chdir(self.maindir)
+            self.G_bound.loc[self.wt, 'PPIS'] = ppis(self.member(self.wt) + '/')
 
 
     def search_data(self):
@@ -1360,35 +3006,60 @@ class AffinityCollector:
         self.search_lj()
         self.search_electro()
         self.search_area()
+        self.search_failures([self.G_bound.drop(columns='PPIS'),
+            self.G_grp1.drop(columns='PPIS'), self.G_grp2.drop(columns='PPIS')])
+        self.means()
 
+        return self.G_bound_mean, self.G_grp1_mean, self.G_grp2_mean
+
+
+    def means(self):
+        """Weighted means of the members of each ensemble in the mean tables.
+        """
         for c in self.G_bound.columns:
  
             for i in self.G_bound_mean.index:
-                self.G_bound_mean.loc[i, c] = self.G_bound.loc[i, c].mean()
-                self.G_grp1_mean.loc[i, c] = self.G_grp1.loc[i, c].mean()
-                self.G_grp2_mean.loc[i, c] = self.G_grp2.loc[i, c].mean()
+                w = self.weights.loc[i]
+                self.G_bound_mean.loc[i, c] = average(self.G_bound.loc[i, c], w)
+                self.G_grp1_mean.loc[i, c] = average(self.G_grp1.loc[i, c], w)
+                self.G_grp2_mean.loc[i, c] = average(self.G_grp2.loc[i, c], w)
 
-        self.G_bound_mean['PPIS'] = self.G_bound.loc[self.wt, 'PPIS'].mean()
-
-        return self.G_bound_mean, self.G_grp1_mean, self.G_grp2_mean
+        self.G_bound_mean['PPIS'] = average(self.G_bound.loc[self.wt, 'PPIS'],
+            self.weights.loc[self.wt])
 
 
     def daffinity(self):
         """Calculate the dG tables for the (un-)bounded state for the mutations
-        by subtracting the wildtype values from it.
+        by subtracting the wildtype values from it. In paired mode the
+        energy terms are mean differences of the pairs of members, with the
+        standard error of their ddG in self.ddG_err.
         """
+        if self.paired:
+            G = self.G_bound - self.G_grp1 - self.G_grp2
+
         for c in self.dG_bound.columns:
 
             for i in self.dG_bound.index:
-                self.dG_bound.loc[i, c] = \
-                    self.G_bound_mean.loc[i, c] - \
-                    self.G_bound_mean.loc[self.wt, c]
-        
-                self.dG_unbound.loc[i, c] = \
-                    (self.G_grp1_mean.loc[i, c] - \
-                    self.G_grp1_mean.loc[self.wt, c]) + \
-                    (self.G_grp2_mean.loc[i, c] - \
-                    self.G_grp2_mean.loc[self.wt, c])
+
+                if self.paired and c != 'PPIS':
+                    w = self.weights
+                    self.dG_bound.loc[i, c] = \
+                        pairwise(self.G_bound, i, self.wt, c, w)[0]
+                    self.dG_unbound.loc[i, c] = \
+                        pairwise(self.G_grp1, i, self.wt, c, w)[0] \
+                        + pairwise(self.G_grp2, i, self.wt, c, w)[0]
+                    self.ddG_err.loc[i, c] = pairwise(G, i, self.wt, c, w)[1]
+
+                else:
+                    self.dG_bound.loc[i, c] = \
+                        self.G_bound_mean.loc[i, c] - \
+                        self.G_bound_mean.loc[self.wt, c]
+
+                    self.dG_unbound.loc[i, c] = \
+                        (self.G_grp1_mean.loc[i, c] - \
+                        self.G_grp1_mean.loc[self.wt, c]) + \
+                        (self.G_grp2_mean.loc[i, c] - \
+                        self.G_grp2_mean.loc[self.wt, c])
 
 
     def ddaffinity(self):
@@ -1407,19 +3078,19 @@ class AffinityCollector:
     
     def fitaffinity(self, alpha, beta, gamma, c, pka=0):
         """Multiply the column of each energy contribution by a certain value.
-        Add constants to values as in the paper.
+        Add constants to values as in the paper. The fitted values are stored
+        in self.ddG_fit, self.ddG stays unfitted so fits can be reapplied.
         """
-        self.ddG["SOLV"] *= alpha
-        self.ddG["COUL"] *= alpha
-        self.ddG["LJ (1-4)"] *= beta
-        self.ddG["LJ (SR)"] *= beta
-        self.ddG["PPIS"] = gamma*self.ddG["PPIS"] + c
-        self.ddG["PKA"] = pka
-
-        for i in self.ddG.index:
-            self.ddG["CALC"][i] = sum(self.ddG.loc[i, "SOLV":])
+        self.ddG_fit = self.ddG.copy()
+        self.ddG_fit["SOLV"] *= alpha
+        self.ddG_fit["COUL"] *= alpha
+        self.ddG_fit["LJ (1-4)"] *= beta
+        self.ddG_fit["LJ (SR)"] *= beta
+        self.ddG_fit["PPIS"] = gamma*self.ddG_fit["PPIS"] + c
+        self.ddG_fit["PKA"] = pka
+        self.ddG_fit["CALC"] = self.ddG_fit.loc[:, "SOLV":].sum(axis=1)
 
-        return self.ddG
+        return self.ddG_fit
 
 
 class GXG(DataGenerator, DataCollector):
@@ -1431,33 +3102,31 @@ class GXG(DataGenerator, DataCollector):
         self,
         flags,
         spmdp,
-        verbosity=0
+        verbosity=0,
+        pb='gropbe',
+        logs=False,
+        retries=0,
+        disco_split=1,
+        minimizer='mdrun'
     ):
         """In contrast to DataGenerator, this constructor does not require the
         wildtype .pdb file or a list of mutations.
         """
-        if verbosity == 0:
-            self.pipe = {
-                'stdout': subprocess.PIPE,
-                'stderr': subprocess.PIPE
-            }
-
-        elif verbosity == 1:
-            self.pipe = {
-                'stdout': None,
-                'stderr': None
-            }
-
-        else:
-            raise ValueError
+        self.pipe = pipes(verbosity, logs)
+        self.disco_split = disco_split
+        self.minimizer = minimizer
         
         self.flags, self.input = parse_flags(flags)
+        self.pipe.update(timeouts=timeouts(self.flags), retries=retries)
         self.flags.setdefault("disco", []).extend(["-op", ""])
+        self.pb = pb
         self.chains = 'A'
         self.n = len(self)
+        self.lj_group = None
         os.mkdir('GXG')
         os.chdir('GXG')
         self.maindir = os.getcwd()
+        self.topologies = self.maindir + '/.topologies'
 
         for x in self.aa1:
             gxg = 'G%sG' % x
@@ -1482,14 +3151,12 @@ class GXG(DataGenerator, DataCollector):
 
         os.chdir(self.maindir)
         self.wds = ['G%sG' % x for x in self.aa1]
-        idx = next(os.walk('.'))[1]
+        idx = [i for i in next(os.walk('.'))[1] if not i.startswith('.')]
         self.G_mean = pd.DataFrame(0.0,
             columns=['SOLV', 'COUL', 'LJ (1-4)', 'LJ (SR)', 'SAS', '-TS'],
             index=idx
         )
-        idx = pd.MultiIndex.from_tuples(
-            [(i, j) for i in idx for j in range(1, len(self)+1)]
-        )
+        idx, self.weights = self.ensembles(idx)
         self.G = pd.DataFrame(0.0,
             columns=['SOLV', 'COUL', 'LJ (1-4)', 'LJ (SR)', 'SAS'],
             index=idx
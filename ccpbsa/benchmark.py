@@ -0,0 +1,184 @@
+import os
+import sys
+import time
+import shlex
+import shutil
+import subprocess
+import numpy as np
+import pandas as pd
+from .CCPBSA import TIMINGS, filecheck
+from .fitting import KCAL, fit
+
+WALL = 'wall.txt' # wall time of a benchmark run, in its directory
+
+
+def read_grid(fname):
+    """Read a grid of settings: one per line, a name followed by the options
+    of the routine for it, e.g. `n10 -f flags_n10.txt` or
+    `quick --no-concoord`. Empty lines and lines starting with # are left
+    out. Files in the options are made absolute, as the runs happen in
+    their own directories.
+    Returns a list of the names and their options.
+    """
+    grid = []
+
+    with open(fname, 'r') as lines:
+
+        for l in lines:
+            l = shlex.split(l, comments=True)
+
+            if len(l) > 0:
+                grid.append((l[0], [dict(filecheck(o)).get(o, o)
+                    for o in l[1:]]))
+
+    names = [g[0] for g in grid]
+
+    if len(set(names)) != len(names):
+        raise ValueError("Settings in %s have to be named uniquely" % fname)
+
+    return grid
+
+
+def run(script, routine, pdb, mutations, options, d, cores):
+    """Run the routine on a protein with the options in the directory d,
+    unless it succeeded there before. Failed runs are run again. Its core
+    hours are the durations of all its tasks from the timings file, or the
+    wall time on all cores if there is none.
+    Returns the run directory, its wall time and core hours in hours and
+    whether it succeeded.
+    """
+    name = os.path.basename(pdb)[:-len('.pdb')]
+    maindir = os.path.join(d, name)
+
+    seconds, returncode = 0, 1
+
+    if os.path.exists(os.path.join(d, WALL)):
+
+        with open(os.path.join(d, WALL), 'r') as wall:
+            seconds, returncode = wall.read().split()
+
+    if int(returncode) != 0:
+
+#        A run that was stopped or failed is started over.
+        shutil.rmtree(d, ignore_errors=True)
+        os.makedirs(d)
+        start = time.time()
+
+#        The wildtype is expected relative to the run directory.
+        with open(os.path.join(d, 'out.log'), 'w') as out:
+            proc = subprocess.run(
+                [sys.executable, script, routine,
+                    '-w', os.path.relpath(pdb, d),
+                    '-m', os.path.relpath(mutations, d),
+                    '--cores', str(cores)] + options,
+                cwd=d,
+                stdout=out,
+                stderr=subprocess.STDOUT
+            )
+
+        seconds, returncode = time.time() - start, proc.returncode
+
+        with open(os.path.join(d, WALL), 'w') as wall:
+            wall.write("%.3f %d\n" % (seconds, returncode))
+
+    seconds = float(seconds)
+    timings = os.path.join(maindir, TIMINGS)
+
+    if os.path.exists(timings):
+        core = pd.read_csv(timings, header=None)[3].sum()
+
+    else:
+        core = seconds * cores
+
+    return maindir, seconds / 3600, core / 3600, int(returncode) == 0
+
+
+def accuracy(calc, exp):
+    """Number of variants, Pearson and Spearman correlation and root mean
+    square error (kJ/mol) of computed against experimental values, on the
+    variants with both.
+    """
+    both = pd.concat([calc, exp], axis=1, keys=['CALC', 'EXP']).dropna()
+    x, y = both['CALC'], both['EXP']
+
+    if len(both) < 2:
+        return dict(N=len(both), PEARSON=np.nan, SPEARMAN=np.nan, RMSE=np.nan)
+
+    return dict(
+        N=len(both),
+        PEARSON=x.corr(y),
+        SPEARMAN=x.corr(y, method='spearman'),
+        RMSE=np.sqrt(((x - y)**2).mean()),
+    )
+
+
+def benchmark(grid, proteins, inputs, experiments, workdir, script,
+    routine='stability', cores=1):
+    """Run every setting of the grid on every protein and score it against
+    experiment. The structures and mutations are read from inputs
+    (<protein>.pdb, mutations_<protein>.txt), the experimental values from
+    experiments (<protein>-compare.csv, in kcal/mol). Runs go to
+    workdir/<setting>/<protein>, finished ones are reused.
+    The scores use the fitted ddG of each run. The ALL row of a setting
+    pools its proteins and, with more than one, adds the correlation and
+    error of refitting the parameters with one protein left out at a time
+    (LOPO), so settings are not judged by parameters fitted for another.
+    Returns the report with a row for each setting and protein.
+    """
+    rows = []
+
+    for setting, options in grid:
+        tables = os.path.join(workdir, setting, 'tables')
+        os.makedirs(tables, exist_ok=True)
+        calcs = []
+        exps = []
+        wall = core = 0.0
+
+        for p in proteins:
+            maindir, w, c, ok = run(
+                script,
+                routine,
+                os.path.join(inputs, p + '.pdb'),
+                os.path.join(inputs, 'mutations_%s.txt' % p),
+                options,
+                os.path.join(workdir, setting, p),
+                cores
+            )
+            wall += w
+            core += c
+            compare = os.path.join(experiments, p + '-compare.csv')
+            exp = pd.read_csv(compare, index_col=0)['EXP'] * KCAL
+            fitted = os.path.join(maindir, 'ddG_fit.csv')
+
+            if ok and os.path.exists(fitted):
+                calc = pd.read_csv(fitted, index_col=0)['CALC']
+                shutil.copy(os.path.join(maindir, 'ddG.csv'),
+                    os.path.join(tables, p + '.csv'))
+                shutil.copy(compare, tables)
+
+            else:
+                calc = pd.Series(np.nan, index=exp.index)
+
+            calcs.append(calc)
+            exps.append(exp)
+            rows.append(dict(accuracy(calc, exp), SETTING=setting, PROTEIN=p,
+                FAILED=not ok, **{'WALL-H': w, 'CORE-H': c}))
+
+        row = dict(accuracy(pd.concat(calcs, keys=proteins),
+            pd.concat(exps, keys=proteins)), SETTING=setting,
+            PROTEIN='ALL', FAILED=any(r['FAILED'] for r in rows[-len(proteins):]),
+            **{'WALL-H': wall, 'CORE-H': core})
+        scored = [f for f in os.listdir(tables) if f.endswith('-compare.csv')]
+
+        if len(scored) > 1:
+            scores = fit(tables, kind=routine)[1]
+            row['LOPO RMSE'] = scores.loc['leave-one-protein-out', 'RMSE']
+            row['LOPO R'] = scores.loc['leave-one-protein-out', 'R']
+
+        rows.append(row)
+
+    columns = ['N', 'FAILED', 'WALL-H', 'CORE-H', 'PEARSON', 'SPEARMAN',
+        'RMSE', 'LOPO RMSE', 'LOPO R']
+
+    return pd.DataFrame(rows).set_index(['SETTING', 'PROTEIN']) \
+        .reindex(columns=columns)
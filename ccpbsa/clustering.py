@@ -0,0 +1,121 @@
+import os
+import numpy as np
+import pandas as pd
+
+CLUSTERS = 'clusters.csv' # clusters of an ensemble, in its directory
+
+
+def rmsd_matrix(X):
+    """RMSD (nm) of all pairs of structures X (members x atoms x 3) after
+    optimal superposition. The rotation of each pair follows from the
+    singular values of its correlation matrix (Kabsch), so no structure is
+    actually rotated, and all correlation matrices come from one product.
+    """
+    M, N = X.shape[:2]
+    X = X - X.mean(axis=1, keepdims=True)
+    norms = (X**2).sum(axis=(1, 2))
+    A = X.transpose(0, 2, 1).reshape(3 * M, N)
+    H = (A @ A.T).reshape(M, 3, M, 3).transpose(0, 2, 1, 3)
+    s = np.linalg.svd(H, compute_uv=False)
+    s[..., 2] *= np.sign(np.linalg.det(H))
+    msd = (norms[:, None] + norms[None, :] - 2 * s.sum(axis=2)) / N
+    np.fill_diagonal(msd, 0)
+
+    return np.sqrt(np.clip(msd, 0, None))
+
+
+def gromos(D, cutoff):
+    """Cluster by the distance matrix D as gmx cluster -method gromos: the
+    member with the most neighbours within cutoff is the center of a cluster
+    of it and these neighbours, which are removed, until none are left.
+    Returns the center of the cluster of each member.
+    """
+    neighbours = D <= cutoff
+    left = np.ones(len(D), dtype=bool)
+    centers = np.zeros(len(D), dtype=int)
+
+    while left.any():
+        counts = neighbours[:, left].sum(axis=1) * left
+        c = np.argmax(counts)
+        cluster = neighbours[c] & left
+        centers[cluster] = c
+        left &= ~cluster
+
+    return centers
+
+
+def write_clusters(members, X, cutoff, fname=CLUSTERS):
+    """Cluster the structures X of the members (numbers) of an ensemble and
+    write the cluster of each member, named by its center, with the RMSD to
+    it.
+    Returns the table.
+    """
+    D = rmsd_matrix(X)
+    centers = gromos(D, cutoff)
+    table = pd.DataFrame(
+        {
+            'CLUSTER': [members[c] for c in centers],
+            'RMSD': D[np.arange(len(D)), centers],
+        },
+        index=pd.Index(members, name='MEMBER')
+    )
+    table.to_csv(fname)
+
+    return table
+
+
+def superpose(X, ref):
+    """The structures X (members x atoms x 3) superposed onto the structure
+    ref (atoms x 3) by the rotation of Kabsch.
+    """
+    X = X - X.mean(axis=1, keepdims=True)
+    center = ref.mean(axis=0)
+    U, _, Vt = np.linalg.svd(X.transpose(0, 2, 1) @ (ref - center))
+    d = np.sign(np.linalg.det(U @ Vt))
+    U[..., 2] *= d[:, None]
+
+    return X @ U @ Vt + center
+
+
+def displace(x, ref, X):
+    """Coordinates of the structures X about the structure x, which stands in
+    for ref: the deviation of each from ref, after superposition, added to x.
+    """
+    return x + superpose(X, ref) - ref
+
+
+def cluster_weights(d, n):
+    """Members of the ensemble in d to evaluate with their weights: the
+    centers of the clusters with their size if d was clustered, else all n
+    members once.
+    """
+    fname = d + '/' + CLUSTERS
+
+    if not os.path.exists(fname):
+        return [(i, 1) for i in range(1, n+1)]
+
+    sizes = pd.read_csv(fname, index_col=0)['CLUSTER'].value_counts()
+
+    return sorted((int(i), int(w)) for i, w in sizes.items())
+
+
+def summary(ensembles):
+    """Members, clusters, the share of members left to evaluate and the mean
+    RMSD of the members to their centers of each clustered ensemble.
+    """
+    rows = {}
+
+    for d in ensembles:
+
+        if os.path.exists(d + '/' + CLUSTERS):
+            table = pd.read_csv(d + '/' + CLUSTERS, index_col=0)
+            clusters = table['CLUSTER'].nunique()
+            rows[d] = {
+                'MEMBERS': len(table),
+                'CLUSTERS': clusters,
+                'EVALUATED': clusters / len(table),
+                'RMSD': table['RMSD'].mean(),
+            }
+
+    return pd.DataFrame(rows, index=['MEMBERS', 'CLUSTERS', 'EVALUATED',
+        'RMSD']).T
@@ -0,0 +1,171 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from .topology import Topology, lj_parameters, exclusions
+from .pbsolver import ONE_4PI_EPS0, radius
+from .CCPBSA import read_gro, read_pdb, residues, residue_index
+from .trajectory import last_frames
+from .spatial import SpatialIndex
+
+PROBE = 0.14 # nm, radius of the solvent probe
+SPHERE = 96 # points per atom for the surface
+BLOCK = 2**21 # pair energies computed at once
+
+#    Interactions of each residue with the whole structure and, with a
+#    partner, with the other chain group only. SAS is the solvent accessible
+#    surface in the complex, BSA the part of it buried by the partner.
+TERMS = ['LJ', 'COUL']
+PARTNER = ['LJ (partner)', 'COUL (partner)']
+
+
+def sphere(n=SPHERE):
+    """n evenly spread points on the unit sphere.
+    """
+    k = np.arange(n) + 0.5
+    z = 1 - 2 * k / n
+    phi = np.pi * (1 + 5**0.5) * k
+    r = np.sqrt(1 - z**2)
+
+    return np.stack([r * np.cos(phi), r * np.sin(phi), z], axis=1)
+
+
+def sasa(xyz, radii, probe=PROBE, n=SPHERE):
+    """Solvent accessible surface (nm^2) of each atom by the Shrake-Rupley
+    method: the share of points around an atom not inside any neighbour.
+    """
+    R = radii + probe
+    dots = sphere(n)
+    pairs = np.stack(SpatialIndex(xyz).pairs(2 * R.max()), axis=1)
+    pairs = np.concatenate([pairs, pairs[:, ::-1]])
+    buried = np.zeros((len(xyz), n), dtype=bool)
+
+    for c in range(0, len(pairs), 4096):
+        i, j = pairs[c:c+4096].T
+        p = xyz[i, None, :] + R[i, None, None] * dots[None, :, :]
+        hit = ((p - xyz[j, None, :])**2).sum(axis=2) < R[j, None]**2
+        np.logical_or.at(buried, i, hit)
+
+    return 4 * np.pi * R**2 * (1 - buried.mean(axis=1))
+
+
+def half(acc, e, i):
+    """Give each atom of the pairs in e (members x rows i x all atoms) half
+    of their energy.
+    """
+    acc[:, i] += e.sum(axis=2) / 2
+    acc += e.sum(axis=1) / 2
+
+
+def pair_energies(X, q, t, C6, C12, excl, group=None, eps=1.0):
+    """Non-bonded energies of all atoms of the structures X (members x atoms
+    x 3), without cutoff as in the energy .mdp. The energy of each pair is
+    split evenly between its atoms, so the atoms sum up to the total. All
+    members are done at once, in blocks of rows.
+    Returns the energies per member and atom of each term.
+    """
+    M, N = X.shape[:2]
+    size = max(1, BLOCK // (M * N))
+    acc = dict((k, np.zeros((M, N))) for k in TERMS + PARTNER)
+
+    for c in range(0, N, size):
+        i = np.arange(c, min(c + size, N))
+        keep = (i[:, None] < np.arange(N)[None, :]) & ~excl[i].toarray()
+        d = np.linalg.norm(X[:, i, None, :] - X[:, None, :, :], axis=3)
+        r = np.where(keep, d, np.inf)
+        inv6 = r**-6
+        energies = {
+            'LJ': C12[t[i, None], t] * inv6**2 - C6[t[i, None], t] * inv6,
+            'COUL': ONE_4PI_EPS0 / eps * np.outer(q[i], q) / r,
+        }
+
+        for k, e in energies.items():
+            half(acc[k], e, i)
+
+            if group is not None:
+                half(acc[k + ' (partner)'], e * (group[i, None] != group), i)
+
+    return acc
+
+
+def ensemble(structures, chains=None, eps=1.0):
+    """Per residue energies and surfaces of structures with the same
+    topology, given as (.gro, .top, .pdb) files. With chains, the residues of
+    those chains and the rest are partners, whose interactions and buried
+    surface are reported separately.
+    Returns the residues as (chain, residue number, name) and a dictionary
+    of arrays (members x residues) of each term.
+    """
+    gro, top, pdb = structures[0]
+    top = Topology(top)
+    atoms = top.atoms()
+    _, groatoms, _, _ = read_gro(gro)
+
+    if len(atoms) != len(groatoms):
+        raise Exception("Atoms of %s and %s do not match" % (gro, top))
+
+    resid = residue_index(groatoms)
+    res = residues(read_pdb(pdb)[0])
+
+    if resid[-1] + 1 != len(res):
+        raise Exception("Residues of %s and %s do not match" % (pdb, gro))
+
+    names = [groatoms[i][1] for i in np.searchsorted(resid, range(len(res)))]
+    group = None if chains is None \
+        else np.array([r[0] in chains for r in res])[resid]
+
+    q = np.array([a['charge'] for a in atoms])
+    radii = np.array([radius(a['name']) for a in atoms])
+    t, C6, C12 = lj_parameters(top)
+    X = last_frames([s[0] for s in structures],
+        np.empty((len(structures), len(groatoms), 3)))
+    per_atom = pair_energies(X, q, t, C6, C12, exclusions(top), group, eps)
+    per_atom['SAS'] = np.stack([sasa(x, radii) for x in X])
+
+    if group is not None:
+        unbound = np.zeros(X.shape[:2])
+
+        for g in (group, ~group):
+            unbound[:, g] = np.stack([sasa(x[g], radii[g]) for x in X])
+
+        per_atom['BSA'] = unbound - per_atom['SAS']
+
+    else:
+
+        for k in PARTNER:
+            del per_atom[k]
+
+#    Sum the atoms of each residue for all members at once.
+    R = sp.csr_matrix(
+        (np.ones(len(resid)), (np.arange(len(resid)), resid)),
+        shape=(len(resid), len(res))
+    )
+    values = dict((k, (R.T @ v.T).T) for k, v in per_atom.items())
+
+    return [r + (n,) for r, n in zip(res, names)], values
+
+
+def summarize(results):
+    """Mean and standard deviation over all members of the results of
+    ensemble, which may come in batches. TOTAL is the sum of the energies,
+    with a partner only of the interactions with it. Sorted by TOTAL, so the
+    residues contributing the most come first.
+    """
+    if len(results) == 0:
+        raise ValueError("No members succeeded")
+
+    res = results[0][0]
+    values = dict((k, np.concatenate([r[1][k] for r in results]))
+        for k in results[0][1])
+    index = pd.MultiIndex.from_tuples(res, names=['CHAIN', 'RESIDUE', 'NAME'])
+    mean = pd.DataFrame(
+        dict((k, v.mean(axis=0)) for k, v in values.items()), index=index
+    )
+    std = pd.DataFrame(
+        dict((k, v.std(axis=0)) for k, v in values.items()), index=index
+    )
+    terms = PARTNER if PARTNER[0] in values else TERMS
+    mean['TOTAL'] = mean[terms].sum(axis=1)
+    std['TOTAL'] = sum(values[k] for k in terms).std(axis=0)
+    order = mean['TOTAL'].sort_values().index
+
+    return mean.loc[order], std.loc[order]
@@ -0,0 +1,237 @@
+import struct
+import numpy as np
+
+#    GROMACS energy files (.edr) are XDR encoded, i.e. big endian with every
+#    item padded to 4 bytes. The file starts with the names and units of
+#    the energy terms, followed by the frames: a header, the value of each
+#    term (with its average and sum over the steps since the last frame if
+#    these were kept) and blocks of further data, which are skipped here.
+#    Reals are floats or doubles, depending on the precision of mdrun.
+NAMES_MAGIC = -55555
+FRAME_MAGIC = -7777777
+CHECK = -1e10 # the first real of a frame header is -2e10
+VERSION = 5 # newest version of the format
+BLOCK_TYPES = {0: '>i4', 1: '>f4', 2: '>f8', 3: '>i8', 4: '>u4'}
+STRING = 5 # block data type of strings
+
+
+class Unpacker:
+    """Reads the XDR items of a buffer one after another.
+    """
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+
+    def done(self):
+        return self.pos >= len(self.data)
+
+
+    def unpack(self, fmt):
+        value = struct.unpack_from(fmt, self.data, self.pos)[0]
+        self.pos += struct.calcsize(fmt)
+
+        return value
+
+
+    def int(self):
+        return self.unpack('>i')
+
+
+    def int64(self):
+        return self.unpack('>q')
+
+
+    def float(self):
+        return self.unpack('>f')
+
+
+    def double(self):
+        return self.unpack('>d')
+
+
+    def array(self, dtype, n):
+        """n items of the numpy dtype, each padded to 4 bytes.
+        """
+        a = np.frombuffer(self.data, dtype=dtype, count=n, offset=self.pos)
+        self.pos += a.nbytes
+
+        return a
+
+
+    def string(self):
+        """An XDR string: its length, then the characters.
+        """
+        n = self.unpack('>I')
+        s = bytes(self.data[self.pos:self.pos+n]).decode('utf-8', 'replace')
+        self.pos += n + (-n) % 4
+
+        return s
+
+
+def precision(data, pos):
+    """The real type of the frames of an energy file, whose first frame
+    starts at pos: the first real of a frame header is a marker below CHECK,
+    read as either type.
+    """
+    for dtype in ('>f4', '>f8'):
+
+        if len(data) >= pos + 8 and np.frombuffer(data, dtype, 1, pos)[0] < CHECK:
+            return dtype
+
+    if len(data) == pos:
+        return '>f4' # no frames
+
+    raise ValueError("Energy file of an unsupported format")
+
+
+def read_names(unpacker):
+    """Names and units of the energy terms.
+    """
+    magic = unpacker.int()
+
+    if magic != NAMES_MAGIC:
+        raise ValueError("Not an energy file or of a version before 2")
+
+    version = unpacker.int()
+
+    if version > VERSION:
+        raise ValueError("Energy file of an unknown version %d" % version)
+
+    nre = unpacker.int()
+    terms = [(unpacker.string(), unpacker.string()) for _ in range(nre)]
+
+    return [t[0] for t in terms], [t[1] for t in terms]
+
+
+def read_frame(unpacker, real):
+    """Time, step and energies of the next frame.
+    """
+    unpacker.array(real, 1)
+
+    if unpacker.int() != FRAME_MAGIC:
+        raise ValueError("Corrupt energy frame")
+
+    version = unpacker.int()
+    time = unpacker.double()
+    step = unpacker.int64()
+    nsum = unpacker.int()
+
+    if version >= 3:
+        unpacker.int64() # nsteps
+
+    if version >= 5:
+        unpacker.double() # dt
+
+    nre = unpacker.int()
+    unpacker.int() # reserved
+    nblock = unpacker.int()
+    subs = []
+
+    for _ in range(nblock):
+        unpacker.int() # id
+        nsub = unpacker.int()
+        subs.extend((unpacker.int(), unpacker.int()) for _ in range(nsub))
+
+    for _ in range(3): # sizes and reserved
+        unpacker.int()
+
+#    Each term has its value, with nsum > 0 followed by average and sum.
+    stride = 3 if nsum > 0 else 1
+    energies = unpacker.array(real, nre * stride)[::stride]
+
+    for dtype, nr in subs:
+
+        if dtype == STRING:
+
+            for _ in range(nr):
+                unpacker.string()
+
+        else:
+            unpacker.array(BLOCK_TYPES[dtype], nr)
+
+    return time, step, energies
+
+
+def read_edr(fname):
+    """Read all frames of a GROMACS energy file. Returns a structured array
+    with a row per frame and a field per energy term, named as by gmx
+    energy, besides the fields Time and Step.
+    """
+    with open(fname, 'rb') as edr:
+        data = edr.read()
+
+    unpacker = Unpacker(data)
+
+    try:
+        names, _ = read_names(unpacker)
+
+    except struct.error:
+        raise ValueError("Truncated energy file")
+
+    real = precision(data, unpacker.pos)
+    frames = []
+
+    while not unpacker.done():
+
+        try:
+            frame = read_frame(unpacker, real)
+
+        except struct.error:
+            break # a frame cut off by an interrupted run
+
+#        Frames with blocks only have no energies.
+        if len(frame[2]) > 0:
+            frames.append(frame)
+
+    dtype = [('Time', 'f8'), ('Step', 'i8')] + [(n, 'f8') for n in names]
+    table = np.zeros(len(frames), dtype=dtype)
+
+    for i, (time, step, energies) in enumerate(frames):
+        table[i] = (time, step) + tuple(energies[:len(names)])
+
+    return table
+
+
+def read_edrs(files):
+    """Read the energy files of many structures at once. Files that can not
+    be read are None.
+    """
+    tables = {}
+
+    for f in files:
+
+        try:
+            tables[f] = read_edr(f)
+
+        except (OSError, ValueError):
+            tables[f] = None
+
+    return tables
+
+
+def lj_terms(table, pair='', group=None):
+    """Mean Lennard-Jones 1-4 and short range energies over the frames of an
+    energy table. With pair (e.g. 'grpA-grpB') only the terms of that pair
+    of energy groups, with group all terms of pairs including it, else the
+    totals.
+    """
+    names = table.dtype.names
+
+    if pair != '':
+        keys = ['LJ-14:' + pair], ['LJ-SR:' + pair]
+
+    elif group is not None:
+        keys = [[n for n in names if n.startswith(t)
+            and group in n[len(t):].split('-')]
+            for t in ('LJ-14:', 'LJ-SR:')]
+
+    else:
+        keys = ['LJ-14'], ['LJ (SR)']
+
+    missing = [k for ks in keys for k in ks if k not in names]
+
+    if len(missing) > 0 or len(table) == 0:
+        raise ValueError("Missing energy terms: %s" % ", ".join(missing))
+
+    return tuple(sum(table[k].mean() for k in ks) for ks in keys)
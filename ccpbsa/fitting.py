@@ -0,0 +1,164 @@
+import os
+import numpy as np
+import pandas as pd
+
+KCAL = 4.18 # kJ/kcal, experimental values are given in kcal/mol
+
+#    Parameters of each kind of fit and the ddG columns they scale. A column
+#    of None stands for the constant c.
+TERMS = {
+    'stability': [
+        ('alpha', ['SOLV', 'COUL']),
+        ('beta', ['LJ (1-4)', 'LJ (SR)']),
+        ('gamma', ['SAS']),
+        ('tau', ['-TS']),
+    ],
+    'affinity': [
+        ('alpha', ['SOLV', 'COUL']),
+        ('beta', ['LJ (1-4)', 'LJ (SR)']),
+        ('gamma', ['PPIS']),
+        ('c', None),
+    ],
+}
+
+
+def design(ddG, kind):
+    """Design matrix of the fit from an unfitted ddG table: one column per
+    parameter, holding the sum of the energy terms it scales.
+    """
+    cols = []
+
+    for name, terms in TERMS[kind]:
+
+        if terms is None:
+            cols.append(np.ones(len(ddG)))
+
+        else:
+            cols.append(ddG[terms].sum(axis=1).values)
+
+    return np.stack(cols, axis=1)
+
+
+def load(directory, kind='stability', proteins=None):
+    """Load the stored unfitted ddG tables (<protein>.csv) and the
+    experimental values (<protein>-compare.csv, column EXP) of a directory.
+    Without a list of proteins, all with both files are used.
+    Returns the design matrix, the experimental values in kJ/mol and the
+    protein of each row.
+    """
+    if proteins is None:
+        proteins = sorted(f[:-len('-compare.csv')] for f in os.listdir(directory)
+            if f.endswith('-compare.csv') and os.path.exists(
+                os.path.join(directory, f[:-len('-compare.csv')] + '.csv')
+            ))
+
+    X = []
+    y = []
+    groups = []
+
+    for p in proteins:
+        calc = pd.read_csv(os.path.join(directory, p + '.csv'), index_col=0)
+        exp = pd.read_csv(
+            os.path.join(directory, p + '-compare.csv'), index_col=0
+        )
+        idx = calc.index.intersection(exp.index).sort_values()
+        X.append(design(calc.loc[idx], kind))
+        y.append(exp.loc[idx, 'EXP'].values * KCAL)
+        groups.extend([p] * len(idx))
+
+    return np.concatenate(X), np.concatenate(y), np.array(groups)
+
+
+def lstsq(X, y):
+    """Closed form linear least squares solution for the parameters.
+    """
+    return np.linalg.lstsq(X, y, rcond=None)[0]
+
+
+def score(X, y, P):
+    """Score many parameter sets at once. P has one parameter set per row.
+    Returns the root mean square error and the Pearson correlation of each
+    set, computed from a single matrix product.
+    """
+    P = np.atleast_2d(P)
+    Y = P @ X.T
+    rmse = np.sqrt(((Y - y)**2).mean(axis=1))
+    Yc = Y - Y.mean(axis=1)[:, None]
+    yc = y - y.mean()
+    r = (Yc @ yc) / (np.linalg.norm(Yc, axis=1) * np.linalg.norm(yc))
+
+    return rmse, r
+
+
+def cross_validate(X, y, folds):
+    """Fit on all but one fold and predict the left out one, for every fold.
+    folds holds the fold label of each row. Returns the predictions.
+    """
+    pred = np.zeros(len(y))
+
+    for f in np.unique(folds):
+        test = folds == f
+        pred[test] = X[test] @ lstsq(X[~test], y[~test])
+
+    return pred
+
+
+def kfold(n, k, seed=0):
+    """Random assignment of n rows to k folds.
+    """
+    return np.random.default_rng(seed).permutation(n) % k
+
+
+def candidates(p, n, spread=0.5, seed=0):
+    """n parameter sets drawn uniformly within +-spread (relative) around the
+    parameters p. The first row is p itself.
+    """
+    rng = np.random.default_rng(seed)
+    P = p * (1 + rng.uniform(-spread, spread, (n, len(p))))
+    P[0] = p
+
+    return P
+
+
+def fit(directory, kind='stability', proteins=None, k=5, n=10000, seed=0):
+    """Fit the parameters on the stored tables and validate them. Returns the
+    fitted parameters as a dictionary and a table of the validation scores.
+    """
+    X, y, groups = load(directory, kind, proteins)
+    p = lstsq(X, y)
+    names = [name for name, _ in TERMS[kind]]
+    rows = []
+
+    rmse, r = score(X, y, p)
+    rows.append(('fit', rmse[0], r[0]))
+
+    pred = cross_validate(X, y, kfold(len(y), k, seed))
+    rmse, r = score(pred[:, None], y, [1])
+    rows.append(('%d-fold' % k, rmse[0], r[0]))
+
+    pred = cross_validate(X, y, groups)
+    rmse, r = score(pred[:, None], y, [1])
+    rows.append(('leave-one-protein-out', rmse[0], r[0]))
+
+    P = candidates(p, n, seed=seed)
+    rmse, r = score(X, y, P)
+    best = np.argmax(r)
+    rows.append(('best of %d candidates' % n, rmse[best], r[best]))
+
+    scores = pd.DataFrame(rows, columns=['VALIDATION', 'RMSE', 'R']) \
+        .set_index('VALIDATION')
+    candidate = pd.Series(P[best], index=names)
+
+    return dict(zip(names, p.tolist())), scores, candidate
+
+
+def write_fit(fname, parameters, kind='stability'):
+    """Write parameters in the format of the fit_*.txt files.
+    """
+    with open(fname, 'w') as out:
+
+        for k, v in parameters.items():
+            out.write('%s=%g\n' % (k, v))
+
+        if kind == 'affinity' and 'pka' not in parameters:
+            out.write('pka=0\n')
@@ -0,0 +1,629 @@
+import numpy as np
+from .pbsolver import ONE_4PI_EPS0
+from .topology import Topology, combination, lj_parameters, exclusions
+
+BLOCK = 2**19 # pair interactions computed at once
+PAIRS = 2**15 # pairs of a block, the same for any number of members
+HISTORY = 10 # correction pairs of L-BFGS kept per member
+MAXSTEP = 0.05 # nm, longest move of an atom in one step
+BACKTRACK = 30 # halvings of a step before the line search gives up
+ARMIJO = 1e-4 # sufficient decrease of the line search
+
+#    Energy terms as mdrun computes them with the minimization .mdp: the
+#    bonded interactions of the common function types, the 1-4 pairs and
+#    all other pairs within the cutoffs, with Coulomb scaled by the function
+#    f(r) of the table given to mdrun with -table (-tablep for the pairs)
+#    and dispersion and repulsion by g(r) and h(r), if the .mdp asks for
+#    user functions. Energies in kJ/mol, lengths in nm.
+TERMS = ['BOND', 'ANGLE', 'DIHEDRAL', 'LJ (1-4)', 'COUL (1-4)', 'LJ (SR)',
+    'COUL (SR)']
+
+#    Atoms and supported function types of each bonded section, with the
+#    number of parameters of each.
+BONDED = {
+    'bonds': (2, {1: 2, 2: 2}),
+    'angles': (3, {1: 2, 2: 2, 5: 4}),
+    'dihedrals': (4, {1: 3, 2: 2, 3: 6, 4: 3, 9: 3}),
+    'pairs': (2, {1: 2}),
+}
+TYPES = {'bonds': 'bondtypes', 'angles': 'angletypes',
+    'dihedrals': 'dihedraltypes', 'pairs': 'pairtypes'}
+
+
+def parse_mdp(fname):
+    """Read an .mdp file into a dictionary of strings. Keys are lower case
+    without dashes and underscores, e.g. coulombtype for coulomb-type.
+    """
+    mdp = {}
+
+    for l in open(fname, 'r').readlines():
+        l = l.split(';')[0]
+
+        if '=' in l:
+            k, v = l.split('=', 1)
+            k = k.strip().lower().replace('-', '').replace('_', '')
+            mdp[k] = v.strip()
+
+    return mdp
+
+
+def read_table(fname):
+    """Read an mdrun table: r, then f, -f', g, -g', h and -h' on an evenly
+    spaced grid. Returns the spacing and the values and derivatives (points
+    x 3) of f, g and h.
+    """
+    T = np.loadtxt(fname, comments=['#', '@'])
+
+    return T[1, 0] - T[0, 0], T[:, [1, 3, 5]], -T[:, [2, 4, 6]]
+
+
+def hermite(table, columns):
+    """Cubic Hermite coefficients (intervals x 4 x functions) of the
+    functions in columns of a table from read_table: value and derivative
+    times the spacing at both ends of each interval.
+    """
+    dr, V, D = table
+    V = V[:, columns]
+    D = D[:, columns] * dr
+
+    return dr, np.stack([V[:-1], D[:-1], V[1:], D[1:]], axis=1), columns
+
+
+def functions(r, W, table=None, plain=(False, False, False)):
+    """Energies (members x pairs) of pairs at the distances r, the sums of
+    f, g and h weighted by the coefficients W (pairs x 3), and their
+    derivatives by r. The functions are interpolated from the Hermite table
+    (see hermite), those in plain are 1/r, -1/r^6 and 1/r^12.
+    """
+    e = np.zeros(r.shape)
+    de = np.zeros(r.shape)
+
+    if table is not None:
+        dr, H, columns = table
+        x = r / dr
+        k = np.minimum(x.astype(np.int32), len(H) - 1)
+        t = x - k
+        a = np.einsum('...jc,...c->...j', H[k], W[:, columns])
+        e += a[..., 0] + t * (a[..., 1] + t * (3 * (a[..., 2] - a[..., 0])
+            - 2 * a[..., 1] - a[..., 3] + t * (2 * (a[..., 0] - a[..., 2])
+            + a[..., 1] + a[..., 3])))
+        de += (a[..., 1] + t * (6 * (a[..., 2] - a[..., 0]) - 4 * a[..., 1]
+            - 2 * a[..., 3] + t * (6 * (a[..., 0] - a[..., 2])
+            + 3 * (a[..., 1] + a[..., 3])))) / dr
+
+    inv = 1 / r
+
+    if plain[0]:
+        e += W[:, 0] * inv
+        de -= W[:, 0] * inv * inv
+
+    if plain[1]:
+        inv6 = (inv * inv)**3
+        e += inv6 * (W[:, 2] * inv6 - W[:, 1])
+        de += inv6 * inv * (6 * W[:, 1] - 12 * W[:, 2] * inv6)
+
+    return e, de
+
+
+def bonded_types(top):
+    """Bonded type of each atom type: the second column of atomtypes lines
+    with eight of them (as in OPLS-AA), else the atom type itself.
+    """
+    return dict((t[0], t[1] if len(t) >= 8 else t[0])
+        for t in top.sections.get('atomtypes', []))
+
+
+def match(types, pattern):
+    """Number of atom types matched exactly by the types of a bondtypes,
+    angletypes etc. line, in either direction, with X matching any type.
+    None if it does not match.
+    """
+    best = None
+
+    for p in (pattern, pattern[::-1]):
+
+        if all(a == b or b == 'X' for a, b in zip(types, p)):
+            n = sum(b != 'X' for b in p)
+            best = n if best is None else max(best, n)
+
+    return best
+
+
+def lookup(lines, types, funct):
+    """Parameters of an interaction of function funct between atoms of the
+    bonded types from the lines of a bondtypes, angletypes, dihedraltypes or
+    pairtypes section: those of the most specific matching line, for
+    dihedrals of function 9 also of the lines with the same types after it.
+    Dihedral lines of two types give the middle atoms of proper dihedrals
+    and the outer ones of improper dihedrals.
+    Returns a list of parameter lists.
+    """
+    found = []
+
+    for n, l in enumerate(lines):
+        k = len(types)
+        t = types
+
+        if k == 4 and l[2].lstrip('-').isdigit():
+            k = 2
+            t = types[1:3] if funct in (1, 3, 9) else types[::3]
+
+        if int(l[k]) != funct:
+            continue
+
+        score = match(t, l[:k])
+
+        if score is not None:
+            found.append((score, -n, k))
+
+    if len(found) == 0:
+        raise ValueError("No parameters of function %d for types %s"
+            % (funct, " ".join(types)))
+
+    _, first, k = max(found)
+    n = -first
+    params = [lines[n][k+1:]]
+
+    if funct == 9:
+
+        for l in lines[n+1:]:
+
+            if l[:k+1] != lines[n][:k+1]:
+                break
+
+            params.append(l[k+1:])
+
+    return [[float(p) for p in ps] for ps in params]
+
+
+def interactions(top):
+    """Bonded interactions of all molecules of a Topology by section and
+    function type: the atoms (interactions x atoms, 0 based) and their
+    parameters. Parameters missing in a molecule are looked up by the bonded
+    types of its atoms, those of pairs by the atom types. Pairs are given as C6 and C12, generated from the
+    atom types with fudgeLJ if there are no pairtypes for them and the
+    defaults say so.
+    """
+    bt = bonded_types(top)
+    defaults = top.sections.get('defaults', [['1', '1']])[0]
+    comb = int(defaults[1])
+    gen_pairs = len(defaults) > 2 and defaults[2].lower() == 'yes'
+    fudge_lj = float(defaults[3]) if len(defaults) > 3 else 1.0
+    index, C6, C12 = combination(top)
+    found = {}
+    offset = 0
+
+    for name, count in top.molecules:
+        mol = top.moleculetypes[name]
+        atypes = [a[1] for a in mol.get('atoms', [])]
+        own = {}
+
+        for section, (k, functs) in BONDED.items():
+            lines = top.sections.get(TYPES[section], [])
+
+            for l in mol.get(section, []):
+                atoms = [int(a) - 1 for a in l[:k]]
+                funct = int(l[k])
+
+                if funct not in functs:
+                    raise ValueError("Function %d in [ %s ] of %s is not "
+                        "supported" % (funct, section, name))
+
+#                Pairtypes are given for atom types, as in mdrun.
+                types = [atypes[a] if section == 'pairs' else bt[atypes[a]]
+                    for a in atoms]
+
+                if len(l) > k + 1:
+                    params = [[float(p) for p in l[k+1:]]]
+
+                elif section == 'pairs' and gen_pairs:
+
+                    try:
+                        params = lookup(lines, types, funct)
+
+                    except ValueError:
+                        i, j = [index[atypes[a]] for a in atoms]
+                        p = [fudge_lj * C6[i, j], fudge_lj * C12[i, j]]
+                        own.setdefault((section, funct), []).append((atoms, p))
+                        continue
+
+                else:
+                    params = lookup(lines, types, funct)
+
+                for p in params:
+                    p = p[:functs[funct]]
+
+#                    Pairs of sigma and epsilon force fields are given as
+#                    these.
+                    if section == 'pairs' and comb != 1:
+                        p = [4 * p[1] * p[0]**6, 4 * p[1] * p[0]**12]
+
+                    own.setdefault((section, funct), []).append((atoms, p))
+
+        for c in range(count):
+
+            for key, items in own.items():
+                found.setdefault(key, []).extend(
+                    ([a + offset for a in atoms], p) for atoms, p in items)
+
+            offset += len(atypes)
+
+    return dict((key, (
+        np.array([i[0] for i in items], dtype=int),
+        np.array([i[1] for i in items], dtype=float),
+    )) for key, items in found.items())
+
+
+def accumulate(G, i, g):
+    """Add the gradients g (members x k x 3) of the atoms i to G (members x
+    atoms x 3).
+    """
+    M, N = G.shape[:2]
+    flat = (np.arange(M)[:, None] * N + i[None, :]).ravel()
+
+    for c in range(3):
+        G[..., c] += np.bincount(flat, g[..., c].ravel(), M * N) \
+            .reshape(M, N)
+
+
+def norm(v):
+    return np.sqrt(np.einsum('...i,...i', v, v))
+
+
+def bond(x, P, funct):
+    """Energies (members x bonds) of the bonds between the atoms x (members
+    x bonds x 2 x 3) and their gradients. Function 2 is the quartic bond of
+    GROMOS.
+    """
+    d = x[:, :, 1] - x[:, :, 0]
+    r = norm(d)
+    b0, kb = P[:, 0], P[:, 1]
+
+    if funct == 2:
+        e = kb * (r**2 - b0**2)**2 / 4
+        de = kb * (r**2 - b0**2) * r
+
+    else:
+        e = kb * (r - b0)**2 / 2
+        de = kb * (r - b0)
+
+    g = (de / r)[..., None] * d
+
+    return e, np.stack([-g, g], axis=2)
+
+
+def angle(x, P, funct):
+    """Energies and gradients of angles, like bond(). Function 2 is the
+    cosine based angle of GROMOS, 5 adds an Urey-Bradley bond.
+    """
+    u = x[:, :, 0] - x[:, :, 1]
+    v = x[:, :, 2] - x[:, :, 1]
+    lu, lv = norm(u), norm(v)
+    c = np.clip((u * v).sum(axis=-1) / (lu * lv), -1, 1)
+
+    if funct == 2:
+        c0 = np.cos(np.radians(P[:, 0]))
+        e = P[:, 1] * (c - c0)**2 / 2
+        dc = P[:, 1] * (c - c0)
+
+    else:
+        theta = np.arccos(c) - np.radians(P[:, 0])
+        e = P[:, 1] * theta**2 / 2
+        dc = -P[:, 1] * theta / np.maximum(np.sqrt(1 - c**2), 1e-8)
+
+    gu = dc[..., None] * (v / (lu * lv)[..., None]
+        - c[..., None] * u / (lu**2)[..., None])
+    gv = dc[..., None] * (u / (lu * lv)[..., None]
+        - c[..., None] * v / (lv**2)[..., None])
+    g = np.stack([gu, -gu - gv, gv], axis=2)
+
+    if funct == 5:
+        eub, gub = bond(x[:, :, ::2], P[:, 2:4], 1)
+        e = e + eub
+        g[:, :, ::2] += gub
+
+    return e, g
+
+
+def dihedral(x, P, funct):
+    """Energies and gradients of dihedrals, like bond(). Functions 1, 4 and 9
+    are periodic, 2 harmonic and 3 of Ryckaert-Bellemans. The angle is 0
+    for cis and the gradient is that of mdrun.
+    """
+    rij = x[:, :, 0] - x[:, :, 1]
+    rkj = x[:, :, 2] - x[:, :, 1]
+    rkl = x[:, :, 2] - x[:, :, 3]
+    m = np.cross(rij, rkj)
+    n = np.cross(rkj, rkl)
+    iprm = (m * m).sum(axis=-1)
+    iprn = (n * n).sum(axis=-1)
+    nrkj = norm(rkj)
+    phi = np.arctan2(nrkj * (rij * n).sum(axis=-1), (m * n).sum(axis=-1))
+
+    if funct == 2:
+        dp = (phi - np.radians(P[:, 0]) + np.pi) % (2 * np.pi) - np.pi
+        e = P[:, 1] * dp**2 / 2
+        ddphi = P[:, 1] * dp
+
+    elif funct == 3:
+        c = np.cos(phi - np.pi)
+        s = np.sin(phi - np.pi)
+        e = sum(P[:, i] * c**i for i in range(6))
+        ddphi = -s * sum(i * P[:, i] * c**(i-1) for i in range(1, 6))
+
+    else:
+        a = P[:, 2] * phi - np.radians(P[:, 0])
+        e = P[:, 1] * (1 + np.cos(a))
+        ddphi = -P[:, 1] * P[:, 2] * np.sin(a)
+
+    fi = (-ddphi * nrkj / iprm)[..., None] * m
+    fl = (ddphi * nrkj / iprn)[..., None] * n
+    p = ((rij * rkj).sum(axis=-1) / nrkj**2)[..., None]
+    q = ((rkl * rkj).sum(axis=-1) / nrkj**2)[..., None]
+    s = p * fi - q * fl
+
+    return e, np.stack([-fi, fi - s, fl + s, -fl], axis=2)
+
+
+KINDS = {'bonds': ('BOND', bond), 'angles': ('ANGLE', angle),
+    'dihedrals': ('DIHEDRAL', dihedral)}
+
+
+def cutoff(mdp, key):
+    """A cutoff of the .mdp, 0 meaning none.
+    """
+    r = float(mdp.get(key, 1))
+
+    return np.inf if r == 0 else r
+
+
+class ForceField:
+    """Potential energy and its gradient of structures with the atoms of a
+    topology, as mdrun computes them with the settings of an .mdp file (see
+    parse_mdp) and the tables given to mdrun with -table and -tablep. Atoms
+    in frozen (a boolean mask) are not moved by minimize and their pairs
+    with each other are left out, as with energygrp-excl.
+    """
+    def __init__(self, top, mdp, table=None, tablep=None, frozen=None):
+        top = Topology(top) if isinstance(top, str) else top
+        defaults = top.sections.get('defaults', [['1', '1']])[0]
+        q = np.array([a['charge'] for a in top.atoms()])
+        fudge_qq = float(defaults[4]) if len(defaults) > 4 else 1.0
+        f = ONE_4PI_EPS0 / float(mdp.get('epsilonr', 1))
+        rc = cutoff(mdp, 'rcoulomb')
+        rvdw = cutoff(mdp, 'rvdw')
+        user = np.array([mdp.get('coulombtype', '').lower() == 'user']
+            + [mdp.get('vdwtype', '').lower() == 'user'] * 2)
+
+        if user.any() and table is None:
+            raise ValueError("User functions in the .mdp need a table")
+
+        table = None if table is None else read_table(table)
+        tablep = table if tablep is None else read_table(tablep)
+        self.bonded = interactions(top)
+        N = len(q)
+        self.frozen = np.zeros(N, dtype=bool) if frozen is None else frozen
+
+#        All pairs that are not excluded, the same for every structure, with
+#        the coefficients of f, g and h.
+        i, j = np.triu_indices(N, 1)
+        excl = exclusions(top).tocoo()
+        keep = ~np.isin(i * N + j, excl.row * N + excl.col)
+        keep &= ~(self.frozen[i] & self.frozen[j])
+        self.i = i[keep].astype(np.int32)
+        self.j = j[keep].astype(np.int32)
+        t, C6, C12 = lj_parameters(top)
+        ti, tj = t[self.i], t[self.j]
+        self.W = np.stack([f * q[self.i] * q[self.j], C6[ti, tj],
+            C12[ti, tj]], axis=1)
+        pi, pj = self.bonded.pop(('pairs', 1),
+            (np.zeros((0, 2), dtype=int), np.zeros((0, 2))))
+        self.i14, self.j14 = pi[:, 0], pi[:, 1]
+        self.W14 = np.stack([f * fudge_qq * q[self.i14] * q[self.j14],
+            pj[:, 0], pj[:, 1]], axis=1)
+
+#        Coulomb and LJ are computed apart for their own energy terms and
+#        cutoffs, or together if only the sum is needed.
+        self.groups = {True: [], False: []}
+        coul = np.array([True, False, False])
+        kinds = [('COUL', coul, rc), ('LJ', ~coul, rvdw)]
+
+        if rc == rvdw:
+            self.groups[False].append(('NB', coul | ~coul, rc))
+
+        else:
+            self.groups[False].extend(kinds)
+
+        self.groups[True].extend(kinds)
+
+        for terms, groups in self.groups.items():
+            self.groups[terms] = [(name, cut, columns & ~user,
+                None if not (columns & user).any() else (
+                    hermite(table, columns & user),
+                    hermite(tablep, columns & user),
+                ))
+                for name, columns, cut in groups]
+
+
+    def pairs(self, x, i, j, W, table, plain, cut=np.inf):
+        """Energies (members x pairs) of the pairs of atoms i and j of the
+        structures x with the coefficients W (see functions) and their
+        gradients by the position of j.
+        """
+        d = x[:, j] - x[:, i]
+        r = norm(d)
+        e, de = functions(r, W, table, plain)
+
+        if cut < np.inf:
+            inside = r < cut
+            e *= inside
+            de *= inside
+
+        return e, (de / r)[..., None] * d
+
+
+    def energy(self, X, terms=True):
+        """Energy terms (see TERMS) of each of the structures X (members x
+        atoms x 3) and the gradient of their sum. Without terms the
+        nonbonded energies may be given as sums only, which is faster.
+        The pairs are done in blocks of PAIRS for up to BLOCK // PAIRS
+        members at once, so the numbers of a member do not depend on the
+        others.
+        """
+        M = len(X)
+        step = max(1, BLOCK // PAIRS)
+
+        if M > step:
+            parts = [self.energy(X[k:k+step], terms)
+                for k in range(0, M, step)]
+
+            return dict((t, np.concatenate([p[0][t] for p in parts]))
+                for t in parts[0][0]), np.concatenate([p[1] for p in parts])
+
+        E = dict((t, np.zeros(M)) for t in TERMS)
+        G = np.zeros(X.shape)
+
+        for (section, funct), (idx, P) in self.bonded.items():
+            term, func = KINDS[section]
+            e, g = func(X[:, idx], P, funct)
+            E[term] += e.sum(axis=1)
+
+            for a in range(idx.shape[1]):
+                accumulate(G, idx[:, a], g[:, :, a])
+
+        for name, cut, plain, tables in self.groups[terms]:
+            table, tablep = (None, None) if tables is None else tables
+            e, g = self.pairs(X, self.i14, self.j14, self.W14, tablep, plain)
+            E['%s (1-4)' % name] = E.get('%s (1-4)' % name, 0) + e.sum(axis=1)
+            accumulate(G, self.i14, -g)
+            accumulate(G, self.j14, g)
+
+            for c in range(0, len(self.i), PAIRS):
+                i, j = self.i[c:c+PAIRS], self.j[c:c+PAIRS]
+                e, g = self.pairs(X, i, j, self.W[c:c+PAIRS], table, plain,
+                    cut)
+                E['%s (SR)' % name] = E.get('%s (SR)' % name, 0) \
+                    + e.sum(axis=1)
+                accumulate(G, i, -g)
+                accumulate(G, j, g)
+
+        return E, G
+
+
+def lbfgs_direction(g, S, Y, n, head):
+    """Search directions -H g of the L-BFGS two loop recursion for each
+    member, with the correction pairs S and Y (members x history x
+    coordinates) of its own, n of them stored before position head.
+    """
+    M, m = S.shape[:2]
+    rows = np.arange(M)
+    q = g.copy()
+    alpha = np.zeros((M, m))
+    rho = np.zeros((M, m))
+    order = [(head - 1 - k) % m for k in range(m)]
+
+    for k, idx in enumerate(order):
+        s, y = S[rows, idx], Y[rows, idx]
+        np.divide(1, np.einsum('ij,ij->i', s, y), out=rho[:, k], where=k < n)
+        alpha[:, k] = rho[:, k] * np.einsum('ij,ij->i', s, q)
+        q -= alpha[:, k, None] * y
+
+#    The initial Hessian is scaled by the newest pair, as by Nocedal.
+    s, y = S[rows, order[0]], Y[rows, order[0]]
+    gamma = np.ones(M)
+    np.divide(np.einsum('ij,ij->i', s, y), np.einsum('ij,ij->i', y, y),
+        out=gamma, where=n > 0)
+    r = gamma[:, None] * q
+
+    for k, idx in reversed(list(enumerate(order))):
+        beta = rho[:, k] * np.einsum('ij,ij->i', Y[rows, idx], r)
+        r += (alpha[:, k] - beta)[:, None] * S[rows, idx]
+
+    return -r
+
+
+def minimize(ff, X, nsteps=1000, emtol=10.0):
+    """Minimize each of the structures X (members x atoms x 3) of the
+    ForceField ff with L-BFGS, until none of its atoms has a force above
+    emtol (kJ/mol/nm) or after nsteps steps. Every member has its own
+    correction pairs, line search and convergence test, only the energies
+    of all members still running are computed together, so a member ends
+    up the same whatever else is in the batch.
+    Returns the minimized structures, their energy terms and the steps of
+    each.
+    """
+    X = np.array(X, dtype=float)
+    M = len(X)
+    move = ~ff.frozen
+    size = 3 * move.sum()
+    S = np.zeros((M, HISTORY, size))
+    Y = np.zeros((M, HISTORY, size))
+    n = np.zeros(M, dtype=int)
+    head = np.zeros(M, dtype=int)
+    steps = np.zeros(M, dtype=int)
+    stuck = np.zeros(M, dtype=bool)
+
+    def evaluate(idx, x):
+        Xi = X[idx].copy()
+        Xi[:, move] = x.reshape(len(idx), -1, 3)
+        E, G = ff.energy(Xi, terms=False)
+
+        return sum(E.values()), G[:, move].reshape(len(idx), -1)
+
+    x = X[:, move].reshape(M, -1)
+    f, g = evaluate(np.arange(M), x)
+    running = np.arange(M)
+
+    while True:
+        force = np.linalg.norm(g[running].reshape(len(running), -1, 3),
+            axis=2).max(axis=1, initial=0)
+        running = running[(force > emtol) & (steps[running] < nsteps)
+            & ~stuck[running]]
+
+        if len(running) == 0:
+            break
+
+        r = running
+        d = lbfgs_direction(g[r], S[r], Y[r], n[r], head[r])
+        slope = np.einsum('ij,ij->i', d, g[r])
+
+#        Without descent the history of the member is dropped.
+        reset = slope >= 0
+        d[reset] = -g[r][reset]
+        n[r[reset]] = 0
+        slope = np.einsum('ij,ij->i', d, g[r])
+        step = np.minimum(1, MAXSTEP / np.linalg.norm(
+            d.reshape(len(r), -1, 3), axis=2).max(axis=1))
+        xn, fn, gn = x[r].copy(), f[r].copy(), g[r].copy()
+        todo = np.arange(len(r))
+
+#        Backtracking line search with the Armijo condition, per member.
+        for _ in range(BACKTRACK):
+            trial = x[r[todo]] + step[todo, None] * d[todo]
+            ft, gt = evaluate(r[todo], trial)
+            ok = ft <= f[r[todo]] + ARMIJO * step[todo] * slope[todo]
+            done = todo[ok]
+            xn[done], fn[done], gn[done] = trial[ok], ft[ok], gt[ok]
+            todo = todo[~ok]
+            step[todo] /= 2
+
+            if len(todo) == 0:
+                break
+
+#        Members whose line search fails can not get any lower.
+        stuck[r[todo]] = True
+        moved = np.setdiff1d(np.arange(len(r)), todo)
+        rm = r[moved]
+        s_, y_ = xn[moved] - x[rm], gn[moved] - g[rm]
+        curved = np.einsum('ij,ij->i', s_, y_) > 1e-10
+        keep = rm[curved]
+        S[keep, head[keep]] = s_[curved]
+        Y[keep, head[keep]] = y_[curved]
+        head[keep] = (head[keep] + 1) % HISTORY
+        n[keep] = np.minimum(n[keep] + 1, HISTORY)
+        x[rm], f[rm], g[rm] = xn[moved], fn[moved], gn[moved]
+        steps[rm] += 1
+
+    X[:, move] = x.reshape(M, -1, 3)
+
+    return X, ff.energy(X)[0], steps
@@ -0,0 +1,364 @@
+import numpy as np
+import scipy.sparse as sp
+
+ONE_4PI_EPS0 = 138.935458 # kJ mol^-1 nm e^-2
+KT = 2.479 # kJ/mol at 298.15 K
+
+#    Van der Waals radii (nm) by element, after Bondi.
+RADII = {'H': 0.11, 'C': 0.17, 'N': 0.155, 'O': 0.152, 'S': 0.18, 'P': 0.18}
+
+
+def parse_gropbe(file_):
+    """Parse a gropbe parameter file into a dictionary. Settings without a
+    value (like nomem) are stored as True. Lines with in(...) statements are
+    ignored since the input is given directly to the solver.
+    """
+    prm = {}
+
+    for l in open(file_, 'r').readlines():
+        l = l.strip()
+
+        if len(l) == 0 or l.startswith('in('):
+            continue
+
+        if '=' in l:
+            k, v = l.split('=', 1)
+            prm[k.strip()] = float(v)
+
+        else:
+            prm[l] = True
+
+    return prm
+
+
+def radius(name):
+    """Guess the element from a GROMACS atom name and return its radius.
+    """
+    element = name.lstrip('0123456789')[:1]
+
+    return RADII.get(element, 0.17)
+
+
+class Grid:
+    """A cubic finite difference grid. Holds the index arithmetic that does
+    not change between structures of the same size, i.e. the neighbour
+    offsets of the 7 point stencil and the charge spreading pattern.
+    """
+    def __init__(self, n, h):
+        self.n = n
+        self.h = h
+        self.shape = (n, n, n)
+        idx = np.arange(n**3).reshape(self.shape)
+        self.interior = idx[1:-1, 1:-1, 1:-1].ravel()
+        edge = np.ones(self.shape, dtype=bool)
+        edge[1:-1, 1:-1, 1:-1] = False
+        self.boundary = idx[edge]
+        self.ipoints = np.array(
+            np.unravel_index(self.interior, self.shape)
+        ).T * h
+        self.bpoints = np.array(
+            np.unravel_index(self.boundary, self.shape)
+        ).T * h
+        self.corners = np.array(
+            [(i, j, k) for i in (0, 1) for j in (0, 1) for k in (0, 1)]
+        )
+
+
+    def spread(self, origin, xyz):
+        """Trilinear weights of positions on the grid. Returns the flat grid
+        indices and weights, both of shape (len(xyz), 8).
+        """
+        g = (xyz - origin) / self.h
+        i0 = np.floor(g).astype(int)
+        f = g - i0
+        idx = i0[:, None, :] + self.corners[None, :, :]
+        w = np.where(self.corners[None, :, :] == 1, f[:, None, :],
+            1 - f[:, None, :]).prod(axis=2)
+        flat = np.ravel_multi_index(
+            (idx[..., 0], idx[..., 1], idx[..., 2]), self.shape
+        )
+
+        return flat, w
+
+
+    def dielectric(self, origin, xyz, radii, epsin, epsout):
+        """Dielectric constants on the faces between grid points, i.e. on the
+        three grids shifted by half a spacing in x, y and z. A face is inside
+        the solute if it lies within the van der Waals radius of any atom.
+        """
+        faces = []
+
+        for axis in range(3):
+            shift = np.zeros(3)
+            shift[axis] = self.h / 2
+            inside = np.zeros(self.shape, dtype=bool)
+
+            for r in np.unique(radii):
+                sel = xyz[radii == r]
+                reach = int(np.ceil(r / self.h)) + 1
+                off = np.arange(-reach, reach+1)
+                off = np.array(np.meshgrid(off, off, off, indexing='ij')) \
+                    .reshape(3, -1).T
+
+                for c in range(0, len(sel), 256):
+                    chunk = sel[c:c+256]
+                    g = np.rint((chunk - origin - shift) / self.h).astype(int)
+                    pts = g[:, None, :] + off[None, :, :]
+                    d = pts * self.h + origin + shift - chunk[:, None, :]
+                    hit = ((d**2).sum(axis=2) < r**2) \
+                        & (pts >= 0).all(axis=2) & (pts < self.n).all(axis=2)
+                    pts = pts[hit]
+                    inside[pts[:, 0], pts[:, 1], pts[:, 2]] = True
+
+            faces.append(np.where(inside, epsin, epsout))
+
+        return faces
+
+
+    def operator(self, faces):
+        """Sparse matrix of the discretized -div(eps grad) on the interior
+        points, together with the coupling to the boundary points.
+        """
+        n = self.n
+        N = n**3
+        rows = []
+        cols = []
+        vals = []
+        diag = np.zeros(N)
+        idx = np.arange(N).reshape(self.shape)
+
+        for axis in range(3):
+            eps = faces[axis]
+            lo = [slice(None)] * 3
+            hi = [slice(None)] * 3
+            lo[axis] = slice(0, -1)
+            hi[axis] = slice(1, None)
+            e = eps[tuple(lo)].ravel() # face between i and i+1
+            a = idx[tuple(lo)].ravel()
+            b = idx[tuple(hi)].ravel()
+            np.add.at(diag, a, e)
+            np.add.at(diag, b, e)
+            rows.extend([a, b])
+            cols.extend([b, a])
+            vals.extend([-e, -e])
+
+        A = sp.csr_matrix(
+            (np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+            shape=(N, N)
+        ) + sp.diags(diag)
+        A = A.tocsr()
+
+        return A[self.interior][:, self.interior], \
+            A[self.interior][:, self.boundary]
+
+
+class PBSolver:
+    """Finite difference Poisson-Boltzmann solver (without mobile ions) as an
+    in-process replacement for gropbe. It honors the settings of the gropbe
+    parameter file: epsIn, epsOut, spacing (in Angstrom), filling (percentage
+    of the coarse grid covered by the solute) and the convergence criteria
+    rmsc and maxc (in kT/e).
+    Charges and radii are set once per topology, so one solver is reused for
+    all members of an ensemble. Grids are set up for the first structure and
+    only rebuilt if a later structure does not fit.
+    """
+    def __init__(self, charges, radii, epsIn=2, epsOut=78, spacing=0.5,
+        filling=60, rmsc=0.01, maxc=0.01, maxpoints=97, maxiter=5000, **kwargs):
+        self.q = np.asarray(charges, dtype=float)
+        self.r = np.asarray(radii, dtype=float)
+        self.epsin = epsIn
+        self.epsout = epsOut
+        self.h = spacing / 10 # Angstrom --> nm
+        self.filling = filling / 100
+        self.rmsc = rmsc * KT
+        self.maxc = maxc * KT
+        self.maxpoints = maxpoints
+        self.maxiter = maxiter
+        self.grids = None
+        self.size = None
+
+
+    def setup(self, xyz, sel):
+        """Choose the coarse and the focused grids for a structure. The coarse
+        grid holds all atoms, the focused ones the selected atoms.
+        """
+        size = (xyz.max(axis=0) - xyz.min(axis=0)).max() + 2*self.r.max()
+        focus = (xyz[sel].max(axis=0) - xyz[sel].min(axis=0)).max() \
+            + 2*self.r.max()
+        coarse = size / self.filling
+        hc = max(self.h, coarse / (self.maxpoints-1))
+        grids = [Grid(int(np.ceil(coarse/hc)) + 1, hc)]
+
+#        Focus onto the requested spacing in steps of at most a factor 4 in
+#        resolution, keeping each grid within the one before.
+        while grids[-1].h > self.h * 1.0001:
+            h = max(self.h, grids[-1].h / 4)
+            n = int(np.ceil((focus + 4*grids[-1].h) / h)) + 1
+            n = min(n, int((grids[-1].n - 3) * grids[-1].h / h) + 1)
+            grids.append(Grid(n, h))
+
+        self.grids = grids
+        self.size = size, focus
+        self._reference = {}
+
+
+    def coulomb_boundary(self, points, xyz, q, eps):
+        """Coulomb potential of the charges q at the given points.
+        """
+        phi = np.zeros(len(points))
+
+        for c in range(0, len(points), 512):
+            d = np.linalg.norm(
+                points[c:c+512, None, :] - xyz[None, :, :], axis=2
+            )
+            phi[c:c+512] = (q[None, :] / d).sum(axis=1)
+
+        return ONE_4PI_EPS0 * phi / eps
+
+
+    def cg(self, A, b, x, M):
+        """Jacobi preconditioned conjugate gradients. Stops when the root
+        mean square and the maximum change of the potential in one iteration
+        drop below rmsc and maxc.
+        """
+        r = b - A @ x
+        z = M * r
+        p = z.copy()
+        rz = r @ z
+
+        for i in range(self.maxiter):
+            Ap = A @ p
+            alpha = rz / (p @ Ap)
+            dx = alpha * p
+            x += dx
+            r -= alpha * Ap
+
+            if np.sqrt((dx**2).mean()) < self.rmsc \
+                and np.abs(dx).max() < self.maxc:
+                break
+
+            z = M * r
+            rz_new = r @ z
+            p = z + rz_new / rz * p
+            rz = rz_new
+
+        return x
+
+
+    def potential(self, xyz, uniform, sel):
+        """Solve on all grids, each one with boundary values from the one
+        before. Returns the potential at the positions of the selected atoms
+        on the finest grid. The coarse grid is centered on all atoms and holds
+        all charges, the finer ones are centered on the selected atoms and get
+        the field of the charges outside them through their boundary values.
+        With uniform=True the solute dielectric fills all space, which gives
+        the reference state.
+        """
+        center = (xyz[sel].max(axis=0) + xyz[sel].min(axis=0)) / 2
+        prev = None
+
+        for n, g in enumerate(self.grids):
+
+            if prev is None:
+                origin = (xyz.max(axis=0) + xyz.min(axis=0)) / 2 \
+                    - (g.n - 1) * g.h / 2
+
+            else:
+#                Shifted into the grid before, one spacing off its boundary.
+                pg, porigin, _ = prev
+                origin = np.clip(center - (g.n - 1) * g.h / 2,
+                    porigin + pg.h, porigin + (pg.n - 2) * pg.h
+                    - (g.n - 1) * g.h)
+
+            inside = ((xyz > origin) & (xyz < origin + (g.n-1)*g.h)).all(axis=1)
+            flat, w = g.spread(origin, xyz[inside])
+            rho = np.zeros(g.n**3)
+            np.add.at(rho, flat.ravel(), (w * self.q[inside, None]).ravel())
+
+            if uniform:
+
+                if n not in self._reference:
+                    faces = [np.full(g.shape, float(self.epsin))] * 3
+                    self._reference[n] = g.operator(faces)
+
+                A, B = self._reference[n]
+
+            else:
+                faces = g.dielectric(origin, xyz, self.r, self.epsin,
+                    self.epsout)
+                A, B = g.operator(faces)
+
+            if prev is None:
+                eps = self.epsin if uniform else self.epsout
+                phib = self.coulomb_boundary(
+                    g.bpoints + origin, xyz[inside], self.q[inside], eps
+                )
+                x = np.zeros(len(g.interior))
+
+            else:
+#                Boundary values and the initial guess are interpolated from
+#                the coarser grid.
+                pg, porigin, pphi = prev
+                pflat, pw = pg.spread(porigin, g.bpoints + origin)
+                phib = (pphi[pflat] * pw).sum(axis=1)
+                pflat, pw = pg.spread(porigin, g.ipoints + origin)
+                x = (pphi[pflat] * pw).sum(axis=1)
+
+            b = 4 * np.pi * ONE_4PI_EPS0 * rho[g.interior] / g.h - B @ phib
+            x = self.cg(A, b, x, 1 / A.diagonal())
+            phi = np.zeros(g.n**3)
+            phi[g.interior] = x
+            phi[g.boundary] = phib
+            prev = g, origin, phi
+
+        flat, w = g.spread(origin, xyz[sel])
+
+        return (phi[flat] * w).sum(axis=1)
+
+
+    def coulomb(self, xyz, sel):
+        """Coulomb energy in the solute dielectric of all pairs with at least
+        one selected atom.
+        """
+        e = 0.0
+
+        for c in range(0, len(xyz), 512):
+            d = np.linalg.norm(xyz[c:c+512, None, :] - xyz[None, :, :], axis=2)
+            i, j = np.nonzero(d)
+            mask = (i + c < j) & (sel[i + c] | sel[j])
+            e += (self.q[i[mask]+c] * self.q[j[mask]] / d[i[mask], j[mask]]).sum()
+
+        return ONE_4PI_EPS0 * e / self.epsin
+
+
+    def solve(self, xyz, sel=None):
+        """Returns the Coulomb and the solvation energy (kJ/mol) of the
+        structure with coordinates xyz (nm).
+        If a boolean mask sel is given, the finer grids are focused on the
+        selected atoms and only their energies are returned: the solvation
+        energy of the selected charges in the reaction field of all charges,
+        and the Coulomb energy of all pairs involving them.
+        """
+        sel = np.ones(len(xyz), dtype=bool) if sel is None \
+            else np.asarray(sel, dtype=bool)
+        size = (xyz.max(axis=0) - xyz.min(axis=0)).max() + 2*self.r.max()
+        focus = (xyz[sel].max(axis=0) - xyz[sel].min(axis=0)).max() \
+            + 2*self.r.max()
+
+        if self.grids is None or size > self.size[0] or focus > self.size[1]:
+            self.setup(xyz, sel)
+
+        solv = 0.5 * (self.q[sel] * (
+            self.potential(xyz, False, sel) - self.potential(xyz, True, sel)
+        )).sum()
+
+        return self.coulomb(xyz, sel), solv
+
+
+def write_log(fname, coul, solv):
+    """Write the energies in the same layout as gropbe, so get_electro can
+    read either.
+    """
+    with open(fname, 'w') as log:
+        log.write("Coulombic energy of the selected groups: %f kJ/mol\n" % coul)
+        log.write("Solvation energy of selected groups: %f kJ/mol\n" % solv)
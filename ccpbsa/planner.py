@@ -0,0 +1,254 @@
+import os
+import heapq
+import numpy as np
+import pandas as pd
+from .CCPBSA import parse_flags, parse_mutations, read_pdb, TIMINGS
+
+#    Cost of one task of each stage on one core, as a function of the number
+#    of heavy atoms of the structure (of the whole complex for unbound):
+#    seconds per atom, program launches, files and bytes per atom plus a
+#    fixed amount of bytes. The concoord and entropy stages also grow with
+#    the ensemble size n. These are rough defaults, --profile calibrates them
+#    with the timings of previous runs.
+STAGES = {
+    'minimization': dict(rate=0.03, launches=3, files=10, bytes=1000,
+        fixed=50000),
+    'update': dict(rate=0.002, launches=1, files=1, bytes=80, fixed=0),
+    'concoord': dict(rate=0.0005, per_member=True, launches=2, files=6,
+        bytes=100, member_bytes=80, fixed=0),
+    'mutate': dict(rate=0.0003, per_member=True, launches=0, files=0,
+        bytes=0, member_bytes=80, fixed=0),
+    'cluster': dict(rate=0.00005, per_member=True, launches=0, files=1,
+        bytes=0, fixed=10000),
+    'energy': dict(rate=0.05, launches=6, files=16, bytes=1000, fixed=50000),
+    'unbound': dict(rate=0.02, launches=4, files=10, bytes=500, fixed=30000),
+    'entropy': dict(rate=0.0002, per_member=True, launches=2, files=8,
+        bytes=20, square_bytes=36, fixed=100000),
+    'area': dict(rate=0.005, launches=3, files=3, bytes=0, fixed=5000),
+}
+
+#    Stages run in this order, each one waits for the one before. Stages in
+#    the same phase share one pool. Serial stages run in the main process.
+PHASES = ['minimization', 'update', 'concoord', 'cluster', 'mutate',
+    ('energy', 'unbound'), 'entropy', 'area']
+SERIAL = ('update', 'area')
+
+COLUMNS = ['stage', 'atoms', 'members', 'seconds', 'failed']
+
+
+def tasks(kind, variants, n, concoord=True, paired=False, clustered=False):
+    """Number of tasks of each stage for a run with a number of variants
+    (without the wildtype) and n structures per ensemble. In paired mode
+    only the wildtype gets an ensemble, which is mutated for the variants.
+    Clustered ensembles are counted in full, as the number of clusters is
+    not known before.
+    """
+    ensembles = variants + 1
+    members = ensembles * n if concoord else ensembles
+    count = {'energy': members}
+
+    if concoord and paired:
+        count.update(minimization=1, update=1, concoord=1, mutate=variants)
+
+    elif concoord:
+        count.update(minimization=ensembles, update=ensembles,
+            concoord=ensembles)
+
+    if kind == 'stability':
+
+        if concoord:
+            count['entropy'] = ensembles
+
+    else:
+        count['unbound'] = 2 * members
+        count['area'] = n if concoord else 1
+
+    if concoord and clustered:
+        count['cluster'] = 1 if paired else ensembles
+
+    return count
+
+
+def read_timings(*paths):
+    """Read the timings files of previous runs. Paths are run directories or
+    timings files. Failed tasks are left out.
+    """
+    frames = []
+
+    for p in paths:
+
+        if os.path.isdir(p):
+            p = os.path.join(p, TIMINGS)
+
+        frames.append(pd.read_csv(p, header=None, names=COLUMNS))
+
+    if len(frames) == 0:
+        return pd.DataFrame(columns=COLUMNS)
+
+    timings = pd.concat(frames, ignore_index=True)
+
+    return timings[timings['failed'] == 0]
+
+
+def calibrate(timings):
+    """Seconds per atom of each stage from previous timings, by least squares
+    through the origin. Stages without timings get their default rate scaled
+    by the median ratio of measured to default rates, so a slower or faster
+    machine shifts all of them.
+    """
+    rates = {}
+
+    for stage, t in timings.groupby('stage'):
+
+        if stage not in STAGES or (t['atoms'] == 0).all():
+            continue
+
+        a = t['atoms'].values.astype(float)
+
+        if STAGES[stage].get('per_member'):
+            a = a * t['members'].values
+
+        rates[stage] = (t['seconds'].values * a).sum() / (a**2).sum()
+
+    ratios = [rates[s] / STAGES[s]['rate'] for s in rates]
+    scale = np.median(ratios) if len(ratios) > 0 else 1.0
+
+    return dict((s, rates.get(s, STAGES[s]['rate'] * scale)) for s in STAGES)
+
+
+def makespan(durations, cores):
+    """Wall time of a list of tasks on a pool of cores, each task going to
+    the core that becomes free first, longest tasks first.
+    """
+    if len(durations) == 0:
+        return 0.0
+
+    free = [0.0] * min(cores, len(durations))
+
+    for d in sorted(durations, reverse=True):
+        heapq.heapreplace(free, free[0] + d)
+
+    return max(free)
+
+
+def balance(tasks, costs, cores, heavy=2.0):
+    """Order tasks for a pool longest first, so the big structures do not
+    end up last and set the wall time. Tasks costing more than heavy times
+    the mean are returned separately, to be handed out one at a time. The
+    light ones are handed out in chunks of about the same cost, a quarter of
+    the share of each core, which keeps the overhead of many small member
+    tasks down without piling the bigger ones into one chunk.
+    Returns the heavy tasks and the chunks of light tasks.
+    """
+    if len(tasks) == 0:
+        return [], []
+
+    costs = np.asarray(costs, dtype=float)
+    order = np.argsort(-costs, kind='stable')
+    big = costs[order] > heavy * costs.mean()
+    heavy = [tasks[i] for i, b in zip(order, big) if b]
+    light = [i for i, b in zip(order, big) if not b]
+
+#    Without costs, all tasks count the same.
+    weights = costs[light] if costs[light].sum() > 0 else np.ones(len(light))
+    target = weights.sum() / (4 * cores)
+    chunks = []
+    chunk, sum_ = [], 0.0
+
+    for i, w in zip(light, weights):
+        chunk.append(tasks[i])
+        sum_ += w
+
+        if sum_ >= target:
+            chunks.append(chunk)
+            chunk, sum_ = [], 0.0
+
+    if len(chunk) > 0:
+        chunks.append(chunk)
+
+    return heavy, chunks
+
+
+def plan(wtpdb, mutlist, flags, kind='stability', concoord=True, cores=1,
+    profile=(), pb='gropbe', minimizer='mdrun', energygroups=False,
+    paired=False, clustered=False):
+    """Estimate the cost of a run without running anything. Returns a table
+    with the tasks, program launches, files, disk space (bytes), core hours
+    and wall time (hours) of each stage and a row with the totals.
+    """
+    flags, _ = parse_flags(flags)
+
+    try:
+        n = int(flags['disco'][flags['disco'].index('-n')+1])
+
+    except (KeyError, ValueError):
+        n = 300
+
+    variants = len(parse_mutations(mutlist))
+    atoms = len(read_pdb(wtpdb)[0])
+    count = tasks(kind, variants, n, concoord, paired, clustered)
+    rates = calibrate(read_timings(*profile))
+
+    launches = dict((s, STAGES[s]['launches']) for s in STAGES)
+    launches['energy'] -= pb == 'internal'
+    launches['energy'] -= 2 * (minimizer == 'internal') # grompp and mdrun
+    launches['minimization'] -= minimizer == 'internal'
+    launches['energy'] -= kind == 'affinity' # no sasa in the bound task
+    launches['unbound'] -= energygroups + (pb == 'internal')
+
+    rows = {}
+
+    for stage, t in count.items():
+        c = STAGES[stage]
+        m = n if c.get('per_member') and concoord else 1
+        seconds = rates[stage] * atoms * m
+
+        if stage == 'unbound' and energygroups:
+            seconds *= 0.5
+
+        size = c['fixed'] + c['bytes'] * atoms \
+            + c.get('member_bytes', 0) * atoms * m \
+            + c.get('square_bytes', 0) * atoms**2
+        files = c['files'] + (m if stage in ('concoord', 'mutate') else 0)
+        rows[stage] = {
+            'TASKS': t,
+            'LAUNCHES': t * launches[stage],
+            'FILES': t * files,
+            'DISK': t * size,
+            'SECONDS/TASK': seconds,
+            'CORE-H': t * seconds / 3600,
+        }
+
+    for phase in PHASES:
+        stages = [s for s in (phase if isinstance(phase, tuple) else (phase,))
+            if s in rows]
+        durations = [rows[s]['SECONDS/TASK'] for s in stages
+            for _ in range(rows[s]['TASKS'])]
+        wall = makespan(durations, 1 if stages and stages[0] in SERIAL \
+            else cores) / 3600
+
+#        Stages sharing a pool share its wall time, by their work.
+        work = sum(rows[s]['CORE-H'] for s in stages)
+
+        for s in stages:
+            rows[s]['WALL-H'] = wall * rows[s]['CORE-H'] / work if work else 0
+
+    order = [s for p in PHASES for s in (p if isinstance(p, tuple) else (p,))
+        if s in rows]
+    table = pd.DataFrame([rows[s] for s in order], index=order)
+    table.loc['TOTAL'] = table.sum()
+    table.loc['TOTAL', 'SECONDS/TASK'] = np.nan
+    table.index.name = 'STAGE'
+
+    return table.astype({'TASKS': int, 'LAUNCHES': int, 'FILES': int})
+
+
+def human(size):
+    """Bytes as a human readable string.
+    """
+    for unit in ('B', 'kB', 'MB', 'GB', 'TB'):
+
+        if size < 1000 or unit == 'TB':
+            return "%.1f %s" % (size, unit)
+
+        size /= 1000
@@ -0,0 +1,187 @@
+import os
+import sys
+import json
+import time
+from collections import Counter
+
+INTERVAL = 5 # seconds between reports
+
+
+def variant(task):
+    """The ensemble a task (a directory or a tuple starting with one) belongs
+    to.
+    """
+    d = task if isinstance(task, str) else task[0]
+
+    return d.split('/')[0]
+
+
+def clock(seconds):
+    """Seconds as h:mm:ss.
+    """
+    seconds = int(round(seconds))
+
+    return "%d:%02d:%02d" % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+class Progress:
+    """Progress of the tasks of one stage, fed with each finished task. Shows
+    the tasks done, the throughput, the ensembles completed and the remaining
+    time, estimated from the costs of the tasks (see planner.calibrate) and
+    corrected by the time the finished ones took. Reports go to stream at
+    most every interval seconds, and optionally as JSON to a status file for
+    monitors, which keeps a summary of the stages before.
+    """
+    def __init__(self, stage, tasks, costs=None, cores=1, status=None,
+        stream=sys.stderr, interval=INTERVAL):
+        tasks = list(tasks)
+        costs = [1.0] * len(tasks) if costs is None else list(costs)
+        self.stage = stage
+        self.costs = dict(zip(tasks, costs))
+        self.total = len(tasks)
+        self.cores = cores
+        self.status = status
+        self.stream = stream
+        self.interval = interval
+        self.done = 0
+        self.failed = 0
+        self.cost_done = 0.0
+        self.cost_left = float(sum(costs))
+        self.tasks = Counter(variant(t) for t in tasks)
+        self.finished = Counter()
+        self.start = time.time()
+        self.last = 0.0
+        self.report()
+
+
+    def update(self, task, reason=None):
+        """Count a finished task, reason is set if it failed.
+        """
+        cost = self.costs.get(task, 0.0)
+        self.done += 1
+        self.failed += reason is not None
+        self.cost_done += cost
+        self.cost_left -= cost
+        self.finished[variant(task)] += 1
+
+        if time.time() - self.last >= self.interval:
+            self.report()
+
+
+    def eta(self):
+        """Seconds until the stage is done. Before the first task finishes
+        this is the estimated cost spread over the cores.
+        """
+        if self.done == self.total:
+            return 0.0
+
+        if self.cost_done > 0:
+            return (time.time() - self.start) / self.cost_done \
+                * max(self.cost_left, 0.0)
+
+        return max(self.cost_left, 0.0) / self.cores
+
+
+    def state(self):
+        elapsed = time.time() - self.start
+
+        return {
+            'stage': self.stage,
+            'done': self.done,
+            'failed': self.failed,
+            'total': self.total,
+            'per_hour': self.done / elapsed * 3600 if elapsed > 0 else 0.0,
+            'elapsed': elapsed,
+            'eta': self.eta(),
+            'ensembles': dict((v, [self.finished[v], n])
+                for v, n in self.tasks.items()),
+            'updated': time.time(),
+        }
+
+
+    def report(self):
+        state = self.state()
+        complete = sum(self.finished[v] == n for v, n in self.tasks.items())
+        line = "%s: %d/%d tasks (%d failed), %.1f/h, %d/%d ensembles done, " \
+            "%s elapsed, ETA %s" % (
+                self.stage, self.done, self.total, self.failed,
+                state['per_hour'], complete, len(self.tasks),
+                clock(state['elapsed']), clock(state['eta'])
+            )
+
+        if self.stream is not None:
+
+            if self.stream.isatty():
+                self.stream.write('\r' + line + '\033[K')
+
+            else:
+                self.stream.write(line + '\n')
+
+            self.stream.flush()
+
+        if self.status is not None:
+            self.write(state)
+
+        self.last = time.time()
+
+
+    def write(self, state):
+        """Replace the status file in one step, so a monitor never reads a
+        partial one.
+        """
+        try:
+            with open(self.status, 'r') as status:
+                stages = json.load(status).get('stages', {})
+
+        except (OSError, ValueError):
+            stages = {}
+
+        stages[self.stage] = dict((k, state[k])
+            for k in ('done', 'failed', 'total', 'elapsed', 'eta'))
+        tmp = self.status + '.tmp'
+
+        with open(tmp, 'w') as status:
+            json.dump(dict(state, stages=stages), status, indent=1)
+
+        os.replace(tmp, self.status)
+
+
+    def close(self):
+        self.report()
+
+        if self.stream is not None and self.stream.isatty():
+            self.stream.write('\n')
+
+
+class Tagged:
+    """Wraps a pool function so the results come with their task, which
+    imap_unordered does not tell.
+    """
+    def __init__(self, func):
+        self.func = func
+
+
+    def __call__(self, task):
+        return task, self.func(task)
+
+
+class Batched(Tagged):
+    """Wraps a pool function to run a chunk of tasks in one call, returning
+    the results tagged with their tasks.
+    """
+    def __call__(self, chunk):
+        return [(task, self.func(task)) for task in chunk]
+
+
+def track(items, stage, **kwargs):
+    """Iterate over items, reporting the progress of the loop like a pool
+    stage.
+    """
+    items = list(items)
+    progress = Progress(stage, items, **kwargs)
+
+    for i in items:
+        yield i
+        progress.update(i)
+
+    progress.close()
@@ -0,0 +1,542 @@
+import os
+import json
+import queue
+import shutil
+import socket
+import hashlib
+import threading
+import itertools
+import collections
+import socketserver
+import numpy as np
+from multiprocessing import Pool
+from .CCPBSA import DataGenerator, AffinityGenerator, DataCollector, \
+    AffinityCollector, parse_mutations, failure
+
+SOCKET = 'ccpbsa.sock'
+CACHED = 16 # generators kept per worker
+
+#    Generators of the jobs a worker has seen, so the following tasks of a
+#    job in the same worker do not parse the flags and load the wildtype
+#    again.
+_generators = collections.OrderedDict()
+
+
+def generator(spec, dummy=True):
+    """The generator of a job in this worker. Made with dummy=False once
+    per job, by setup, to create the job directory.
+    """
+    data = _generators.get(spec['id'])
+
+    if data is not None:
+        return data
+
+    os.chdir(spec['dir'])
+    options = dict(spec['options'])
+
+    if spec['routine'] == 'affinity':
+        data = AffinityGenerator(spec['wildtype'], 'mutations.txt',
+            chaingrp=spec['chains'], dummy=dummy, **options)
+
+    else:
+        options.pop('energygroups', None)
+        data = DataGenerator(spec['wildtype'], 'mutations.txt', dummy=dummy,
+            **options)
+
+#    All jobs share the topology cache of the server.
+    data.topologies = spec['topologies']
+
+    if spec['no_concoord']:
+        data.n = 0
+
+    if len(_generators) >= CACHED:
+        _generators.popitem(last=False)
+
+    _generators[spec['id']] = data
+
+    return data
+
+
+def setup(spec):
+    """Worker task: create the directory of a job. A finished wildtype of an
+    earlier job with the same input is copied in.
+    Returns whether it was.
+    """
+    data = generator(spec, dummy=False)
+    cached = spec['wildtypes'] + '/' + spec['key']
+
+    if not os.path.isdir(cached):
+        return False
+
+    shutil.copytree(cached, data.maindir + '/' + data.wt, dirs_exist_ok=True)
+
+    return True
+
+
+def pipeline(spec, d):
+    """Worker task: all stages of the ensemble d of a job, one after the
+    other. A wildtype without failures is stored for later jobs.
+    Returns the reason if d failed.
+    """
+    data = generator(spec)
+    affinity = spec['routine'] == 'affinity'
+
+    if spec['no_concoord']:
+        members = [d]
+
+    else:
+
+        for func, stage in (
+            (data.do_minimization, 'minimization'),
+            (data.update_struct, 'update'),
+            (data.do_concoord, 'concoord')
+        ):
+
+            if data.attempt(d, func, d, stage=stage) is not None:
+                return failure(d)
+
+        members = data.members([d])
+
+        if data.minimizer == 'internal':
+            data.attempt(d, data.minimize_members, d, stage='minimize')
+
+    for m in members:
+
+        if affinity:
+
+            for grp in (None, data.grp1, data.grp2):
+                data.attempt(m, data.energy, m, grp,
+                    stage='energy' if grp is None else 'unbound')
+
+        else:
+            data.attempt(m, data.energy, m, stage='energy')
+
+    if affinity and d == data.wt:
+        data.area()
+
+    elif not affinity and not spec['no_concoord']:
+        data.attempt(d, data.schlitter, d, stage='entropy')
+
+    reason = failure(d)
+
+    if d == data.wt and reason is None:
+        store(data.maindir + '/' + d, spec['wildtypes'] + '/' + spec['key'])
+
+    return reason
+
+
+def store(src, dst):
+    """Copy a directory to dst in one step, so no other process sees a
+    partial copy.
+    """
+    tmp = '%s.%d' % (dst, os.getpid())
+    shutil.copytree(src, tmp)
+
+    try:
+        os.rename(tmp, dst)
+
+    except OSError: # stored by another job meanwhile
+        shutil.rmtree(tmp)
+
+
+def row(table, i):
+    """A row of a table as a dictionary, NaN as None.
+    """
+    return dict((k, None if np.isnan(v) else float(v))
+        for k, v in table.loc[i].items())
+
+
+def collect(spec, v):
+    """Worker task: the tables of the wildtype and the variant v of a job.
+    Returns the ddG values without and with fit and the structures that
+    were left out.
+    """
+    data = generator(spec)
+
+    if spec['routine'] == 'affinity':
+        search = AffinityCollector(data, [data.wt, v])
+        search.search_data()
+        search.daffinity()
+        search.ddaffinity()
+        fit = search.fitaffinity(**spec['parameters'])
+
+    else:
+        search = DataCollector(data, [data.wt, v])
+        search.search_data(entropy=not spec['no_concoord'])
+        search.dstability(spec['gxg_table'])
+
+        if spec['no_concoord']:
+            search.dG_unfld['-TS'] = 0
+
+        search.ddstability()
+        fit = search.fitstability(**spec['parameters'])
+
+    return {
+        'ddG': row(search.ddG, v),
+        'ddG_fit': row(fit, v),
+        'failures': dict((i, r) for i, r in search.failures['REASON'].items()
+            if i.split('/')[0] == v),
+    }
+
+
+class Job:
+    """A submitted job: its tasks waiting for a worker and the events for
+    the client.
+    """
+    def __init__(self, spec, variants):
+        self.spec = spec
+        self.variants = variants
+        self.ready = collections.deque()
+        self.events = queue.Queue()
+        self.waiting = [] # variants finished before the wildtype
+        self.wildtype = None # reason of a failed wildtype, '' when done
+        self.open = len(variants)
+        self.cancelled = False
+
+
+    def send(self, event, **kwargs):
+        kwargs.update(event=event, job=self.spec['id'])
+        self.events.put(kwargs)
+
+
+class Scheduler:
+    """Hands the tasks of all jobs to one pool of warm workers. At most one
+    task per core is given to the pool, the rest wait here and the jobs take
+    turns, so a small job is not stuck behind a large one.
+    """
+    def __init__(self, cores):
+        self.cores = cores
+        self.pool = Pool(cores)
+        self.jobs = collections.deque()
+        self.running = 0
+        self.lock = threading.RLock()
+
+
+    def add(self, job):
+        with self.lock:
+            self.jobs.append(job)
+
+
+    def remove(self, job):
+        with self.lock:
+            job.ready.clear()
+
+            if job in self.jobs:
+                self.jobs.remove(job)
+
+
+    def submit(self, job, func, args, callback):
+        """Queue func(*args) for job. callback gets the result and the
+        exception, one of them None, unless the job was cancelled.
+        """
+        with self.lock:
+            job.ready.append((func, args, callback))
+            self.pump()
+
+
+    def pump(self):
+        while self.running < self.cores:
+            job = next((j for j in self.turns() if len(j.ready) > 0), None)
+
+            if job is None:
+                return
+
+            func, args, callback = job.ready.popleft()
+            self.running += 1
+            self.pool.apply_async(
+                func, args,
+                callback=lambda r, j=job, c=callback: self.done(j, c, r, None),
+                error_callback=lambda e, j=job, c=callback: \
+                    self.done(j, c, None, e)
+            )
+
+
+    def turns(self):
+        """The jobs in turn, starting after the last one served.
+        """
+        for _ in range(len(self.jobs)):
+            self.jobs.rotate(-1)
+            yield self.jobs[-1]
+
+
+    def done(self, job, callback, result, error):
+        with self.lock:
+            self.running -= 1
+
+            if not job.cancelled:
+                callback(result, error)
+
+            self.pump()
+
+
+    def status(self):
+        with self.lock:
+            return {
+                'cores': self.cores,
+                'running': self.running,
+                'queued': sum(len(j.ready) for j in self.jobs),
+                'jobs': len(self.jobs),
+            }
+
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+
+class Server:
+    """Runs stability and affinity jobs in a pool of workers which stay up
+    between jobs. Flags, parameters and the GXG table are read once, the
+    topologies are cached across jobs and a finished wildtype is reused by
+    every later job with the same wildtype and settings. Each variant is
+    reported as soon as it and the wildtype are done.
+    """
+    def __init__(self, root, cores, options, parameters, gxg_table):
+        self.root = os.path.abspath(root)
+        self.options = options
+        self.parameters = parameters
+        self.gxg_table = gxg_table
+        self.ids = itertools.count(1)
+
+        for d in ('jobs', '.wildtypes', '.topologies'):
+            os.makedirs(self.root + '/' + d, exist_ok=True)
+
+        self.scheduler = Scheduler(cores)
+
+
+    def key(self, spec):
+        """Identifies the wildtype results of a job. In localized mode the
+        region depends on all mutations, so they are part of it.
+        """
+        h = hashlib.sha1()
+
+        for f in (spec['dir'] + '/' + spec['wildtype'],
+            self.options['flags'], self.options['spmdp']):
+
+            with open(f, 'rb') as content:
+                h.update(content.read())
+
+        h.update(json.dumps([spec['routine'], spec['chains'],
+            spec['no_concoord'], self.options], sort_keys=True).encode())
+
+        if self.options.get('local') is not None:
+
+            with open(spec['dir'] + '/mutations.txt', 'rb') as muts:
+                h.update(muts.read())
+
+        return h.hexdigest()
+
+
+    def accept(self, request):
+        """Make the directory of a job and queue its setup. The wildtype is
+        a .pdb file, the mutations either a file or a list of lines as in the
+        mutations file.
+        """
+        routine = request.get('routine', 'stability')
+
+        if routine not in ('stability', 'affinity'):
+            raise ValueError("Unknown routine %s" % routine)
+
+        id_ = '%d-%d' % (os.getpid(), next(self.ids))
+        spec = {
+            'id': id_,
+            'routine': routine,
+            'dir': self.root + '/jobs/' + id_,
+            'wildtype': os.path.basename(request['wildtype']),
+            'chains': "".join(request.get('chains', 'A')),
+            'no_concoord': bool(request.get('no_concoord', False)),
+            'options': self.options,
+            'parameters': self.parameters[routine],
+            'gxg_table': self.gxg_table,
+            'topologies': self.root + '/.topologies',
+            'wildtypes': self.root + '/.wildtypes',
+        }
+        os.makedirs(spec['dir'])
+        shutil.copy(request['wildtype'], spec['dir'])
+        mutations = request['mutations']
+
+        if isinstance(mutations, str):
+            shutil.copy(mutations, spec['dir'] + '/mutations.txt')
+
+        else:
+
+            with open(spec['dir'] + '/mutations.txt', 'w') as muts:
+                muts.write("".join(m + '\n' for m in mutations))
+
+        mut_df = parse_mutations(spec['dir'] + '/mutations.txt')
+        variants = ["+".join([j for j in i if len(j) > 0])
+            for i in mut_df.index]
+        spec['key'] = self.key(spec)
+
+        job = Job(spec, variants)
+        job.send('accepted', directory=spec['dir'], variants=variants)
+        self.scheduler.add(job)
+        self.scheduler.submit(job, setup, (spec,),
+            lambda r, e: self.started(job, r, e))
+
+        return job
+
+
+    def started(self, job, cached, error):
+        if error is not None:
+            job.send('error', reason=str(error))
+            self.finish(job)
+            return
+
+        wt = job.spec['wildtype'][:job.spec['wildtype'].find('.pdb')]
+
+        if cached:
+            job.wildtype = ''
+
+        else:
+            self.scheduler.submit(job, pipeline, (job.spec, wt),
+                lambda r, e: self.wildtype(job, r, e))
+
+        for v in job.variants:
+            self.scheduler.submit(job, pipeline, (job.spec, v),
+                lambda r, e, v=v: self.variant(job, v, r, e))
+
+
+    def wildtype(self, job, reason, error):
+        job.wildtype = str(error) if error is not None else (reason or '')
+
+        for v in job.waiting:
+            self.result(job, v)
+
+        job.waiting = []
+
+
+    def variant(self, job, v, reason, error):
+        if error is not None or reason is not None:
+            self.failed(job, v, str(error) if reason is None else reason)
+
+        elif job.wildtype is None:
+            job.waiting.append(v)
+
+        else:
+            self.result(job, v)
+
+
+    def result(self, job, v):
+        """Collect a finished variant, unless the wildtype failed.
+        """
+        if len(job.wildtype) > 0:
+            self.failed(job, v, "wildtype failed: " + job.wildtype)
+            return
+
+        def collected(values, error):
+
+            if error is not None:
+                self.failed(job, v, str(error))
+
+            else:
+                job.send('result', variant=v, **values)
+                self.close(job)
+
+        self.scheduler.submit(job, collect, (job.spec, v), collected)
+
+
+    def failed(self, job, v, reason):
+        job.send('failed', variant=v, reason=reason)
+        self.close(job)
+
+
+    def close(self, job):
+        """Count a reported variant, the job is done with the last.
+        """
+        job.open -= 1
+
+        if job.open == 0:
+            job.send('done')
+            self.finish(job)
+
+
+    def finish(self, job):
+        self.scheduler.remove(job)
+
+
+    def cancel(self, job):
+        """Drop the waiting tasks of a job whose client went away. Running
+        tasks are finished, their results ignored.
+        """
+        job.cancelled = True
+        self.scheduler.remove(job)
+
+
+class Handler(socketserver.StreamRequestHandler):
+    """One connection: a request as one line of JSON, answered with one
+    line of JSON per event. A job streams its events until it is done.
+    """
+    def send(self, event):
+        self.wfile.write(json.dumps(event).encode() + b'\n')
+        self.wfile.flush()
+
+
+    def handle(self):
+        server = self.server.ccpbsa
+
+        try:
+            request = json.loads(self.rfile.readline())
+            kind = request.get('request', 'job')
+
+            if kind == 'status':
+                self.send(dict(server.scheduler.status(), event='status'))
+                return
+
+            if kind == 'shutdown':
+                self.send({'event': 'shutdown'})
+                threading.Thread(target=self.server.shutdown).start()
+                return
+
+            job = server.accept(request)
+
+        except (ValueError, KeyError, TypeError, OSError) as e:
+            self.send({'event': 'error', 'reason': str(e)})
+            return
+
+        while True:
+            event = job.events.get()
+
+            try:
+                self.send(event)
+
+            except OSError:
+                server.cancel(job)
+                return
+
+            if event['event'] in ('done', 'error'):
+                return
+
+
+def serve(socket_path, root, cores, options, parameters, gxg_table):
+    """Run a server on a Unix socket until it gets a shutdown request.
+    """
+    server = Server(root, cores, options, parameters, gxg_table)
+    socket_path = os.path.abspath(socket_path)
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    unix = socketserver.ThreadingUnixStreamServer(socket_path, Handler)
+    unix.daemon_threads = True
+    unix.ccpbsa = server
+
+    try:
+        unix.serve_forever()
+
+    finally:
+        unix.server_close()
+        server.scheduler.close()
+        os.remove(socket_path)
+
+
+def submit(request, socket_path=SOCKET):
+    """Send a job or a request to a running server and yield its events as
+    they arrive.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(socket_path)
+        s.sendall(json.dumps(request).encode() + b'\n')
+
+        for line in s.makefile('rb'):
+            yield json.loads(line)
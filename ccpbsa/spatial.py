@@ -0,0 +1,171 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+REBUILD = 0.1 # share of moved atoms after which all trees are rebuilt
+
+#    Neighbours are searched with KD-trees: one of all atoms as they were
+#    when it was built and a small one of the atoms moved since, e.g. a
+#    mutated side chain. Results of the first tree for moved atoms are
+#    dropped, the second one stands in for them. Queries of many points
+#    are answered at once by a tree of the points.
+
+
+class SpatialIndex:
+    """Neighbour search over the coordinates xyz (atoms x 3, nm) of a
+    structure, for radius and nearest neighbour queries of many points at
+    once. atoms are the records of read_pdb, (chain, residue number, ...),
+    for the masks of select. Queries take a boolean mask of the atoms to
+    consider.
+    """
+    def __init__(self, xyz, atoms=None):
+        self.xyz = np.array(xyz, dtype=float).reshape(-1, 3)
+        self.chains = None if atoms is None \
+            else np.array([a[0] for a in atoms])
+        self.residues = None if atoms is None \
+            else [(a[0], a[1]) for a in atoms]
+        self.build()
+
+
+    def __len__(self):
+        return len(self.xyz)
+
+
+    def build(self):
+        """(Re)build the tree of all atoms.
+        """
+        self.tree = cKDTree(self.xyz)
+        self.moved = np.zeros(len(self), dtype=bool)
+        self.overlay = None
+        self.overlay_atoms = np.zeros(0, dtype=int)
+
+
+    def update(self, idx, xyz):
+        """Move the atoms idx to xyz. Only the tree of the moved atoms is
+        rebuilt, unless they are more than REBUILD of all.
+        """
+        self.xyz[idx] = xyz
+        self.moved[idx] = True
+
+        if self.moved.sum() > REBUILD * len(self):
+            self.build()
+            return
+
+        self.overlay_atoms = np.where(self.moved)[0]
+        self.overlay = cKDTree(self.xyz[self.overlay_atoms])
+
+
+    def select(self, chains=None, residues=None):
+        """Boolean mask of the atoms in any of the chains and, if given,
+        of the residues, as (chain, residue number) with an empty chain
+        matching all chains.
+        """
+        mask = np.ones(len(self), dtype=bool)
+
+        if chains is not None:
+            mask &= np.isin(self.chains, list(chains))
+
+        if residues is not None:
+            residues = set((str(c), str(r)) for c, r in residues)
+            numbers = set(r for c, r in residues if c == '')
+            mask &= np.array([r in residues or r[1] in numbers
+                for r in self.residues], dtype=bool)
+
+        return mask
+
+
+    def query(self, points, r, mask=None):
+        """All atoms (of mask) within r of any of the points (points x 3).
+        Returns the point and the atom of each pair.
+        """
+        points = cKDTree(np.asarray(points, dtype=float).reshape(-1, 3))
+        found = points.sparse_distance_matrix(self.tree, r,
+            output_type='ndarray')
+        p, j = found['i'], found['j']
+        keep = ~self.moved[j]
+        p, j = p[keep], j[keep]
+
+        if self.overlay is not None:
+            found = points.sparse_distance_matrix(self.overlay, r,
+                output_type='ndarray')
+            p = np.concatenate([p, found['i']])
+            j = np.concatenate([j, self.overlay_atoms[found['j']]])
+
+        if mask is not None:
+            keep = mask[j]
+            p, j = p[keep], j[keep]
+
+        return p, j
+
+
+    def within(self, points, r, mask=None):
+        """Boolean mask of the atoms (of mask) within r of any of the
+        points.
+        """
+        near = np.zeros(len(self), dtype=bool)
+        near[self.query(points, r, mask)[1]] = True
+
+        return near
+
+
+    def pairs(self, r, mask=None):
+        """All pairs i < j of atoms (of mask) within r of each other.
+        """
+        found = self.tree.query_pairs(r, output_type='ndarray')
+        i, j = found[:, 0], found[:, 1]
+        keep = ~(self.moved[i] | self.moved[j])
+        i, j = i[keep], j[keep]
+
+        if self.overlay is not None:
+            p, k = self.query(self.xyz[self.overlay_atoms], r)
+            p = self.overlay_atoms[p]
+            keep = (p != k) & ((p < k) | ~self.moved[k])
+            a, b = p[keep], k[keep]
+            i = np.concatenate([i, np.minimum(a, b)])
+            j = np.concatenate([j, np.maximum(a, b)])
+
+        if mask is not None:
+            keep = mask[i] & mask[j]
+            i, j = i[keep], j[keep]
+
+        return i, j
+
+
+    def contacts(self, a, b, r):
+        """Masks of the atoms of a within r of any of b and of those of b
+        within r of any of a, e.g. the interface of two chain groups.
+        """
+        p, j = self.query(self.xyz[a], r, b)
+        near_a = np.zeros(len(self), dtype=bool)
+        near_a[np.where(a)[0][p]] = True
+        near_b = np.zeros(len(self), dtype=bool)
+        near_b[j] = True
+
+        return near_a, near_b
+
+
+    def nearest(self, points, k=1, mask=None):
+        """Distances and atoms (points x k) of the k atoms (of mask) closest
+        to each of the points, nearest first. Missing neighbours have the
+        distance inf and the atom -1.
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 3)
+
+        if mask is not None or self.overlay is not None:
+            atoms = np.arange(len(self)) if mask is None \
+                else np.where(mask)[0]
+            tree = cKDTree(self.xyz[atoms])
+
+        else:
+            atoms = np.arange(len(self))
+            tree = self.tree
+
+        d, i = tree.query(points, [n + 1 for n in range(k)])
+        found = i < len(atoms)
+
+        return d, np.where(found, atoms[np.minimum(i, len(atoms) - 1)], -1)
+
+
+    def residues_of(self, mask):
+        """The residues, as (chain, residue number), of the atoms in mask.
+        """
+        return set(r for r, m in zip(self.residues, mask) if m)
@@ -0,0 +1,220 @@
+import os
+import shutil
+import hashlib
+import pandas as pd
+from .CCPBSA import DataGenerator, AffinityGenerator, DataCollector, \
+    AffinityCollector, parse_flags
+
+GRAPH = 'graph.csv' # stage keys and nodes of the variants of a sweep
+SWEEP = 'sweep.csv' # fitted ddG of all variants
+DONE = 'done' # marks a finished node in its directory
+
+#    The stages of a sweep in order, with the sections of the flags file and
+#    the generator options each of them depends on, besides the stages
+#    before it. The structures CONCOORD starts from are minimized with the
+#    settings of the first variant of its node, so the ensembles do not
+#    depend on the force field. The members are minimized for each one.
+STAGES = [
+    ('concoord', ['dist', 'disco'], ['paired', 'rmsd_cutoff']),
+    ('minimization', ['pdb2gmx', 'editconf', 'grompp', 'mdrun', 'covar'],
+        ['minimizer', 'local']),
+    ('energy', ['gropbe'], ['spmdp', 'pb', 'energygroups']),
+]
+
+#    Files of the members that the following stages only read. They are
+#    shared between the nodes by hard links, all other files are copied.
+LINKED = ('.pdb', '.gro', '.tpr', '.trr', '.edr')
+
+
+def digest(h, v):
+    """Add v to the hash h, the contents of the file if v names one.
+    """
+    if isinstance(v, str) and os.path.isfile(v):
+
+        with open(v, 'rb') as f:
+            v = f.read()
+
+    h.update(v if isinstance(v, bytes) else repr(v).encode())
+
+
+def stage_keys(options, *inputs):
+    """Keys of the stages of a variant with the generator options: hashes of
+    the files inputs (the wildtype and mutations) and of all that a stage
+    and the stages before it depend on, see STAGES. Flags files are
+    compared by those sections only, with the files they name by contents.
+    Returns a dictionary of the keys by stage.
+    """
+    flags, input_ = parse_flags(options['flags'])
+    h = hashlib.sha1()
+    keys = {}
+
+    for f in inputs:
+        digest(h, f)
+
+    for stage, sections, names in STAGES:
+
+        for s in sections:
+
+            for v in [s] + flags.get(s, []) + [input_.get(s, b'')]:
+                digest(h, v)
+
+        for n in names:
+            digest(h, n)
+            digest(h, options.get(n))
+
+        keys[stage] = h.hexdigest()
+
+    return keys
+
+
+def graph(variants, *inputs):
+    """The task graph of a sweep over variants, given as their names and
+    generator options: the key of each stage of each variant. Variants with
+    the same key share the node of that stage, which runs once for all.
+    Returns a DataFrame of the keys, variants x stages.
+    """
+    return pd.DataFrame(
+        [stage_keys(o, *inputs) for _, o in variants],
+        index=pd.Index([n for n, _ in variants], name='VARIANT'),
+        columns=[s[0] for s in STAGES]
+    )
+
+
+def nodes(table, stage):
+    """The nodes of a stage of the graph table, each with the first variant
+    that needs it, whose options it runs with.
+    Returns a list of (variant, key).
+    """
+    return list(table[stage].drop_duplicates().items())
+
+
+def node(root, stage, key):
+    """The directory of the node of a stage in the sweep directory root.
+    """
+    return '%s/%s-%s' % (root, stage, key[:12])
+
+
+def start(d):
+    """Prepare the directory d of a node. A node that was stopped is started
+    over.
+    Returns False if it is done already.
+    """
+    if os.path.exists(d + '/' + DONE):
+        return False
+
+    shutil.rmtree(d, ignore_errors=True)
+    os.makedirs(d)
+
+    return True
+
+
+def finish(d):
+    """Mark the node in d as done, so later sweeps reuse it.
+    """
+    open(d + '/' + DONE, 'w').close()
+
+
+def generator(kind, wildtype, mutations, chains, options, dummy=False):
+    """The generator of a node in the current directory, for kind
+    'stability' or 'affinity'. wildtype is relative to the directory.
+    """
+    options = dict(options)
+
+    if kind == 'affinity':
+        return AffinityGenerator(wildtype, mutations, chaingrp=chains,
+            dummy=dummy, **options)
+
+    options.pop('energygroups', None)
+
+    return DataGenerator(wildtype, mutations, dummy=dummy, **options)
+
+
+def link_tree(src, dst):
+    """Copy the ensemble directory src to dst, the files of LINKED of its
+    members as hard links. Files in dst are replaced.
+    """
+    for path, _, files in os.walk(src):
+        rel = os.path.relpath(path, src)
+        member = rel != '.'
+        os.makedirs(os.path.join(dst, rel), exist_ok=True)
+
+        for f in files:
+            target = os.path.join(dst, rel, f)
+
+            if os.path.exists(target):
+                os.remove(target)
+
+            if member and f.endswith(LINKED):
+                os.link(os.path.join(path, f), target)
+
+            else:
+                shutil.copy2(os.path.join(path, f), target)
+
+
+def link_ensembles(src, dst, ensembles):
+    """Take over the ensembles from the main directory src of the node
+    before into the main directory dst.
+    """
+    for en in ensembles:
+        link_tree(src + '/' + en, dst + '/' + en)
+
+
+def collect(data, kind, parameters, gxg_table=None):
+    """Collect the results of an energy node like the stability and affinity
+    routines and write the tables to its main directory.
+    Returns the fitted ddG.
+    """
+    if kind == 'affinity':
+        search = AffinityCollector(data)
+        search.search_data()
+        search.daffinity()
+        search.ddaffinity()
+        search.fitaffinity(**parameters)
+        tables = dict(
+            G_bound=search.G_bound,
+            G_bound_mean=search.G_bound_mean,
+            G_grp1=search.G_grp1,
+            G_grp1_mean=search.G_grp1_mean,
+            G_grp2=search.G_grp2,
+            G_grp2_mean=search.G_grp2_mean,
+            dG_bound=search.dG_bound,
+            dG_unbound=search.dG_unbound,
+            ddG=search.ddG,
+            ddG_fit=search.ddG_fit,
+        )
+        err = search.ddG_err if search.paired else None
+
+    else:
+        search = DataCollector(data)
+        search.search_data()
+        search.dstability(gxg_table)
+        search.ddstability()
+        tables = dict(
+            G_fold=search.G,
+            G_fold_mean=search.G_mean,
+            dG_fold=search.dG,
+            dG_unfold=search.dG_unfld,
+            ddG=search.ddG,
+            ddG_fit=search.fitstability(**parameters),
+        )
+        err = search.dG_err if search.paired else None
+
+    if err is not None:
+        tables['ddG_err'] = err
+
+    for name, table in tables.items():
+        table.to_csv(data.maindir + '/' + name + '.csv')
+
+    search.failures.to_csv(data.maindir + '/failures.csv')
+
+    return tables['ddG_fit']
+
+
+def summary(table, root, wt):
+    """The fitted ddG of all variants of the graph table from their energy
+    nodes in root, one column per variant.
+    """
+    return pd.DataFrame(dict(
+        (v, pd.read_csv(node(root, 'energy', k) + '/' + wt + '/ddG_fit.csv',
+            index_col=0)['CALC']) for v, k in table['energy'].items()
+    ))
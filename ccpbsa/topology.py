@@ -0,0 +1,254 @@
+import os
+import numpy as np
+import scipy.sparse as sp
+
+
+def gmx_include_dirs():
+    """Directories searched for #include files which are not found next to
+    the including file, in the order GROMACS does: GMXLIB, then the share
+    directory of the installation.
+    """
+    dirs = []
+
+    if 'GMXLIB' in os.environ:
+        dirs.extend(os.environ['GMXLIB'].split(':'))
+
+    if 'GMXDATA' in os.environ:
+        dirs.append(os.environ['GMXDATA'] + '/top')
+
+    dirs.extend([
+        '/usr/local/gromacs/share/gromacs/top',
+        '/usr/share/gromacs/top',
+    ])
+
+    return dirs
+
+
+class Topology:
+    """Reads a GROMACS .top file with its #include files and #define
+    directives. The directives of the force field are kept in self.sections,
+    molecule types in self.moleculetypes and the system composition in
+    self.molecules. Lines are stored as lists of strings with the macros
+    already substituted.
+    """
+    def __init__(self, top, defines=(), include_dirs=None):
+        self.defines = dict((d, '') for d in defines)
+        self.include_dirs = gmx_include_dirs() if include_dirs is None \
+            else include_dirs
+        self.sections = {}
+        self.moleculetypes = {}
+        self.molecules = []
+        self.missing = []
+        self._section = None
+        self._moltype = None
+        self.read(os.path.abspath(top))
+
+
+    def read(self, fname):
+        """Preprocess a topology file and sort its lines into sections.
+        """
+        here = os.path.dirname(fname)
+        skip = [] # stack of booleans for #ifdef blocks
+
+        with open(fname, 'r') as top:
+            lines = top.readlines()
+
+        for l in lines:
+            l = l[:l.find(';')] if ';' in l else l
+            l = l.strip()
+
+            if len(l) == 0:
+                continue
+
+            if l[0] == '#':
+                directive = l.split()
+                d = directive[0]
+
+                if d == '#ifdef':
+                    skip.append(directive[1] not in self.defines)
+
+                elif d == '#ifndef':
+                    skip.append(directive[1] in self.defines)
+
+                elif d == '#else':
+                    skip[-1] = not skip[-1]
+
+                elif d == '#endif':
+                    skip.pop()
+
+                elif any(skip):
+                    continue
+
+                elif d == '#define':
+                    self.defines[directive[1]] = " ".join(directive[2:])
+
+                elif d == '#undef':
+                    self.defines.pop(directive[1], None)
+
+                elif d == '#include':
+                    self.include(l.split(None, 1)[1].strip('"<> '), here)
+
+                continue
+
+            if any(skip):
+                continue
+
+            if l[0] == '[':
+                self.section(l[1:-1].strip())
+                continue
+
+            tokens = []
+
+            for t in l.split():
+                tokens.extend(self.defines[t].split() \
+                    if self.defines.get(t) else [t])
+
+            self.line(tokens)
+
+
+    def include(self, fname, here):
+        """Find an #include file like GROMACS does and read it. Files that can
+        not be found are recorded in self.missing.
+        """
+        for d in [here, os.getcwd()] + self.include_dirs:
+            path = os.path.join(d, fname)
+
+            if os.path.exists(path):
+                self.read(path)
+                return
+
+        self.missing.append(fname)
+
+
+    def section(self, name):
+        self._section = name
+
+        if name == 'moleculetype':
+            self._moltype = None
+
+
+    def line(self, tokens):
+        if self._section == 'moleculetype':
+            self._moltype = tokens[0]
+            self.moleculetypes[tokens[0]] = {'nrexcl': int(tokens[1])}
+
+        elif self._section == 'molecules':
+            self.molecules.append((tokens[0], int(tokens[1])))
+
+        elif self._section == 'system':
+            self.sections.setdefault('system', []).append(" ".join(tokens))
+
+        elif self._moltype is not None and self._section not in (
+            'defaults', 'atomtypes', 'bondtypes', 'pairtypes', 'angletypes',
+            'dihedraltypes', 'constrainttypes', 'nonbond_params'
+        ):
+            self.moleculetypes[self._moltype].setdefault(
+                self._section, []
+            ).append(tokens)
+
+        else:
+            self.sections.setdefault(self._section, []).append(tokens)
+
+
+    def atoms(self):
+        """Returns the atoms of the whole system in order as a list of
+        dictionaries with type, residue number, residue name, atom name,
+        charge and mass.
+        """
+        atoms = []
+
+        for name, count in self.molecules:
+            mol = [{
+                'type': a[1],
+                'resnr': int(a[2]),
+                'resname': a[3],
+                'name': a[4],
+                'charge': float(a[6]) if len(a) > 6 else 0.0,
+                'mass': float(a[7]) if len(a) > 7 else None,
+                'molecule': name,
+            } for a in self.moleculetypes[name].get('atoms', [])]
+            atoms.extend(mol * count)
+
+        return atoms
+
+
+def combination(top):
+    """C6 and C12 of all pairs of atom types of a Topology by the
+    combination rule of the force field alone. Returns the index of each
+    atom type and the two matrices.
+    """
+    comb = int(top.sections.get('defaults', [['1', '1']])[0][1])
+    types = top.sections.get('atomtypes', [])
+    index = dict((t[0], n) for n, t in enumerate(types))
+    v = np.array([float(t[-2]) for t in types])
+    w = np.array([float(t[-1]) for t in types])
+
+    if comb == 1: # c6 and c12 given, geometric mean
+        C6 = np.sqrt(np.outer(v, v))
+        C12 = np.sqrt(np.outer(w, w))
+
+    else: # sigma and epsilon given
+        sigma = (v[:, None] + v[None, :]) / 2 if comb == 2 \
+            else np.sqrt(np.outer(v, v))
+        eps = np.sqrt(np.outer(w, w))
+        C6 = 4 * eps * sigma**6
+        C12 = 4 * eps * sigma**12
+
+    return index, C6, C12
+
+
+def lj_parameters(top):
+    """C6 and C12 of all pairs of atom types of a Topology, from the
+    combination rule of the force field and its nonbond_params. Returns the
+    type index of each atom and the two matrices.
+    """
+    comb = int(top.sections.get('defaults', [['1', '1']])[0][1])
+    index, C6, C12 = combination(top)
+
+    for l in top.sections.get('nonbond_params', []):
+        i, j = index[l[0]], index[l[1]]
+        a, b = float(l[3]), float(l[4])
+
+        if comb != 1:
+            a, b = 4 * b * a**6, 4 * b * a**12
+
+        C6[i, j] = C6[j, i] = a
+        C12[i, j] = C12[j, i] = b
+
+    t = np.array([index[a['type']] for a in top.atoms()], dtype=int)
+
+    return t, C6, C12
+
+
+def exclusions(top):
+    """Sparse boolean matrix of the atom pairs of a Topology without
+    non-bonded interactions: atoms up to nrexcl bonds apart and the pairs of
+    the exclusions sections. The 1-4 pairs are left out with them.
+    """
+    blocks = []
+
+    for name, count in top.molecules:
+        mol = top.moleculetypes[name]
+        n = len(mol.get('atoms', []))
+        b = np.array(
+            [l[:2] for l in mol.get('bonds', []) + mol.get('constraints', [])],
+            dtype=int
+        ).reshape(-1, 2) - 1
+        A = sp.csr_matrix((np.ones(len(b)), (b[:, 0], b[:, 1])), shape=(n, n))
+        A = A + A.T + sp.identity(n, format='csr')
+        E = sp.identity(n, format='csr')
+
+        for _ in range(mol['nrexcl']):
+            E = E @ A
+
+        E = E.tolil()
+
+        for l in mol.get('exclusions', []):
+            i = int(l[0]) - 1
+
+            for j in l[1:]:
+                E[i, int(j)-1] = E[int(j)-1, i] = 1
+
+        blocks.extend([E.tocsr()] * count)
+
+    return sp.block_diag(blocks, format='csr') > 0
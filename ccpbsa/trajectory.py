@@ -0,0 +1,538 @@
+import os
+import re
+import struct
+from collections import namedtuple
+import numpy as np
+from .edr import Unpacker
+
+#    GROMACS coordinate files, read without the external tools. Files are
+#    memory mapped and the offset of each frame is found on first access by
+#    reading the frame headers only, so any frame is read without the ones
+#    before it. Coordinates come as float32 arrays (atoms x 3) in nm.
+#    .trr files are XDR encoded and hold the coordinates as they are, in
+#    single or double precision. .xtc files hold them as integers (the
+#    coordinates times a precision), packed into a bit stream: each atom
+#    relative to the smallest coordinates of the frame, and runs of atoms
+#    close to the one before as small differences to it, whose bit size
+#    follows XTC_MAGICINTS.
+TRR_MAGIC = 1993
+TRR_VERSION = b'GMX_trn_file'
+TRR_SIZES = ['ir', 'e', 'box', 'vir', 'pres', 'top', 'sym', 'x', 'v', 'f',
+    'natoms', 'step', 'nre']
+XTC_MAGIC = 1995
+XTC_LONG_MAGIC = 2023 # frames of over 2 GB, with 64 bit byte counts
+XTC_FIRSTIDX = 9 # the first usable index of XTC_MAGICINTS
+XTC_MAGICINTS = [
+    0, 0, 0, 0, 0, 0, 0, 0, 0, 8, 10, 12, 16, 20, 25, 32, 40, 50, 64, 80,
+    101, 128, 161, 203, 256, 322, 406, 512, 645, 812, 1024, 1290, 1625, 2048,
+    2580, 3250, 4096, 5060, 6501, 8192, 10321, 13003, 16384, 20642, 26007,
+    32768, 41285, 52015, 65536, 82570, 104031, 131072, 165140, 208063,
+    262144, 330280, 416127, 524287, 660561, 832255, 1048576, 1321122,
+    1664510, 2097152, 2642245, 3329021, 4194304, 5284491, 6658042, 8388607,
+    10568983, 13316085, 16777216
+]
+
+Frame = namedtuple('Frame', ['step', 'time', 'box', 'x'])
+
+
+def store(x, out=None):
+    """Coordinates x as float32, or written into out if given.
+    """
+    if out is None:
+        return x.astype(np.float32)
+
+    if out.shape != x.shape:
+        raise ValueError("%d atoms instead of %d" % (len(x), len(out)))
+
+    out[...] = x
+
+    return out
+
+
+def box_matrix(b):
+    """Box vectors (3 x 3) from the last line of a .gro file. The diagonal
+    comes first, the off-diagonal elements only for triclinic boxes.
+    """
+    box = np.diag(np.asarray(b[:3], dtype=np.float32))
+
+    if len(b) == 9:
+        box[0, 1], box[0, 2], box[1, 0], box[1, 2], box[2, 0], \
+            box[2, 1] = b[3:]
+
+    return box
+
+
+class Trajectory:
+    """Frames of a coordinate file, read on demand. Indexing gives the
+    coordinates of a frame, frame() its step, time and box as well.
+    Subclasses find the frames in index() and read one in read().
+    """
+    def __init__(self, fname):
+        self.fname = fname
+        self.data = np.memmap(fname, dtype=np.uint8, mode='r') \
+            if os.path.getsize(fname) > 0 else b''
+        self.offsets = None
+
+
+    def __len__(self):
+        if self.offsets is None:
+            self.offsets = self.index()
+
+        return len(self.offsets)
+
+
+    def __getitem__(self, i):
+        return self.frame(i).x
+
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+    def frame(self, i, out=None):
+        """Frame i, negative ones counted from the end. With out the
+        coordinates are written into it.
+        """
+        n = len(self)
+
+        if not -n <= i < n:
+            raise IndexError("%s has %d frames, not %d" % (self.fname, n, i))
+
+        return self.read(self.offsets[i % n], out)
+
+
+    def last(self):
+        """Index of the last frame with coordinates.
+        """
+        if len(self) == 0:
+            raise ValueError("No coordinates in %s" % self.fname)
+
+        return len(self) - 1
+
+
+class TRR(Trajectory):
+    """A .trr file. Frames may also hold velocities and forces, which are
+    not read, or lack coordinates, which are None then.
+    """
+    def header(self, pos):
+        """Sizes of the items of the frame at pos (see TRR_SIZES), its step,
+        time and real type and where its data starts.
+        """
+        unpacker = Unpacker(self.data)
+        unpacker.pos = pos
+
+        if unpacker.int() != TRR_MAGIC:
+            raise ValueError("No .trr frame at byte %d of %s"
+                % (pos, self.fname))
+
+#        The version string comes with its length including the terminating
+#        0 before the XDR string, only the latter in some writers.
+        n = unpacker.int()
+
+        if struct.unpack_from('>i', self.data, unpacker.pos)[0] != n - 1:
+            unpacker.pos -= 4
+
+        unpacker.string()
+        h = dict((k, unpacker.int()) for k in TRR_SIZES)
+        items = [h[k] for k in ('box', 'x', 'v', 'f')]
+        size = next((s for s in items if s > 0), 0)
+
+        if h['box'] > 0:
+            size //= 9
+
+        else:
+            size //= 3 * max(h['natoms'], 1)
+
+        h['real'] = '>f8' if size == 8 else '>f4'
+        h['time'] = float(unpacker.array(h['real'], 1)[0])
+        unpacker.array(h['real'], 1) # lambda
+        h['data'] = unpacker.pos
+        h['size'] = sum(h[k] for k in TRR_SIZES[:10])
+
+        return h
+
+
+    def index(self):
+        offsets = []
+        pos = 0
+
+        while pos < len(self.data):
+
+            try:
+                h = self.header(pos)
+
+            except struct.error:
+                break
+
+            if h['data'] + h['size'] > len(self.data):
+                break # a frame cut off by an interrupted run
+
+            offsets.append(pos)
+            pos = h['data'] + h['size']
+
+        return offsets
+
+
+    def read(self, pos, out=None):
+        h = self.header(pos)
+        box = x = None
+
+        if h['box'] > 0:
+            box = np.frombuffer(self.data, h['real'], 9, h['data']) \
+                .reshape(3, 3).astype(np.float32)
+
+        if h['x'] > 0:
+            x = store(np.frombuffer(self.data, h['real'], 3 * h['natoms'],
+                h['data'] + h['box'] + h['vir'] + h['pres']).reshape(-1, 3),
+                out)
+
+        return Frame(h['step'], h['time'], box, x)
+
+
+    def last(self):
+        for i in reversed(range(len(self))):
+
+            if self.header(self.offsets[i])['x'] > 0:
+                return i
+
+        raise ValueError("No coordinates in %s" % self.fname)
+
+
+class Bits:
+    """Reads a stream of bits, most significant first.
+    """
+    def __init__(self, buf):
+        self.buf = buf
+        self.pos = 0
+        self.nbits = 0
+        self.value = 0
+
+
+    def read(self, n):
+        """The next n bits as an integer.
+        """
+        while self.nbits < n:
+            self.value = (self.value << 8) | self.buf[self.pos]
+            self.pos += 1
+            self.nbits += 8
+
+        self.nbits -= n
+        value = self.value >> self.nbits
+        self.value &= (1 << self.nbits) - 1
+
+        return value
+
+
+    def ints(self, nbits, sizes):
+        """Three integers, each below its size, packed into one number of
+        nbits bits. The number is stored as bytes, the least significant
+        first.
+        """
+        n = shift = 0
+
+        while nbits > 8:
+            n |= self.read(8) << shift
+            shift += 8
+            nbits -= 8
+
+        if nbits > 0:
+            n |= self.read(nbits) << shift
+
+        z = n % sizes[2]
+        n //= sizes[2]
+
+        return n // sizes[1], n % sizes[1], z
+
+
+def decompress(buf, natoms, minint, maxint, smallidx):
+    """Integer coordinates (natoms x 3) of the bit stream buf of an .xtc
+    frame, decoded as by xdr3dfcoord of GROMACS.
+    """
+    sizeint = [hi - lo + 1 for lo, hi in zip(minint, maxint)]
+
+#    Large ranges are stored as one number per dimension, else all three in
+#    one.
+    if max(sizeint) > 0xffffff:
+        bitsizeint = [int(s).bit_length() for s in sizeint]
+        bitsize = 0
+
+    else:
+        bitsize = (sizeint[0] * sizeint[1] * sizeint[2]).bit_length()
+
+    bits = Bits(buf)
+    smaller = XTC_MAGICINTS[max(XTC_FIRSTIDX, smallidx - 1)] // 2
+    smallnum = XTC_MAGICINTS[smallidx] // 2
+    sizesmall = [XTC_MAGICINTS[smallidx]] * 3
+    coords = []
+    run = 0
+
+    while len(coords) < natoms:
+
+        if bitsize == 0:
+            c = [bits.read(b) for b in bitsizeint]
+
+        else:
+            c = bits.ints(bitsize, sizeint)
+
+        x, y, z = c[0] + minint[0], c[1] + minint[1], c[2] + minint[2]
+        is_smaller = 0
+
+#        A run (a multiple of 3 coordinates) of atoms close to this one
+#        follows, its length is kept until the next flag. The size of the
+#        small differences changes by is_smaller after each atom.
+        if bits.read(1) == 1:
+            run = bits.read(5)
+            is_smaller = run % 3 - 1
+            run -= run % 3
+
+        if run > 0:
+            px, py, pz = x, y, z
+
+            for k in range(0, run, 3):
+                dx, dy, dz = bits.ints(smallidx, sizesmall)
+                px, py, pz = px + dx - smallnum, py + dy - smallnum, \
+                    pz + dz - smallnum
+
+#                The first two atoms are swapped, for the water molecules
+#                whose oxygen comes first.
+                if k == 0:
+                    coords.append((px, py, pz))
+                    coords.append((x, y, z))
+
+                else:
+                    coords.append((px, py, pz))
+
+        else:
+            coords.append((x, y, z))
+
+        smallidx += is_smaller
+
+        if is_smaller < 0:
+            smallnum = smaller
+            smaller = XTC_MAGICINTS[smallidx - 1] // 2 \
+                if smallidx > XTC_FIRSTIDX else 0
+
+        elif is_smaller > 0:
+            smaller = smallnum
+            smallnum = XTC_MAGICINTS[smallidx] // 2
+
+        sizesmall = [XTC_MAGICINTS[smallidx]] * 3
+
+    return np.array(coords[:natoms], dtype=np.int64).reshape(-1, 3)
+
+
+class XTC(Trajectory):
+    """An .xtc file, with coordinates of a precision of usually 0.001 nm.
+    """
+    def header(self, pos):
+        """Number of atoms, step, time, box, and where the coordinates and
+        the frame end, with the precision and ranges of the compressed
+        coordinates.
+        """
+        unpacker = Unpacker(self.data)
+        unpacker.pos = pos
+        magic = unpacker.int()
+
+        if magic not in (XTC_MAGIC, XTC_LONG_MAGIC):
+            raise ValueError("No .xtc frame at byte %d of %s"
+                % (pos, self.fname))
+
+        h = dict(natoms=unpacker.int(), step=unpacker.int(),
+            time=unpacker.float())
+        h['box'] = unpacker.array('>f4', 9).reshape(3, 3).astype(np.float32)
+
+        if unpacker.int() != h['natoms']:
+            raise ValueError("Corrupt .xtc frame at byte %d of %s"
+                % (pos, self.fname))
+
+#        Few atoms are stored uncompressed.
+        if h['natoms'] <= 9:
+            h['data'] = unpacker.pos
+            h['end'] = unpacker.pos + 12 * h['natoms']
+
+            return h
+
+        h['precision'] = unpacker.float()
+        h['minint'] = [unpacker.int() for _ in range(3)]
+        h['maxint'] = [unpacker.int() for _ in range(3)]
+        h['smallidx'] = unpacker.int()
+        n = unpacker.int64() if magic == XTC_LONG_MAGIC else unpacker.int()
+        h['data'] = unpacker.pos
+        h['end'] = unpacker.pos + n + (-n) % 4
+
+        return h
+
+
+    def index(self):
+        offsets = []
+        pos = 0
+
+        while pos < len(self.data):
+
+            try:
+                h = self.header(pos)
+
+            except struct.error:
+                break
+
+            if h['end'] > len(self.data):
+                break
+
+            offsets.append(pos)
+            pos = h['end']
+
+        return offsets
+
+
+    def read(self, pos, out=None):
+        h = self.header(pos)
+
+        if h['natoms'] <= 9:
+            x = np.frombuffer(self.data, '>f4', 3 * h['natoms'], h['data'])
+
+        else:
+            x = decompress(
+                bytes(self.data[h['data']:h['end']]),
+                h['natoms'],
+                h['minint'],
+                h['maxint'],
+                h['smallidx']
+            ).astype(np.float32) * np.float32(1.0 / h['precision'])
+
+        return Frame(h['step'], h['time'], h['box'],
+            store(x.reshape(-1, 3), out))
+
+
+class GRO(Trajectory):
+    """A .gro file, of one or more frames. The width of the coordinates is
+    taken from the first atom, velocities are not read.
+    """
+    def index(self):
+        ends = np.flatnonzero(np.frombuffer(self.data, np.uint8) == 10) + 1
+
+        if len(self.data) > 0 and self.data[-1] != 10:
+            ends = np.append(ends, len(self.data))
+
+        self.starts = np.concatenate([[0], ends])
+        offsets = []
+        line = 0
+
+#        A frame is a title, the number of atoms, the atoms and the box.
+        while line + 2 < len(ends):
+            natoms = int(self.line(line + 1))
+
+            if line + natoms + 3 > len(ends):
+                break
+
+            offsets.append(line)
+            line += natoms + 3
+
+        return offsets
+
+
+    def line(self, i, n=1):
+        """n lines from line i, as one string.
+        """
+        return bytes(self.data[self.starts[i]:self.starts[i+n]]) \
+            .decode('utf-8', 'replace')
+
+
+    def read(self, line, out=None):
+        title = self.line(line)
+        natoms = int(self.line(line + 1))
+        lines = self.line(line + 2, natoms).splitlines()
+        b = np.array(self.line(line + natoms + 2).split(), dtype=np.float32)
+        time = re.search(r't=\s*(\S+)', title)
+        step = re.search(r'step=\s*(\d+)', title)
+
+        if natoms > 0:
+            p = lines[0].index('.', 20)
+            w = lines[0].index('.', p + 1) - p
+            x = np.array([(l[20:20+w], l[20+w:20+2*w], l[20+2*w:20+3*w])
+                for l in lines], dtype=float)
+
+        else:
+            x = np.zeros((0, 3))
+
+        return Frame(
+            int(step.group(1)) if step else 0,
+            float(time.group(1)) if time else 0.0,
+            box_matrix(b),
+            store(x, out)
+        )
+
+
+READERS = {'.trr': TRR, '.xtc': XTC, '.gro': GRO}
+
+
+def trajectory(fname):
+    """The reader of a coordinate file by its extension.
+    """
+    ext = os.path.splitext(fname)[1]
+
+    if ext not in READERS:
+        raise ValueError("Unknown coordinate file %s" % fname)
+
+    return READERS[ext](fname)
+
+
+def last_frames(files, out=None):
+    """The last coordinates of each of the files, stacked into out (files x
+    atoms x 3), which is allocated as float32 from the first file if not
+    given. Only one file is mapped at a time.
+    """
+    for n, f in enumerate(files):
+        t = trajectory(f)
+
+        if out is None:
+            x = t.frame(t.last()).x
+            out = np.empty((len(files),) + x.shape, dtype=np.float32)
+            out[0] = x
+
+        else:
+            t.frame(t.last(), out[n])
+
+    return out
+
+
+def pack_trr(frame):
+    """A frame with coordinates as single precision .trr frame.
+    """
+    natoms = len(frame.x)
+    box = frame.box is not None
+    sizes = dict((k, 0) for k in TRR_SIZES)
+    sizes.update(box=36 * box, x=12 * natoms, natoms=natoms,
+        step=int(frame.step))
+    header = struct.pack('>3i12s13i2f', TRR_MAGIC, len(TRR_VERSION) + 1,
+        len(TRR_VERSION), TRR_VERSION, *[sizes[k] for k in TRR_SIZES],
+        frame.time, 0.0)
+    data = [np.asarray(frame.x, dtype='>f4').tobytes()]
+
+    if box:
+        data.insert(0, np.asarray(frame.box, dtype='>f4').tobytes())
+
+    return header + b''.join(data)
+
+
+def concatenate(files, fname):
+    """Write the frames with coordinates of the files one after another into
+    the .trr file fname, as gmx trjcat -cat yes does, keeping their steps
+    and times.
+    Returns the number of frames.
+    """
+    n = 0
+
+    with open(fname, 'wb') as trr:
+
+        for f in files:
+            t = trajectory(f)
+
+            for i in range(len(t)):
+                frame = t.frame(i)
+
+                if frame.x is not None:
+                    trr.write(pack_trr(frame))
+                    n += 1
+
+    return n
@@ -0,0 +1,71 @@
+import pandas as pd
+from .CCPBSA import DataCollector, AffinityCollector
+
+
+def screen(data, parameters, gxg_table=None):
+    """Fitted ddG values of all variants from their minimized structures
+    only, as with --no-concoord. The energies have to be generated already.
+    Returns the collector.
+    """
+    n = data.n
+    data.n = 0
+
+    if gxg_table is None:
+        data.area()
+        search = AffinityCollector(data)
+        search.search_data()
+        search.daffinity()
+        search.ddaffinity()
+        search.fitaffinity(**parameters)
+
+    else:
+        search = DataCollector(data)
+        search.search_data(entropy=False)
+        search.dstability(gxg_table)
+        search.dG_unfld['-TS'] = 0
+        search.ddstability()
+        search.fitstability(**parameters)
+
+    data.n = n
+
+    return search
+
+
+def select(ddG, top=0, threshold=0.0, margin=0.0, chosen=()):
+    """Variants of a screened ddG table to run with full ensembles: the top
+    ones with the largest predicted effect, those whose CALC is within margin
+    of threshold (which the screen can not decide) and the chosen ones.
+    Variants that failed in the screen are not escalated.
+    Returns the reason for each variant.
+    """
+    unknown = [v for v in chosen if v not in ddG.index]
+
+    if len(unknown) > 0:
+        raise ValueError("Unknown variants: %s" % ", ".join(unknown))
+
+    calc = ddG['CALC'].dropna()
+    reasons = dict((v, 'selected') for v in chosen)
+
+    for v in calc.abs().sort_values(ascending=False).index[:top]:
+        reasons.setdefault(v, 'top')
+
+    for v in calc.index[(calc - threshold).abs() <= margin]:
+        reasons.setdefault(v, 'borderline')
+
+    return pd.Series(reasons, name='REASON', dtype=object)
+
+
+def merge(screened, full):
+    """One result set of both tiers: the values from the full ensembles where
+    there are some, the screened ones else, labelled in FIDELITY.
+    """
+    table = screened.copy()
+    table['FIDELITY'] = 'screen'
+    full = full.loc[full.index.intersection(table.index)]
+
+    for c in full.columns:
+        table.loc[full.index, c] = full[c]
+
+    table.loc[full.index, 'FIDELITY'] = 'ensemble'
+
+    return table
@@ -0,0 +1,165 @@
+import warnings
+import numpy as np
+import pandas as pd
+from .fitting import TERMS
+
+REPLICATES = 2000
+LEVEL = 0.95 # of the confidence intervals
+
+#    The members of an ensemble are resampled with replacement, all
+#    replicates at once. A clustered ensemble is resampled as the ensemble
+#    it stands for: as many draws as it had members, each center drawn with
+#    the probability of its weight.
+
+
+def draws(w, n, rng):
+    """Indices of n bootstrap samples (n x size) of members with the weights
+    w.
+    """
+    size = max(1, int(round(w.sum())))
+
+    return rng.choice(len(w), size=(n, size), p=w / w.sum())
+
+
+def nanmean(X, axis):
+    """Mean leaving out missing values, NaN without any.
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.nanmean(X, axis=axis)
+
+
+def replicate(X, w, n, rng):
+    """n bootstrap replicates (n x columns) of the mean of the member values
+    X (members x columns) with the weights w.
+    """
+    return nanmean(X[draws(w, n, rng)], axis=1)
+
+
+def differences(T, weights, ref, variants, paired=False, n=REPLICATES,
+    rng=None):
+    """Bootstrap replicates of the difference of the mean member values in T
+    (indexed by ensemble and member) between each variant and ref. In
+    paired mode pairs of members with the same number are drawn, else each
+    ensemble is drawn on its own and all variants share the replicates of
+    ref.
+    Returns an array (variants x n x columns).
+    """
+    rng = np.random.default_rng(0) if rng is None else rng
+    R = T.loc[ref]
+    w = weights.loc[ref]
+
+    if not paired:
+        base = replicate(R.values, w.values, n, rng)
+
+    out = []
+
+    for v in variants:
+        V = T.loc[v]
+
+        if paired:
+            common = V.index.intersection(R.index)
+            idx = draws(w.loc[common].values.astype(float), n, rng)
+            out.append(nanmean(V.loc[common].values[idx]
+                - R.loc[common].values[idx], axis=1))
+
+        else:
+            out.append(replicate(V.values, weights.loc[v].values, n, rng)
+                - base)
+
+    return np.stack(out)
+
+
+def fitted(R, columns, kind, parameters):
+    """Fitted CALC of replicates R (... x columns of the unfitted ddG) with
+    the parameters, as fitstability and fitaffinity do.
+    """
+    calc = parameters.get('pka', 0.0)
+
+    for name, terms in TERMS[kind]:
+
+        if terms is None:
+            calc = calc + parameters[name]
+
+        else:
+            calc = calc + parameters[name] \
+                * R[..., [columns.index(t) for t in terms]].sum(axis=-1)
+
+    return calc
+
+
+def summarize(R, calc, index, columns, estimate, level=LEVEL):
+    """Standard errors of the unfitted terms of the replicates R (variants x
+    n x columns) and of the fitted CALC replicates calc (variants x n), with
+    the percentile confidence interval of the latter, next to the fitted
+    estimate.
+    """
+    q = [50 * (1 - level), 50 * (1 + level)]
+    low, high = np.nanpercentile(calc, q, axis=1)
+    table = pd.DataFrame({
+        'CALC': estimate,
+        'CALC SE': np.nanstd(calc, axis=1, ddof=1),
+        'CALC LOW': low,
+        'CALC HIGH': high,
+    }, index=index)
+
+    for i, c in enumerate(columns):
+
+        if c != 'CALC':
+            table['%s SE' % c] = np.nanstd(R[..., i], axis=1, ddof=1)
+
+    return table
+
+
+def stability(search, parameters, n=REPLICATES, level=LEVEL, seed=0):
+    """Bootstrap the ddG of a DataCollector after ddstability. The unfolded
+    state (GXG) and the entropy are values of whole ensembles and are kept
+    fixed.
+    Returns the fitted CALC with its standard error and confidence interval
+    and the standard errors of the unfitted terms.
+    """
+    if search.n == 0:
+        raise ValueError("Bootstrapping needs ensembles")
+
+    G = search.G.columns.tolist()
+    columns = ['CALC'] + G + ['-TS']
+    variants = search.ddG.index
+    dG = differences(search.G, search.weights, search.wt, variants,
+        search.paired, n, np.random.default_rng(seed))
+    R = np.zeros(dG.shape[:2] + (len(columns),))
+    R[..., 1:-1] = dG - search.dG_unfld.loc[variants, G].values[:, None, :]
+    R[..., -1] = search.ddG.loc[variants, '-TS'].values[:, None]
+    R[..., 0] = R[..., 1:].sum(axis=2)
+    calc = fitted(R, columns, 'stability', parameters)
+
+    return summarize(R, calc, variants, columns,
+        search.ddG_fit.loc[variants, 'CALC'], level)
+
+
+def affinity(search, parameters, n=REPLICATES, level=LEVEL, seed=0):
+    """Bootstrap the ddG of an AffinityCollector after ddaffinity. Each
+    member contributes its bound energy less the unbound ones, the PPIS is
+    resampled from the wildtype.
+    Returns the fitted CALC with its standard error and confidence interval
+    and the standard errors of the unfitted terms.
+    """
+    if search.n == 0:
+        raise ValueError("Bootstrapping needs ensembles")
+
+    terms = ['SOLV', 'COUL', 'LJ (1-4)', 'LJ (SR)']
+    columns = ['CALC'] + terms + ['PPIS']
+    variants = search.ddG.index
+    rng = np.random.default_rng(seed)
+    T = search.G_bound[terms] - search.G_grp1[terms] - search.G_grp2[terms]
+    R = np.zeros((len(variants), n, len(columns)))
+    R[..., 1:-1] = differences(T, search.weights, search.wt, variants,
+        search.paired, n, rng)
+    R[..., -1] = replicate(
+        search.G_bound.loc[search.wt, ['PPIS']].values,
+        search.weights.loc[search.wt].values, n, rng
+    )[:, 0]
+    R[..., 0] = R[..., 1:].sum(axis=2)
+    calc = fitted(R, columns, 'affinity', parameters)
+
+    return summarize(R, calc, variants, columns,
+        search.ddG_fit.loc[variants, 'CALC'], level)
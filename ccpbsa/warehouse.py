@@ -0,0 +1,295 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import numpy as np
+import pandas as pd
+from .CCPBSA import TIMINGS
+
+PROVENANCE = 'provenance.csv' # settings of a run, in its main directory
+DATABASE = 'ccpbsa.db'
+
+#    Tables of a run directory that are ingested, by the name of their file.
+#    Their rows are the ensembles (with the member for the member tables),
+#    their columns the energy terms, stored one value per row.
+RESULTS = ['G_fold', 'G_fold_mean', 'dG_fold', 'dG_unfold', 'G_bound',
+    'G_bound_mean', 'G_grp1', 'G_grp1_mean', 'G_grp2', 'G_grp2_mean',
+    'dG_bound', 'dG_unbound', 'ddG', 'ddG_fit', 'ddG_err', 'ddG_bootstrap',
+    'ddG_screen', 'ddG_triage', 'ddG_cluster']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE,
+    campaign TEXT,
+    protein TEXT,
+    kind TEXT,
+    setting TEXT,
+    flags_hash TEXT,
+    forcefield TEXT,
+    ensemble_size INTEGER,
+    core_hours REAL,
+    ingested TEXT
+);
+CREATE TABLE IF NOT EXISTS settings (run INTEGER, key TEXT, value TEXT);
+CREATE TABLE IF NOT EXISTS parameters (run INTEGER, name TEXT, value REAL);
+CREATE TABLE IF NOT EXISTS timings (
+    run INTEGER, stage TEXT, tasks INTEGER, seconds REAL, failed INTEGER
+);
+CREATE TABLE IF NOT EXISTS sites (
+    run INTEGER, variant TEXT, chain TEXT, residue TEXT, aa TEXT,
+    mutation TEXT
+);
+CREATE TABLE IF NOT EXISTS results (
+    run INTEGER, tab TEXT, variant TEXT, member INTEGER, term TEXT,
+    value REAL
+);
+CREATE INDEX IF NOT EXISTS runs_protein ON runs (protein);
+CREATE INDEX IF NOT EXISTS runs_setting ON runs (setting, flags_hash);
+CREATE INDEX IF NOT EXISTS runs_forcefield ON runs (forcefield);
+CREATE INDEX IF NOT EXISTS runs_campaign ON runs (campaign);
+CREATE INDEX IF NOT EXISTS settings_key ON settings (key, value);
+CREATE INDEX IF NOT EXISTS sites_variant ON sites (run, variant);
+CREATE INDEX IF NOT EXISTS sites_residue ON sites (residue, chain);
+CREATE INDEX IF NOT EXISTS sites_chain ON sites (chain);
+CREATE INDEX IF NOT EXISTS sites_mutation ON sites (mutation);
+CREATE INDEX IF NOT EXISTS results_variant ON results (run, tab, variant);
+CREATE INDEX IF NOT EXISTS results_term ON results (tab, term);
+"""
+
+#    Filters of query on the runs and on the mutated sites of a variant.
+RUN_KEYS = ['protein', 'campaign', 'setting', 'flags_hash', 'forcefield',
+    'kind']
+SITE_KEYS = ['chain', 'residue', 'aa', 'mutation']
+
+
+def flags_hash(data):
+    """Hash of the settings of a DataGenerator that the energies depend on:
+    its flags with the contents of the files they name instead of their
+    paths, and the energy .mdp file.
+    """
+    h = hashlib.sha1()
+
+    for prog in sorted(data.flags):
+
+        for v in [prog] + data.flags[prog]:
+
+            if os.path.isfile(v):
+
+                with open(v, 'rb') as f:
+                    v = f.read()
+
+            h.update(v if isinstance(v, bytes) else v.encode())
+
+    with open(data.spmdp, 'rb') as f:
+        h.update(f.read())
+
+    return h.hexdigest()
+
+
+def write_provenance(data, kind, parameters, options):
+    """Write the provenance of a run to PROVENANCE in its main directory:
+    what was calculated, the hash of the settings, the force field, the
+    ensemble size, the fit parameters (as fit:<name>) and further options.
+    """
+    flags = data.flags.get('pdb2gmx', [])
+    table = dict(
+        protein=data.wt,
+        kind=kind,
+        flags_hash=flags_hash(data),
+        forcefield=flags[flags.index('-ff')+1] if '-ff' in flags else '',
+        ensemble_size=data.n,
+        **dict(('fit:' + k, v) for k, v in parameters.items()),
+        **options
+    )
+    pd.Series(table, dtype=object).to_csv(
+        data.maindir + '/' + PROVENANCE, header=False
+    )
+
+
+def read_provenance(maindir):
+    """The provenance of a run as a dictionary of strings, empty without
+    PROVENANCE.
+    """
+    fname = maindir + '/' + PROVENANCE
+
+    if not os.path.exists(fname):
+        return {}
+
+    table = pd.read_csv(fname, header=None, index_col=0, dtype=str,
+        keep_default_na=False)
+
+    return table[1].to_dict()
+
+
+def sites(variant):
+    """The mutated sites of a variant named like its directory, e.g.
+    B_E108A+B_H114A, as (chain, residue, aa, mutation).
+    """
+    found = []
+
+    for m in variant.split('+'):
+        s = re.match(r'^(?:(\w+)_)?([A-Z])(-?\d+[A-Z]?)([A-Z])$', m)
+
+        if s is not None:
+            found.append((s.group(1) or '', s.group(3), s.group(2),
+                s.group(4)))
+
+    return found
+
+
+def read_results(fname):
+    """A result table as rows of (variant, member, term, value). The member
+    is None for tables of whole ensembles.
+    """
+    table = pd.read_csv(fname)
+    index = [c for c in table.columns if c.startswith('Unnamed:')]
+    table = table.set_index(index)
+    values = table.apply(pd.to_numeric, errors='coerce') \
+        .dropna(axis=1, how='all')
+    rows = []
+
+    for idx, row in values.iterrows():
+        idx = idx if isinstance(idx, tuple) else (idx,)
+        member = int(idx[1]) if len(idx) > 1 else None
+
+        for term, v in row.items():
+            rows.append((str(idx[0]), member, term,
+                None if np.isnan(v) else float(v)))
+
+    return rows
+
+
+def read_run_timings(maindir):
+    """Tasks, seconds and failures of each stage of a run.
+    """
+    fname = maindir + '/' + TIMINGS
+
+    if not os.path.exists(fname):
+        return []
+
+    t = pd.read_csv(fname, header=None,
+        names=['stage', 'atoms', 'members', 'seconds', 'failed'])
+    t = t.groupby('stage').agg(tasks=('seconds', 'size'),
+        seconds=('seconds', 'sum'), failed=('failed', 'sum'))
+
+    return [(s, int(r['tasks']), float(r['seconds']), int(r['failed']))
+        for s, r in t.iterrows()]
+
+
+def connect(fname=DATABASE):
+    """Open the results database, creating its tables if needed.
+    """
+    db = sqlite3.connect(fname)
+    db.executescript(SCHEMA)
+
+    return db
+
+
+def ingest(db, maindir, campaign='', setting=None):
+    """Load the results of the run in maindir into the database db: its
+    provenance, fit parameters, timings and all tables of RESULTS that
+    exist. A run ingested before is replaced. setting names the settings of
+    the run, the hash of its flags by default.
+    Returns the id of the run.
+    """
+    maindir = os.path.abspath(maindir)
+    prov = read_provenance(maindir)
+    files = dict((t, maindir + '/' + t + '.csv') for t in RESULTS
+        if os.path.exists(maindir + '/' + t + '.csv'))
+
+    if len(files) == 0:
+        raise ValueError("No results in %s" % maindir)
+
+    timings = read_run_timings(maindir)
+    kind = prov.get('kind', 'affinity' if 'G_bound' in files else 'stability')
+
+    with db:
+        old = db.execute('SELECT id FROM runs WHERE path = ?', (maindir,)) \
+            .fetchone()
+
+        if old is not None:
+
+            for t in ('settings', 'parameters', 'timings', 'sites',
+                'results'):
+                db.execute('DELETE FROM %s WHERE run = ?' % t, old)
+
+            db.execute('DELETE FROM runs WHERE id = ?', old)
+
+        run = db.execute(
+            'INSERT INTO runs (path, campaign, protein, kind, setting, '
+            'flags_hash, forcefield, ensemble_size, core_hours, ingested) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (
+                maindir,
+                campaign,
+                prov.get('protein', os.path.basename(maindir)),
+                kind,
+                setting or prov.get('flags_hash', ''),
+                prov.get('flags_hash', ''),
+                prov.get('forcefield', ''),
+                int(prov['ensemble_size']) if 'ensemble_size' in prov
+                    else None,
+                sum(t[2] for t in timings) / 3600,
+                time.strftime('%Y-%m-%d %H:%M:%S'),
+            )
+        ).lastrowid
+        db.executemany('INSERT INTO settings VALUES (?, ?, ?)',
+            [(run, k, v) for k, v in prov.items()
+                if not k.startswith('fit:')])
+        db.executemany('INSERT INTO parameters VALUES (?, ?, ?)',
+            [(run, k[len('fit:'):], float(v)) for k, v in prov.items()
+                if k.startswith('fit:')])
+        db.executemany('INSERT INTO timings VALUES (?, ?, ?, ?, ?)',
+            [(run,) + t for t in timings])
+        variants = set()
+
+        for tab, fname in files.items():
+            rows = read_results(fname)
+            variants.update(r[0] for r in rows)
+            db.executemany('INSERT INTO results VALUES (?, ?, ?, ?, ?, ?)',
+                [(run, tab) + r for r in rows])
+
+        db.executemany('INSERT INTO sites VALUES (?, ?, ?, ?, ?, ?)',
+            [(run, v) + s for v in sorted(variants) for s in sites(v)])
+
+    return run
+
+
+def query(db, tab='ddG_fit', term='CALC', **where):
+    """Results of the table tab (see RESULTS) of all runs in the database
+    db, with the protein, campaign, setting and force field of their run.
+    term restricts them to one energy term, if given. where filters the runs
+    by the keys RUN_KEYS and the variants by SITE_KEYS, for which any of
+    their mutated sites has to match, e.g. residue='17'.
+    Returns a DataFrame.
+    """
+    unknown = [k for k in where if k not in RUN_KEYS + SITE_KEYS]
+
+    if len(unknown) > 0:
+        raise ValueError("Can not filter by %s" % ", ".join(unknown))
+
+    sql = 'SELECT r.protein, r.campaign, r.setting, r.forcefield, ' \
+        'v.variant, v.member, v.term, v.value FROM results v ' \
+        'JOIN runs r ON v.run = r.id WHERE v.tab = ?'
+    args = [tab]
+
+    if term is not None:
+        sql += ' AND v.term = ?'
+        args.append(term)
+
+    for k in RUN_KEYS:
+
+        if k in where:
+            sql += ' AND r.%s = ?' % k
+            args.append(str(where[k]))
+
+    site = [k for k in SITE_KEYS if k in where]
+
+    if len(site) > 0:
+        sql += ' AND EXISTS (SELECT 1 FROM sites s WHERE s.run = v.run ' \
+            'AND s.variant = v.variant' \
+            + ''.join(' AND s.%s = ?' % k for k in site) + ')'
+        args.extend(str(where[k]) for k in site)
+
+    return pd.read_sql_query(sql, db, params=args)
@@ -17,7 +17,8 @@ setuptools.setup(
     author_email='linkai.zhang1@googlemail.com',
     scripts=['ccpbsa/ccpbsa', 'ccpbsa/ccpbsa-setup'],
     include_package_data=True,
-    install_requires=["numpy", "pandas", "pymol", "tqdm"],
+    install_requires=["numpy", "scipy", "pandas", "pymol"],
+    extras_require={"test": ["pytest", "pyedr"]},
     zip_safe = False
 )
 
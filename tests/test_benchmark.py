@@ -0,0 +1,107 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('pymol')
+
+from ccpbsa.benchmark import read_grid, accuracy, benchmark
+from ccpbsa.fitting import KCAL
+
+STABILITY = os.path.join(os.path.dirname(__file__), os.pardir, 'ddG',
+    'stability')
+
+#    Stands in for the ccpbsa script: writes the bundled ddG table of the
+#    protein as the result of a run, the timings of two tasks and logs its
+#    runs next to the run directory. Fails with --fail.
+SCRIPT = '''import os, sys, shutil
+args = sys.argv[1:]
+name = os.path.basename(args[args.index('-w') + 1])[:-len('.pdb')]
+open(os.path.join('..', 'runs'), 'a').write(name + '\\n')
+if '--fail' in args:
+    sys.exit(1)
+os.makedirs(name)
+table = os.path.join(%r, name + '.csv')
+shutil.copy(table, os.path.join(name, 'ddG.csv'))
+shutil.copy(table, os.path.join(name, 'ddG_fit.csv'))
+open(os.path.join(name, 'timings.csv'), 'w').write(
+    'energy,100,1,1800.0,0\\nenergy,100,1,1800.0,0\\n')
+''' % STABILITY
+
+
+def test_accuracy():
+    """Scores on the variants with both values.
+    """
+    calc = pd.Series([1.0, 2.0, 3.0, np.nan], index=list('abcd'))
+    exp = pd.Series([2.0, 4.0, 5.0, 1.0, 9.0], index=list('dcbae'))
+    score = accuracy(calc, exp)
+
+    assert score['N'] == 3
+    assert score['PEARSON'] == pytest.approx(np.corrcoef([1, 2, 3],
+        [1, 5, 4])[0, 1])
+    assert score['SPEARMAN'] == pytest.approx(0.5)
+    assert score['RMSE'] == pytest.approx(np.sqrt(10 / 3))
+    assert np.isnan(accuracy(calc[:1], exp)['PEARSON'])
+
+
+def test_read_grid(tmp_path, monkeypatch):
+    """Named settings, files made absolute, comments left out.
+    """
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'flags.txt').write_text('')
+    (tmp_path / 'grid.txt').write_text('# settings\n\nn10 -f flags.txt\n'
+        'quick --no-concoord # without ensembles\n')
+
+    assert read_grid('grid.txt') == [
+        ('n10', ['-f', str(tmp_path / 'flags.txt')]),
+        ('quick', ['--no-concoord'])]
+
+    (tmp_path / 'grid.txt').write_text('a\na -v\n')
+
+    with pytest.raises(ValueError):
+        read_grid('grid.txt')
+
+
+def test_benchmark(tmp_path):
+    """Every setting on every protein, scored against experiment, with the
+    refit leaving out one protein. Failed runs score nothing and finished
+    ones are not run again.
+    """
+    inputs = tmp_path / 'inputs'
+    inputs.mkdir()
+    proteins = ['1pga', '1stn']
+
+    for p in proteins:
+        (inputs / (p + '.pdb')).write_text('')
+        (inputs / ('mutations_%s.txt' % p)).write_text('')
+
+    script = tmp_path / 'ccpbsa'
+    script.write_text(SCRIPT)
+    grid = [('good', []), ('bad', ['--fail'])]
+    args = (grid, proteins, str(inputs), STABILITY, str(tmp_path / 'work'),
+        str(script))
+    report = benchmark(*args)
+
+    for p in proteins:
+        calc = pd.read_csv(os.path.join(STABILITY, p + '.csv'),
+            index_col=0)['CALC']
+        exp = pd.read_csv(os.path.join(STABILITY, p + '-compare.csv'),
+            index_col=0)['EXP'] * KCAL
+
+        assert report.loc[('good', p), 'PEARSON'] \
+            == pytest.approx(accuracy(calc, exp)['PEARSON'])
+        assert report.loc[('good', p), 'CORE-H'] == pytest.approx(1.0)
+
+    good, bad = report.loc[('good', 'ALL')], report.loc[('bad', 'ALL')]
+
+    assert good['N'] == sum(report.loc[('good', p), 'N'] for p in proteins)
+    assert not good['FAILED'] and bad['FAILED']
+    assert good['CORE-H'] == pytest.approx(2.0)
+    assert good['LOPO RMSE'] > 0 and -1 <= good['LOPO R'] <= 1
+    assert bad['N'] == 0 and np.isnan(bad['LOPO R'])
+
+    benchmark(*args)
+    runs = [(tmp_path / 'work' / s / 'runs').read_text().split()
+        for s, _ in grid]
+
+    assert runs == [proteins, proteins * 2]
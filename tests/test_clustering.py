@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('pymol')
+
+from ccpbsa.clustering import rmsd_matrix, gromos, write_clusters, \
+    cluster_weights, superpose, displace
+
+
+def kabsch(a, b):
+    """RMSD of b rotated onto a, with the rotation made explicitly.
+    """
+    a = a - a.mean(axis=0)
+    b = b - b.mean(axis=0)
+    U, _, Vt = np.linalg.svd(b.T @ a)
+    d = np.sign(np.linalg.det(U @ Vt))
+    R = U @ np.diag([1, 1, d]) @ Vt
+
+    return np.sqrt(((b @ R - a)**2).sum(axis=1).mean())
+
+
+def rotation(rng):
+    """A random proper rotation matrix.
+    """
+    Q, R = np.linalg.qr(rng.normal(size=(3, 3)))
+    Q = Q * np.sign(np.diag(R))
+
+    return Q * np.sign(np.linalg.det(Q))
+
+
+def test_rmsd_matrix_brute_force():
+    """All pairs against superposing each pair on its own.
+    """
+    rng = np.random.default_rng(2)
+    X = rng.normal(size=(6, 20, 3))
+    D = rmsd_matrix(X)
+
+    for i in range(len(X)):
+
+        for j in range(len(X)):
+            assert D[i, j] == pytest.approx(kabsch(X[i], X[j]), abs=1e-9)
+
+
+def test_rmsd_matrix_rigid_motion():
+    """Rotated and moved copies are the same structure, mirror images are
+    not.
+    """
+    rng = np.random.default_rng(3)
+    x = rng.normal(size=(15, 3))
+    moved = x @ rotation(rng) + rng.normal(size=3)
+    mirrored = x * [1, 1, -1]
+    D = rmsd_matrix(np.stack([x, moved, mirrored]))
+
+    assert D[0, 1] == pytest.approx(0, abs=1e-6)
+    assert D[0, 2] == pytest.approx(kabsch(x, mirrored))
+    assert D[0, 2] > 0.1
+
+
+def test_gromos():
+    """The member with the most neighbours takes them first, the rest
+    cluster among themselves.
+    """
+    x = np.array([0.0, 0.1, 0.2, 0.3, 1.0, 1.1, 3.0])
+    D = np.abs(x[:, None] - x[None, :])
+
+    assert list(gromos(D, 0.15)) == [1, 1, 1, 3, 4, 4, 6]
+
+
+def test_cluster_weights(tmp_path):
+    """Only the centers are evaluated, weighted by the size of their
+    cluster, and all members once without clusters.
+    """
+    rng = np.random.default_rng(4)
+    x = rng.normal(size=(10, 3))
+    X = np.stack([x, x + 0.001, x + 0.002, rng.normal(size=(10, 3))])
+    write_clusters([1, 2, 3, 4], X, 0.01, str(tmp_path / 'clusters.csv'))
+
+    assert cluster_weights(str(tmp_path), 4) == [(1, 3), (4, 1)]
+    assert cluster_weights(str(tmp_path / 'none'), 2) == [(1, 1), (2, 1)]
+
+
+def test_superpose():
+    """Rigidly moved copies land on the reference, other structures at the
+    RMSD of Kabsch from it.
+    """
+    rng = np.random.default_rng(3)
+    ref = rng.normal(0, 1, (20, 3))
+    other = ref + rng.normal(0, 0.1, ref.shape)
+    X = np.stack([ref @ rotation(rng).T + 1.5, other @ rotation(rng).T])
+    S = superpose(X, ref)
+
+    assert S[0] == pytest.approx(ref)
+    assert np.sqrt(((S[1] - ref)**2).sum(axis=1).mean()) \
+        == pytest.approx(kabsch(ref, other))
+    assert displace(ref + 5, ref, X)[0] == pytest.approx(ref + 5)
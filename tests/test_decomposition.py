@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+import scipy.sparse as sp
+
+pytest.importorskip('pymol')
+
+from ccpbsa.decomposition import sasa, pair_energies, summarize, PROBE
+from ccpbsa.pbsolver import ONE_4PI_EPS0
+
+
+def test_sasa_single_atom():
+    """A lone atom is exposed on its whole sphere.
+    """
+    area = sasa(np.zeros((1, 3)), np.array([0.15]))
+
+    assert area[0] == pytest.approx(4 * np.pi * (0.15 + PROBE)**2)
+
+
+def test_sasa_two_atoms():
+    """Two overlapping spheres each lose a cap of 2 pi R h.
+    """
+    r, d = 0.15, 0.3
+    R = r + PROBE
+    xyz = np.array([[0, 0, 0], [d, 0, 0]], dtype=float)
+    area = sasa(xyz, np.array([r, r]), n=4000)
+    exposed = 4 * np.pi * R**2 - 2 * np.pi * R * (R - d / 2)
+
+    assert area == pytest.approx([exposed, exposed], rel=1e-2)
+
+
+def brute_force(x, q, t, C6, C12, excl):
+    """Energies of all pairs of x, looped one by one.
+    """
+    N = len(x)
+    lj, coul = np.zeros(N), np.zeros(N)
+
+    for i in range(N):
+
+        for j in range(i+1, N):
+
+            if excl[i, j]:
+                continue
+
+            r = np.linalg.norm(x[i] - x[j])
+            e = C12[t[i], t[j]] / r**12 - C6[t[i], t[j]] / r**6
+            c = ONE_4PI_EPS0 * q[i] * q[j] / r
+            lj[[i, j]] += e / 2
+            coul[[i, j]] += c / 2
+
+    return lj, coul
+
+
+def test_pair_energies():
+    """All members against a loop over the pairs, with exclusions, and the
+    partner terms only between the groups.
+    """
+    rng = np.random.default_rng(1)
+    M, N = 3, 12
+    X = rng.uniform(0, 1.5, (M, N, 3))
+    q = rng.uniform(-0.5, 0.5, N)
+    t = rng.integers(0, 3, N)
+    C6 = rng.uniform(1e-3, 5e-3, (3, 3))
+    C6 = (C6 + C6.T) / 2
+    C12 = C6 * 1e-6
+    excl = np.zeros((N, N), dtype=bool)
+    excl[0, 1] = excl[1, 0] = excl[4, 7] = excl[7, 4] = True
+    group = np.arange(N) < 5
+
+    acc = pair_energies(X, q, t, C6, C12, sp.csr_matrix(excl), group)
+    cross = excl | (group[:, None] == group[None, :])
+
+    for m in range(M):
+        lj, coul = brute_force(X[m], q, t, C6, C12, excl)
+        lj_p, coul_p = brute_force(X[m], q, t, C6, C12, cross)
+
+        assert acc['LJ'][m] == pytest.approx(lj)
+        assert acc['COUL'][m] == pytest.approx(coul)
+        assert acc['LJ (partner)'][m] == pytest.approx(lj_p)
+        assert acc['COUL (partner)'][m] == pytest.approx(coul_p)
+
+
+def test_summarize_without_members():
+    with pytest.raises(ValueError):
+        summarize([])
@@ -0,0 +1,86 @@
+import os
+import re
+import numpy as np
+import pytest
+
+pytest.importorskip('pymol')
+pyedr = pytest.importorskip('pyedr')
+
+from ccpbsa.edr import read_edr, read_edrs, lj_terms
+
+#    pyedr ships energy files of all versions from 2 on, in single and
+#    double precision and with blocks, each with the output of gmx energy.
+DATA = os.path.join(os.path.dirname(pyedr.__file__), 'tests', 'data')
+FILES = ['2', '2_d', '3', '3_d', '4', '4_d', 'blocks', 'cat_small', 'double',
+    'irregular']
+
+
+def read_xvg(fname):
+    """The terms of an .xvg file of gmx energy, by their legends.
+    """
+    with open(fname, 'r') as xvg:
+        legends = re.findall(r'@ s\d+ legend "(.*)"', xvg.read())
+
+    data = np.loadtxt(fname, comments=['#', '@'])
+
+    return data[:, 0], dict(zip(legends, data[:, 1:].T))
+
+
+@pytest.mark.parametrize('name', FILES)
+def test_read_edr_gmx_energy(name):
+    """All frames and terms as gmx energy printed them.
+    """
+    table = read_edr(os.path.join(DATA, name + '.edr'))
+    time, terms = read_xvg(os.path.join(DATA, name + '.xvg'))
+
+    assert table['Time'] == pytest.approx(time)
+
+    for k, v in terms.items():
+        assert table[k] == pytest.approx(v, rel=1e-4, abs=1e-3), k
+
+
+@pytest.mark.parametrize('name', FILES)
+def test_read_edr_pyedr(name):
+    """All terms at full precision, as read by pyedr.
+    """
+    fname = os.path.join(DATA, name + '.edr')
+    table = read_edr(fname)
+    ref = pyedr.edr_to_dict(fname)
+
+    assert set(ref) == set(table.dtype.names) - {'Step'}
+
+    for k, v in ref.items():
+        assert np.array_equal(table[k], v, equal_nan=True), k
+
+
+def test_read_edrs_unreadable(tmp_path):
+    """Files of version 1, truncated or missing ones are None.
+    """
+    with open(os.path.join(DATA, '2.edr'), 'rb') as edr:
+        data = edr.read()
+
+    (tmp_path / 'cut.edr').write_bytes(data[:100])
+    files = [os.path.join(DATA, '1.edr'), str(tmp_path / 'cut.edr'),
+        str(tmp_path / 'none.edr'), os.path.join(DATA, '2.edr')]
+    tables = read_edrs(files)
+
+    assert [tables[f] is None for f in files] == [True, True, True, False]
+
+
+def test_lj_terms():
+    """Means over the frames of the totals, of a pair of groups and of all
+    pairs with a group.
+    """
+    names = ['LJ-14', 'LJ (SR)', 'LJ-14:A-A', 'LJ-SR:A-A', 'LJ-14:A-B',
+        'LJ-SR:A-B', 'LJ-14:B-B', 'LJ-SR:B-B']
+    table = np.zeros(2, dtype=[(n, 'f8') for n in names])
+
+    for i, n in enumerate(names):
+        table[n] = [i, i + 2]
+
+    assert lj_terms(table) == (1, 2)
+    assert lj_terms(table, pair='A-B') == (5, 6)
+    assert lj_terms(table, group='B') == (5 + 7, 6 + 8)
+
+    with pytest.raises(ValueError):
+        lj_terms(table, pair='A-C')
@@ -0,0 +1,111 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('pymol')
+
+from ccpbsa.fitting import KCAL, TERMS, load, lstsq, score, cross_validate, \
+    kfold, candidates, fit, write_fit
+
+COLUMNS = ['SOLV', 'COUL', 'LJ (1-4)', 'LJ (SR)', 'SAS', '-TS']
+P = np.array([0.2, 0.5, 0.03, 0.1]) # alpha, beta, gamma and tau
+STABILITY = os.path.join(os.path.dirname(__file__), os.pardir, 'ddG',
+    'stability')
+
+
+def tables(d, noise=0.0, seed=0):
+    """Unfitted ddG tables of three proteins with experimental values made
+    from them with the parameters P, in kcal/mol.
+    """
+    rng = np.random.default_rng(seed)
+
+    for p, n in (('a', 8), ('b', 6), ('c', 7)):
+        calc = pd.DataFrame(rng.normal(0, 10, (n, len(COLUMNS))),
+            columns=COLUMNS, index=['V%d' % i for i in range(n)])
+        X = np.stack([calc[t].sum(axis=1) for _, t in TERMS['stability']], 1)
+        exp = (X @ P + rng.normal(0, noise, n)) / KCAL
+        calc.to_csv(os.path.join(d, p + '.csv'))
+        pd.DataFrame({'EXP': exp[::-1]}, index=calc.index[::-1]) \
+            .to_csv(os.path.join(d, p + '-compare.csv'))
+
+
+def test_load(tmp_path):
+    """Rows of both tables matched by variant, the values in kJ/mol.
+    """
+    tables(str(tmp_path))
+    (tmp_path / 'd.csv').write_text(',SOLV\n')
+    X, y, groups = load(str(tmp_path))
+
+    assert X.shape == (21, 4)
+    assert groups.tolist() == ['a'] * 8 + ['b'] * 6 + ['c'] * 7
+    assert X @ P == pytest.approx(y)
+    assert len(load(str(tmp_path), proteins=['b'])[1]) == 6
+
+
+def test_fit_exact(tmp_path):
+    """Noiseless data give back the parameters, and every validation
+    predicts it exactly.
+    """
+    tables(str(tmp_path))
+    parameters, scores, candidate = fit(str(tmp_path), k=3, n=50)
+
+    assert list(parameters) == ['alpha', 'beta', 'gamma', 'tau']
+    assert list(parameters.values()) == pytest.approx(P)
+    assert scores.index.tolist() == ['fit', '3-fold',
+        'leave-one-protein-out', 'best of 50 candidates']
+    assert scores['RMSE'].values == pytest.approx([0] * 4, abs=1e-9)
+    assert scores['R'].values == pytest.approx([1] * 4)
+    assert candidate.values == pytest.approx(P)
+
+
+def test_leave_one_protein_out(tmp_path):
+    """Each protein is predicted by the fit on the others.
+    """
+    tables(str(tmp_path), noise=2.0)
+    X, y, groups = load(str(tmp_path))
+    pred = cross_validate(X, y, groups)
+
+    for p in 'abc':
+        test = groups == p
+        assert pred[test] == pytest.approx(X[test] @ lstsq(X[~test], y[~test]))
+
+
+def test_score():
+    """Many parameter sets at once, as one at a time.
+    """
+    rng = np.random.default_rng(1)
+    X, y = rng.normal(size=(30, 4)), rng.normal(size=30)
+    Ps = candidates(P, 5, seed=2)
+    rmse, r = score(X, y, Ps)
+
+    assert np.array_equal(Ps[0], P)
+    assert (np.abs(Ps / P - 1) <= 0.5).all()
+
+    for i, p in enumerate(Ps):
+        assert rmse[i] == pytest.approx(np.sqrt(((X @ p - y)**2).mean()))
+        assert r[i] == pytest.approx(np.corrcoef(X @ p, y)[0, 1])
+
+
+def test_kfold():
+    folds = kfold(23, 5)
+
+    assert sorted(np.bincount(folds)) == [4, 4, 5, 5, 5]
+    assert np.array_equal(folds, kfold(23, 5))
+
+
+def test_bundled():
+    """The fit on the bundled stability sets validates worse out of sample
+    than in it.
+    """
+    _, scores, _ = fit(STABILITY, n=100)
+
+    assert scores.loc['fit', 'RMSE'] \
+        <= scores.loc['leave-one-protein-out', 'RMSE']
+    assert 0 < scores.loc['fit', 'R'] <= 1
+
+
+def test_write_fit(tmp_path):
+    write_fit(str(tmp_path / 'fit.txt'), dict(alpha=0.5, c=1.25), 'affinity')
+
+    assert (tmp_path / 'fit.txt').read_text() == 'alpha=0.5\nc=1.25\npka=0\n'
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('pymol')
+
+from ccpbsa.CCPBSA import first, get_electro, get_area, get_edr_lj
+from ccpbsa.pbsolver import write_log
+
+
+def test_values(tmp_path):
+    write_log(str(tmp_path / 'solvation.log'), -12.5, -300.25)
+    (tmp_path / 'area.xvg').write_text('# gmx sasa\n@ s0 legend "Total"\n'
+        '0.000 51.2 3.5\n')
+
+    assert first(get_electro, str(tmp_path / 'solvation.log')) \
+        == (-12.5, -300.25)
+    assert first(get_area, str(tmp_path / 'area.xvg'), default=np.nan) \
+        == 3.5
+
+
+def test_missing(tmp_path):
+    """Missing files, files without the values and unreadable energy files
+    give the default.
+    """
+    (tmp_path / 'solvation.log').write_text('Reading parameters\n')
+    (tmp_path / 'area.xvg').write_text('# gmx sasa\n@ s0 legend "Total"\n')
+
+    for parser, f in ((get_electro, 'solvation.log'), (get_area, 'area.xvg'),
+        (get_electro, 'none.log'), (get_area, 'none.xvg')):
+        assert first(parser, str(tmp_path / f), default=None) is None
+
+    assert first(get_edr_lj, None, default=None) is None
+
+
+def test_parse_errors(tmp_path):
+    """Values the parsers do not understand are not taken for missing.
+    """
+    (tmp_path / 'solvation.log').write_text(
+        "Coulombic energy of the selected groups: nan? kJ/mol\n"
+        "Solvation energy of selected groups: -1.0 kJ/mol\n")
+    (tmp_path / 'area.xvg').write_text('0.000 51.2 3.5 kJ\n')
+
+    with pytest.raises(ValueError):
+        first(get_electro, str(tmp_path / 'solvation.log'))
+
+    with pytest.raises(ValueError):
+        first(get_area, str(tmp_path / 'area.xvg'))
+
+    with pytest.raises(ValueError):
+        first(get_edr_lj, np.zeros(2, dtype=[('LJ-14', 'f8'),
+            ('LJ (SR)', 'f8')]), pair='A-B')
@@ -0,0 +1,268 @@
+import os
+import numpy as np
+import pytest
+
+pytest.importorskip('pymol')
+
+from ccpbsa.CCPBSA import read_gro, TABLE
+from ccpbsa.minimizer import ForceField, minimize, read_table, hermite, \
+    functions, TERMS
+from ccpbsa.pbsolver import ONE_4PI_EPS0
+from ccpbsa.topology import Topology
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+PLAIN = dict(coulombtype='Cut-off', rcoulomb='0', rvdw='0')
+USER = dict(coulombtype='User', rcoulomb='0', rvdw='0')
+
+#    The interactions of one molecule of small.top with the parameters
+#    mdrun takes for them, written out by hand: atoms (1 based), function
+#    and parameters.
+BONDS = [
+    ((1, 2), 1, (0.1529, 224262.4)), ((2, 3), 1, (0.1529, 224262.4)),
+    ((3, 4), 1, (0.141, 267776.0)), ((1, 5), 1, (0.109, 284512.0)),
+    ((1, 6), 1, (0.109, 284512.0)), ((2, 7), 1, (0.109, 284512.0)),
+    ((2, 8), 1, (0.109, 284512.0)), ((3, 9), 1, (0.109, 284512.0)),
+    ((1, 10), 1, (0.1529, 224262.4)), ((2, 10), 2, (0.153, 7.15e6)),
+]
+ANGLES = [
+    ((1, 2, 3), 1, (112.7, 488.273)), ((2, 3, 4), 5, (109.5, 418.4, 0.25,
+    2000.0)), ((5, 1, 6), 1, (107.8, 276.144)), ((2, 1, 5), 1, (110.7,
+    313.8)), ((7, 2, 8), 1, (107.8, 276.144)), ((4, 3, 9), 1, (109.5,
+    292.88)), ((3, 2, 7), 2, (109.5, 450.0)),
+]
+RB = (0.6276, 1.8828, 0.0, -2.5104, 0.0, 0.0)
+DIHEDRALS = [
+    ((5, 1, 2, 3), 3, RB),
+    ((1, 2, 3, 4), 9, (0.0, 3.0, 3)), ((1, 2, 3, 4), 9, (180.0, 1.5, 2)),
+    ((1, 2, 3, 4), 9, (0.0, 0.5, 1)),
+    ((10, 1, 2, 3), 3, RB),
+    ((7, 2, 3, 4), 9, (0.0, 1.0, 3)),
+    ((1, 3, 2, 7), 4, (180.0, 4.6, 2)),
+    ((6, 1, 2, 8), 2, (0.0, 80.0)),
+    ((2, 1, 3, 4), 1, (180.0, 10.0, 2)),
+]
+PAIRS = [(1, 4), (5, 3), (10, 3)]
+NREXCL = 3
+
+
+def load():
+    top = Topology(os.path.join(DATA, 'small.top'))
+    _, _, x, _ = read_gro(os.path.join(DATA, 'small.gro'))
+
+    return top, x
+
+
+def dihedral_angle(a, b, c, d):
+    """The dihedral angle (rad), 0 for cis.
+    """
+    b1, b2, b3 = b - a, c - b, d - c
+    m, n = np.cross(b1, b2), np.cross(b2, b3)
+
+    return np.arctan2(np.linalg.norm(b2) * b1 @ n, m @ n)
+
+
+def bonded(x):
+    """Bonded energies of one molecule x, one interaction at a time.
+    """
+    E = dict(BOND=0.0, ANGLE=0.0, DIHEDRAL=0.0)
+
+    for (i, j), funct, (b0, kb) in BONDS:
+        r = np.linalg.norm(x[j-1] - x[i-1])
+        E['BOND'] += kb * (r**2 - b0**2)**2 / 4 if funct == 2 \
+            else kb * (r - b0)**2 / 2
+
+    for (i, j, k), funct, p in ANGLES:
+        u, v = x[i-1] - x[j-1], x[k-1] - x[j-1]
+        c = u @ v / np.linalg.norm(u) / np.linalg.norm(v)
+
+        if funct == 2:
+            E['ANGLE'] += p[1] * (c - np.cos(np.radians(p[0])))**2 / 2
+
+        else:
+            E['ANGLE'] += p[1] * (np.arccos(c) - np.radians(p[0]))**2 / 2
+
+        if funct == 5:
+            r13 = np.linalg.norm(x[k-1] - x[i-1])
+            E['ANGLE'] += p[3] * (r13 - p[2])**2 / 2
+
+    for atoms, funct, p in DIHEDRALS:
+        phi = dihedral_angle(*[x[a-1] for a in atoms])
+
+        if funct == 3:
+            E['DIHEDRAL'] += sum(c * np.cos(phi - np.pi)**n
+                for n, c in enumerate(p))
+
+        elif funct == 2:
+            d = (phi - np.radians(p[0]) + np.pi) % (2 * np.pi) - np.pi
+            E['DIHEDRAL'] += p[1] * d**2 / 2
+
+        else:
+            E['DIHEDRAL'] += p[1] * (1 + np.cos(p[2] * phi - np.radians(p[0])))
+
+    return E
+
+
+def excluded(n):
+    """Pairs of atoms of a molecule up to NREXCL bonds apart.
+    """
+    near = set((i, i) for i in range(n))
+
+    for _ in range(NREXCL):
+        near |= set((a, c) for a, b in near for (i, j), _, _ in BONDS
+            for b_, c in ((i-1, j-1), (j-1, i-1)) if b == b_)
+
+    return near
+
+
+def reference(top, x, cut=np.inf):
+    """Energy terms of the structure x (all molecules) by loops over the
+    interactions, Coulomb and LJ without tables.
+    """
+    defaults = top.sections['defaults'][0]
+    fudge_lj, fudge_qq = float(defaults[3]), float(defaults[4])
+    atoms = top.atoms()
+    q = [a['charge'] for a in atoms]
+    types = dict((t[0], (float(t[-2]), float(t[-1])))
+        for t in top.sections['atomtypes'])
+    pairtypes = dict(((l[0], l[1]), (float(l[3]), float(l[4])))
+        for l in top.sections['pairtypes'])
+
+    def lj(i, j, r, fudge=1.0):
+        a, b = atoms[i]['type'], atoms[j]['type']
+
+        if fudge != 1.0 and (a, b) in pairtypes:
+            sigma, eps = pairtypes[a, b]
+            fudge = 1.0
+
+        else:
+            sigma = np.sqrt(types[a][0] * types[b][0])
+            eps = np.sqrt(types[a][1] * types[b][1])
+
+        return fudge * 4 * eps * ((sigma / r)**12 - (sigma / r)**6)
+
+    n = len(atoms) // 2
+    E = dict((t, 0.0) for t in TERMS)
+    near = excluded(n)
+
+    for m in range(2):
+
+        for k, e in bonded(x[m*n:(m+1)*n]).items():
+            E[k] += e
+
+        for i, j in PAIRS:
+            i, j = m*n + i - 1, m*n + j - 1
+            r = np.linalg.norm(x[i] - x[j])
+            E['LJ (1-4)'] += lj(i, j, r, fudge_lj)
+            E['COUL (1-4)'] += fudge_qq * ONE_4PI_EPS0 * q[i] * q[j] / r
+
+    for i in range(len(x)):
+
+        for j in range(i+1, len(x)):
+            r = np.linalg.norm(x[i] - x[j])
+
+            if (i // n == j // n and (i % n, j % n) in near) or r >= cut:
+                continue
+
+            E['LJ (SR)'] += lj(i, j, r)
+            E['COUL (SR)'] += ONE_4PI_EPS0 * q[i] * q[j] / r
+
+    return E
+
+
+def test_energy_reference():
+    """Energy terms of the bundled structure against the interactions
+    written out by hand.
+    """
+    top, x = load()
+    E, _ = ForceField(top, PLAIN).energy(x[None])
+
+    for k, e in reference(top, x).items():
+        assert E[k][0] == pytest.approx(e, rel=1e-9, abs=1e-9), k
+
+
+def test_energy_cutoff():
+    """Only pairs within the cutoffs, the 1-4 pairs all.
+    """
+    top, x = load()
+    E, _ = ForceField(top, dict(PLAIN, rcoulomb='0.5', rvdw='0.5')) \
+        .energy(x[None])
+
+    for k, e in reference(top, x, 0.5).items():
+        assert E[k][0] == pytest.approx(e, rel=1e-9, abs=1e-9), k
+
+
+@pytest.mark.parametrize('mdp', [PLAIN, USER,
+    dict(PLAIN, rcoulomb='0.6', rvdw='0.8')])
+@pytest.mark.parametrize('terms', [True, False])
+def test_gradient(mdp, terms):
+    """The gradient against central finite differences of the energy, for
+    every coordinate of two structures.
+    """
+    top, x = load()
+    table = TABLE if mdp is USER else None
+    ff = ForceField(top, mdp, table, table)
+    X = np.stack([x, x + np.random.default_rng(0).normal(0, 0.005, x.shape)])
+    _, G = ff.energy(X, terms)
+    h = 1e-6
+    numeric = np.zeros(X.shape)
+
+    for a in range(X.shape[1]):
+
+        for c in range(3):
+            Xp, Xm = X.copy(), X.copy()
+            Xp[:, a, c] += h
+            Xm[:, a, c] -= h
+            numeric[:, a, c] = (sum(ff.energy(Xp, terms)[0].values())
+                - sum(ff.energy(Xm, terms)[0].values())) / (2 * h)
+
+    assert G == pytest.approx(numeric, rel=1e-5, abs=1e-3)
+
+
+def test_table_grid():
+    """The interpolated functions are the values and derivatives of the
+    table on its grid.
+    """
+    dr, V, D = read_table(TABLE)
+    table = hermite((dr, V, D), np.array([True, True, True]))
+    k = np.arange(50, len(V) - 1, 97)
+    r = k * dr
+
+    for c in range(3):
+        W = np.zeros((len(k), 3))
+        W[:, c] = 1
+        e, de = functions(r[None], W, table)
+
+        assert e[0] == pytest.approx(V[k, c], rel=1e-9)
+        assert de[0] == pytest.approx(D[k, c], rel=1e-9)
+
+
+def test_user_functions_need_table():
+    top, _ = load()
+
+    with pytest.raises(ValueError):
+        ForceField(top, USER)
+
+
+def test_minimize():
+    """Each member ends up without forces above emtol, lower in energy, and
+    the same as when it is minimized alone. Frozen atoms stay in place.
+    """
+    top, x = load()
+    rng = np.random.default_rng(1)
+    X = np.stack([x + rng.normal(0, 0.01, x.shape) for _ in range(3)])
+    frozen = np.zeros(len(x), dtype=bool)
+    frozen[10:] = True
+    ff = ForceField(top, PLAIN, frozen=frozen)
+    E0 = sum(ff.energy(X)[0].values())
+    Xm, E, steps = minimize(ff, X, 2000, 10.0)
+    _, G = ff.energy(Xm)
+
+    assert (steps < 2000).all()
+    assert (sum(E.values()) < E0).all()
+    assert np.linalg.norm(G[:, ~frozen], axis=2).max() <= 10.0
+    assert np.array_equal(Xm[:, frozen], X[:, frozen])
+
+    for m in range(3):
+        alone, _, n = minimize(ff, X[m:m+1], 2000, 10.0)
+        assert np.array_equal(alone[0], Xm[m])
+        assert n[0] == steps[m]
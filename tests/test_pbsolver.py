@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('pymol')
+
+from ccpbsa.pbsolver import PBSolver, ONE_4PI_EPS0
+
+TIGHT = dict(rmsc=1e-4, maxc=1e-4)
+
+
+def born(q, a, epsin, epsout):
+    """Solvation energy (kJ/mol) of an ion of charge q and radius a (nm)
+    moved from a dielectric epsin into epsout.
+    """
+    return ONE_4PI_EPS0 * q**2 / (2 * a) * (1 / epsout - 1 / epsin)
+
+
+@pytest.mark.parametrize('q, epsin', [(1.0, 1), (-2.0, 2)])
+def test_born_ion(q, epsin):
+    """The solvation energy of a single ion approaches the Born energy as
+    the spacing gets finer, the Coulomb energy of a single charge is 0.
+    """
+    ref = born(q, 0.2, epsin, 80)
+    errors = []
+
+    for spacing in (1.0, 0.5, 0.25):
+        solver = PBSolver([q], [0.2], epsIn=epsin, epsOut=80,
+            spacing=spacing, **TIGHT)
+        coul, solv = solver.solve(np.full((1, 3), 1.0))
+        errors.append(abs(solv / ref - 1))
+
+        assert coul == 0
+
+    assert errors[0] > errors[1] > errors[2]
+    assert errors[2] < 0.02
+
+
+def test_focusing():
+    """Focusing from coarser grids onto the spacing gives the energy of a
+    single grid with that spacing.
+    """
+    energies = []
+
+    for maxpoints in (97, 17):
+        solver = PBSolver([1.0], [0.2], epsIn=1, epsOut=80, spacing=0.25,
+            maxpoints=maxpoints, **TIGHT)
+        energies.append(solver.solve(np.full((1, 3), 1.0))[1])
+
+        assert len(solver.grids) == (1 if maxpoints == 97 else 2)
+
+    assert energies[1] == pytest.approx(energies[0], rel=2e-3)
+
+
+def test_coulomb():
+    """The Coulomb energy of a pair of charges in the solute dielectric.
+    """
+    xyz = np.array([[1.0, 1.0, 1.0], [1.5, 1.0, 1.0]])
+    coul, _ = PBSolver([1.0, -0.5], [0.17, 0.17], epsIn=2, spacing=1.0) \
+        .solve(xyz)
+
+    assert coul == pytest.approx(-ONE_4PI_EPS0 * 0.5 / 0.5 / 2)
+
+
+@pytest.mark.parametrize('maxpoints', [17, 9])
+def test_localized(maxpoints):
+    """The solvation energies of two selections far apart, each with grids
+    focused on it, add up to that of the whole structure: the charges
+    outside the focused grids still act on them.
+    """
+    rng = np.random.default_rng(0)
+    xyz = np.concatenate([rng.normal(0, 0.15, (6, 3)),
+        rng.normal(0, 0.15, (6, 3)) + [2.0, 0.0, 0.0]])
+    q = np.array([1.0, -1.0, 1.0, 0.5, -0.5, 1.0] * 2)
+    sel = np.arange(12) < 6
+    solvers = [PBSolver(q, np.full(12, 0.17), maxpoints=maxpoints)
+        for _ in range(3)]
+    full = solvers[0].solve(xyz)[1]
+
+    assert solvers[1].solve(xyz, sel)[1] + solvers[2].solve(xyz, ~sel)[1] \
+        == pytest.approx(full, rel=0.01)
+    assert solvers[1].grids[-1].n < solvers[0].grids[-1].n
@@ -0,0 +1,139 @@
+import os
+import numpy as np
+import pytest
+
+pytest.importorskip('pymol')
+
+from ccpbsa.planner import STAGES, tasks, calibrate, read_timings, makespan, \
+    balance, plan, human
+
+DATA = os.path.join(os.path.dirname(__file__), os.pardir)
+PDB = os.path.join(DATA, 'input-data', '1pga.pdb')
+MUTATIONS = os.path.join(DATA, 'input-data', 'mutations_1pga.txt')
+FLAGS = os.path.join(DATA, 'ccpbsa', 'parameters', 'flags.txt')
+ATOMS = 436 # heavy atoms of 1pga
+VARIANTS = 30
+
+
+def test_tasks():
+    """Tasks of each stage by mode.
+    """
+    assert tasks('stability', 4, 10) == dict(energy=50, minimization=5,
+        update=5, concoord=5, entropy=5)
+    assert tasks('stability', 4, 10, concoord=False) == dict(energy=5)
+    assert tasks('stability', 4, 10, paired=True, clustered=True) \
+        == dict(energy=50, minimization=1, update=1, concoord=1, mutate=4,
+        entropy=5, cluster=1)
+    assert tasks('affinity', 4, 10) == dict(energy=50, unbound=100, area=10,
+        minimization=5, update=5, concoord=5)
+
+
+def test_plan():
+    """Tasks, core hours from the default rates and wall times between the
+    core hours on all cores and on one.
+    """
+    table = plan(PDB, MUTATIONS, FLAGS, cores=4)
+    n = 3 # disco -n of the default flags
+
+    assert table.loc['energy', 'TASKS'] == (VARIANTS + 1) * n
+    assert table.loc['entropy', 'TASKS'] == VARIANTS + 1
+    assert table.loc['energy', 'CORE-H'] == pytest.approx(
+        (VARIANTS + 1) * n * STAGES['energy']['rate'] * ATOMS / 3600)
+    assert table.loc['concoord', 'SECONDS/TASK'] == pytest.approx(
+        STAGES['concoord']['rate'] * ATOMS * n)
+
+    stages = table.drop('TOTAL')
+
+    assert (stages['WALL-H'] >= stages['CORE-H'] / 4 - 1e-12).all()
+    assert (stages['WALL-H'] <= stages['CORE-H'] + 1e-12).all()
+    assert stages.loc['update', 'WALL-H'] \
+        == pytest.approx(stages.loc['update', 'CORE-H'])
+    assert table.loc['TOTAL', 'TASKS'] == stages['TASKS'].sum()
+    assert np.isnan(table.loc['TOTAL', 'SECONDS/TASK'])
+
+
+def test_plan_options():
+    """Programs left out by the in-process solvers and by energy groups.
+    """
+    full = plan(PDB, MUTATIONS, FLAGS, kind='affinity')
+    fast = plan(PDB, MUTATIONS, FLAGS, kind='affinity', pb='internal',
+        minimizer='internal', energygroups=True)
+    per_task = (full['LAUNCHES'] - fast['LAUNCHES']) / full['TASKS']
+
+    assert per_task['energy'] == 3
+    assert per_task['unbound'] == 2
+    assert per_task['minimization'] == 1
+    assert fast.loc['unbound', 'CORE-H'] \
+        == pytest.approx(full.loc['unbound', 'CORE-H'] / 2)
+
+
+def test_calibrate(tmp_path):
+    """Measured rates by least squares, the others scaled like the measured
+    ones, failed tasks left out.
+    """
+    (tmp_path / 'timings.csv').write_text(
+        "energy,100,1,10.0,0\nenergy,200,1,20.0,0\nenergy,100,1,99.0,1\n"
+        "concoord,100,10,2.0,0\n")
+    rates = calibrate(read_timings(str(tmp_path)))
+
+    assert rates['energy'] == pytest.approx(0.1)
+    assert rates['concoord'] == pytest.approx(0.002)
+
+    scale = np.median([0.1 / STAGES['energy']['rate'],
+        0.002 / STAGES['concoord']['rate']])
+
+    assert rates['entropy'] == pytest.approx(STAGES['entropy']['rate'] * scale)
+    assert calibrate(read_timings()) == dict((s, STAGES[s]['rate'])
+        for s in STAGES)
+
+
+def test_makespan():
+    """Longest first to the core free first, which is not always optimal.
+    """
+    assert makespan([], 4) == 0
+    assert makespan([2, 3, 2, 3, 2], 2) == 7
+    assert makespan([5, 1, 1], 8) == 5
+
+
+def test_human():
+    assert human(999) == '999.0 B'
+    assert human(1.5e9) == '1.5 GB'
+    assert human(2e16) == '20000.0 TB'
+
+
+def test_balance():
+    """Heavy tasks alone, longest first, the light ones in chunks of at
+    least a quarter of the share of a core, all tasks once.
+    """
+    rng = np.random.default_rng(0)
+    costs = np.concatenate([[50.0, 40.0], rng.uniform(1, 3, 60)])
+    names = ['t%d' % i for i in range(len(costs))]
+    heavy, chunks = balance(names, costs, 3)
+    light = [t for c in chunks for t in c]
+    cost = dict(zip(names, costs))
+    target = sum(cost[t] for t in light) / 12
+
+    assert heavy == ['t0', 't1']
+    assert sorted(heavy + light) == sorted(names)
+    assert [cost[t] for t in light] == sorted(costs[2:], reverse=True)
+    assert all(sum(cost[t] for t in c) >= target for c in chunks[:-1])
+    assert all(sum(cost[t] for t in c[:-1]) < target for c in chunks)
+    assert len(chunks) in (12, 13)
+
+
+def test_balance_even():
+    """Without costs, or with equal ones, all tasks are light and keep
+    their order.
+    """
+    names = list('abcdefgh')
+
+    for costs in ([0] * 8, [1] * 8):
+        heavy, chunks = balance(names, costs, 2)
+
+        assert heavy == []
+        assert chunks == [['a'], ['b'], ['c'], ['d'], ['e'], ['f'], ['g'],
+            ['h']]
+
+    assert balance([], [], 4) == ([], [])
+    assert balance(names, [0] * 8, 1) == ([], [['a', 'b'], ['c', 'd'],
+        ['e', 'f'], ['g', 'h']])
@@ -0,0 +1,101 @@
+import io
+import json
+import types
+import pytest
+
+pytest.importorskip('pymol')
+
+from ccpbsa import progress
+from ccpbsa.progress import Progress, Tagged, Batched, track, clock, variant
+
+
+@pytest.fixture
+def now(monkeypatch):
+    """A clock the test sets, in seconds.
+    """
+    now = [1000.0]
+    monkeypatch.setattr(progress, 'time',
+        types.SimpleNamespace(time=lambda: now[0]))
+
+    return now
+
+
+def test_eta(now):
+    """The estimated cost over the cores at first, then the remaining cost
+    at the pace of the finished tasks.
+    """
+    tasks = ['wt/1', 'wt/2', 'A20G/1', 'A20G/2']
+    p = Progress('energy', tasks, costs=[1, 1, 3, 3], cores=2, stream=None)
+
+    assert p.eta() == 4.0
+
+    now[0] += 10
+    p.update('wt/1')
+    p.update('wt/2')
+
+    assert p.eta() == pytest.approx(10 / 2 * 6)
+
+    now[0] += 20
+    p.update('A20G/1', 'mdrun exited with 1')
+
+    assert p.eta() == pytest.approx(30 / 5 * 3)
+
+    state = p.state()
+
+    assert (state['done'], state['failed'], state['total']) == (3, 1, 4)
+    assert state['per_hour'] == pytest.approx(3 / 30 * 3600)
+    assert state['ensembles'] == {'wt': [2, 2], 'A20G': [1, 2]}
+
+    p.update('A20G/2')
+
+    assert p.eta() == 0.0
+
+
+def test_report(now, tmp_path):
+    """Lines at most every interval, the status file with the stages
+    before.
+    """
+    stream = io.StringIO()
+    status = str(tmp_path / 'status.json')
+    p = Progress('concoord', ['wt', 'A20G'], stream=stream, status=status,
+        interval=5)
+    now[0] += 1
+    p.update('wt')
+    now[0] += 5
+    p.update('A20G')
+    p.close()
+    lines = stream.getvalue().splitlines()
+
+    assert len(lines) == 3
+    assert lines[0] == "concoord: 0/2 tasks (0 failed), 0.0/h, 0/2 " \
+        "ensembles done, 0:00:00 elapsed, ETA 0:00:02"
+    assert lines[1].startswith("concoord: 2/2 tasks (0 failed), 1200.0/h, " \
+        "2/2 ensembles done, 0:00:06 elapsed, ETA 0:00:00")
+
+    Progress('energy', [('wt/1', None)], stream=None, status=status)
+
+    with open(status, 'r') as f:
+        state = json.load(f)
+
+    assert state['stage'] == 'energy'
+    assert sorted(state['stages']) == ['concoord', 'energy']
+    assert state['stages']['concoord']['done'] == 2
+    assert not (tmp_path / 'status.json.tmp').exists()
+
+
+def test_wrappers():
+    assert Tagged(len)('abc') == ('abc', 3)
+    assert Batched(len)(['a', 'bc']) == [('a', 1), ('bc', 2)]
+
+
+def test_track():
+    stream = io.StringIO()
+
+    assert list(track(['x', 'y'], 'area', stream=stream)) == ['x', 'y']
+    assert stream.getvalue().splitlines()[-1].startswith("area: 2/2 tasks")
+
+
+def test_helpers():
+    assert clock(3725.4) == '1:02:05'
+    assert variant('A20G/3') == 'A20G'
+    assert variant(('wt/1', 'chains_A')) == 'wt'
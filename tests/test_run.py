@@ -0,0 +1,116 @@
+import subprocess
+import sys
+import types
+import pytest
+
+pytest.importorskip('pymol')
+
+from ccpbsa.CCPBSA import DataGenerator, ToolError, run, execute, pipes
+
+#    A program writing n lines of 100 bytes to stdout and to stderr.
+NOISY = "import sys\n" \
+    "for i in range(%d):\n" \
+    "    sys.stdout.write('out %%95d\\n' %% i)\n" \
+    "    sys.stderr.write('err %%95d\\n' %% i)\n"
+
+
+def python(code):
+    return [sys.executable, '-c', code]
+
+
+def test_stream(tmp_path):
+    """Output much longer than the tail: stdout goes to its file, stderr to
+    the log, and only the tail of stderr is kept.
+    """
+    out, log = str(tmp_path / 'out.txt'), str(tmp_path / 'tools.log')
+    proc = run(python(NOISY % 2000), stdout=out, stderr=subprocess.PIPE,
+        log=log, tail=250)
+    lines = open(log, 'rb').read().splitlines()
+
+    assert proc.returncode == 0
+    assert proc.stdout is None
+    assert len(proc.stderr) == 250
+    assert proc.stderr.endswith(b'err' + b'%96d\n' % 1999)
+    assert len(lines) == 2000
+    assert lines[-1] == b'err' + b'%96d' % 1999
+    assert open(out, 'rb').read().splitlines()[0] == b'out' + b'%96d' % 0
+
+
+def test_same_file(tmp_path):
+    """stdout and log with the same name share one file, which is appended
+    to.
+    """
+    log = str(tmp_path / 'tools.log')
+
+    with open(log, 'w') as f:
+        f.write('before\n')
+
+    run(python(NOISY % 3), stdout=log, stderr=subprocess.PIPE, log=log)
+    lines = open(log, 'r').read().splitlines()
+
+    assert lines[0] == 'before'
+    assert len(lines) == 7
+
+
+def test_input(tmp_path):
+    out = str(tmp_path / 'out.txt')
+    run(python("import sys; sys.stdout.write(sys.stdin.read()[::-1])"),
+        input=b'0 1', stdout=out)
+
+    assert open(out, 'r').read() == '1 0'
+
+
+def test_pipe_stdout():
+    with pytest.raises(ValueError):
+        run(python(''), stdout=subprocess.PIPE)
+
+
+def test_timeout():
+    """A program is killed after the timeout, with the stderr it wrote.
+    """
+    code = "import sys, time\nsys.stderr.write('started')\n" \
+        "sys.stderr.flush()\ntime.sleep(30)\n"
+
+    with pytest.raises(subprocess.TimeoutExpired) as e:
+        run(python(code), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+            timeout=0.5)
+
+    assert e.value.stderr == b'started'
+
+
+def test_execute(tmp_path):
+    """Failures of a program are ToolErrors with the tail of its stderr.
+    """
+    out = str(tmp_path / 'out.txt')
+    fail = "import sys\nsys.stderr.write('bad input')\nsys.exit(3)\n"
+
+    with pytest.raises(ToolError) as e:
+        execute(python(fail), name='tool', stderr=subprocess.PIPE)
+
+    assert str(e.value) == "tool exited with 3\nbad input"
+
+    with pytest.raises(ToolError) as e:
+        execute(python(''), name='tool', stdout=out, outputs=[out])
+
+    assert str(e.value) == "tool did not write %s" % out
+
+    with pytest.raises(ToolError) as e:
+        execute(python("import time; time.sleep(30)"), name='tool',
+            timeouts={'tool': 0.5})
+
+    assert str(e.value) == "tool timed out after 0.5 s"
+
+
+@pytest.mark.parametrize('verbosity', [0, 1])
+def test_echo(tmp_path, capsys, verbosity):
+    """Output parsed from a file is shown in the terminal only in verbose
+    mode.
+    """
+    gen = types.SimpleNamespace(pipe=pipes(verbosity))
+    out = str(tmp_path / 'out.txt')
+    execute(python(NOISY % 2), **DataGenerator.output(gen, out))
+    DataGenerator.echo(gen, out)
+
+    assert DataGenerator.output(gen, out)['outputs'] == [out]
+    assert capsys.readouterr().out == (open(out, 'r').read() if verbosity
+        else '')
@@ -0,0 +1,167 @@
+import os
+import threading
+import multiprocessing.pool
+import pytest
+
+pytest.importorskip('pymol')
+
+from ccpbsa import server
+
+PDB = os.path.join(os.path.dirname(__file__), os.pardir, 'input-data',
+    '1pga.pdb')
+
+#    What the dummy tasks did, in order, and the variants whose pipeline
+#    waits until its event is set. waiting is set when one does.
+log = []
+gates = {}
+waiting = threading.Event()
+
+
+def setup(spec):
+    """A job directory with the wildtype done by an earlier job.
+    """
+    log.append((spec['id'], 'setup'))
+
+    return True
+
+
+def pipeline(spec, d):
+    """A variant whose name ends in G fails.
+    """
+    if d in gates:
+        waiting.set()
+        gates[d].wait(10)
+
+    log.append((spec['id'], d))
+
+    return 'concoord failed' if d.endswith('G') else None
+
+
+def collect(spec, v):
+    return {'ddG': {'CALC': 1.0}, 'ddG_fit': {'CALC': 0.5}, 'failures': {}}
+
+
+@pytest.fixture
+def socket_path(request, tmp_path, monkeypatch):
+    """A server with the dummy tasks in a pool of threads, one core unless
+    the test asks for more, running on a temporary socket until the test
+    ends.
+    """
+    monkeypatch.setattr(server, 'Pool', multiprocessing.pool.ThreadPool)
+    monkeypatch.setattr(server, 'setup', setup)
+    monkeypatch.setattr(server, 'pipeline', pipeline)
+    monkeypatch.setattr(server, 'collect', collect)
+    log.clear()
+    gates.clear()
+    waiting.clear()
+    flags = tmp_path / 'flags.txt'
+    flags.write_text('[pdb2gmx]\n-ff oplsaa\n')
+    path = str(tmp_path / 'ccpbsa.sock')
+    options = dict(flags=str(flags), spmdp=str(flags))
+    parameters = {'stability': {}, 'affinity': {}}
+    thread = threading.Thread(target=server.serve, args=(path,
+        str(tmp_path), getattr(request, 'param', 1), options, parameters,
+        None))
+    thread.start()
+
+    while not os.path.exists(path):
+        thread.join(0.01)
+
+    yield path
+
+    if thread.is_alive():
+        list(server.submit({'request': 'shutdown'}, path))
+        thread.join(10)
+
+
+def job(mutations):
+    return {'wildtype': PDB, 'mutations': mutations}
+
+
+def test_job(socket_path):
+    """Events of a job submitted as JSON, each variant reported once, then
+    done.
+    """
+    events = list(server.submit(job(['A20G', 'D22A']), socket_path))
+    variants = events[0]['variants']
+
+    assert [e['event'] for e in events[:1] + events[-1:]] \
+        == ['accepted', 'done']
+    assert len(set(e['job'] for e in events)) == 1
+    assert os.path.exists(events[0]['directory'] + '/mutations.txt')
+
+    reported = dict((e['variant'], e) for e in events[1:-1])
+
+    assert sorted(reported) == sorted(variants)
+    assert [reported[v]['event'] for v in variants] == ['failed', 'result']
+    assert reported[variants[0]]['reason'] == 'concoord failed'
+    assert reported[variants[1]]['ddG_fit'] == {'CALC': 0.5}
+
+
+@pytest.mark.parametrize('socket_path', [2], indirect=True)
+def test_streaming(socket_path):
+    """A variant is reported while another one of the job still runs.
+    """
+    gate = gates['D22A'] = threading.Event()
+    events = server.submit(job(['D22A', 'D46A']), socket_path)
+
+    assert next(events)['variants'] == ['D22A', 'D46A']
+
+    first = next(events)
+
+    assert (first['event'], first['variant']) == ('result', 'D46A')
+    assert not gate.is_set()
+
+    gate.set()
+
+    assert [(e['event'], e.get('variant')) for e in events] \
+        == [('result', 'D22A'), ('done', None)]
+
+
+def test_fair(socket_path):
+    """With one core, a small job submitted after a large one is not done
+    last: the jobs take turns.
+    """
+    gate = gates['D22A'] = threading.Event()
+    large = server.submit(job(['D22A', 'D46A', 'A26A', 'A34A', 'K10A']),
+        socket_path)
+    first = next(large)['job']
+    waiting.wait(10)
+    small = server.submit(job(['E15A']), socket_path)
+    second = next(small)['job']
+    status = next(server.submit({'request': 'status'}, socket_path))
+    gate.set()
+    done = threading.Thread(target=list, args=(small,))
+    done.start()
+    list(large)
+    done.join(10)
+
+    assert status == dict(event='status', cores=1, running=1, queued=5,
+        jobs=2)
+    assert log.index((second, 'E15A')) < log.index((first, 'K10A'))
+
+
+def test_errors(socket_path):
+    """A request the server can not read is answered with an error.
+    """
+    events = list(server.submit({'wildtype': PDB}, socket_path))
+    unknown = list(server.submit(dict(job(['D22A']), routine='gxg'),
+        socket_path))
+
+    assert [e['event'] for e in events + unknown] == ['error', 'error']
+
+
+def test_shutdown(socket_path):
+    """A shutdown request stops the server and removes its socket.
+    """
+    assert list(server.submit({'request': 'shutdown'}, socket_path)) \
+        == [{'event': 'shutdown'}]
+
+    for _ in range(100):
+
+        if not os.path.exists(socket_path):
+            break
+
+        threading.Event().wait(0.05)
+
+    assert not os.path.exists(socket_path)
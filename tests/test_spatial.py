@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('pymol')
+
+from ccpbsa.spatial import SpatialIndex
+
+
+def structure(n=400, seed=0):
+    """Random atoms in a box of 3 nm, in chains A and B of ten atoms per
+    residue.
+    """
+    rng = np.random.default_rng(seed)
+    atoms = [('A' if i < n // 2 else 'B', str(i // 10 + 1), 'ALA', 'CA')
+        for i in range(n)]
+
+    return rng.uniform(0, 3, (n, 3)), atoms, rng
+
+
+def moved(rng, index, idx):
+    """Move the atoms idx of index by up to 0.5 nm, as a mutation would.
+    Returns the new coordinates of all atoms.
+    """
+    xyz = index.xyz.copy()
+    xyz[idx] += rng.uniform(-0.5, 0.5, (len(idx), 3))
+    index.update(idx, xyz[idx])
+
+    return xyz
+
+
+def pair_set(*arrays):
+    return set(zip(*[a.tolist() for a in arrays]))
+
+
+def brute_pairs(xyz, r):
+    d = np.linalg.norm(xyz[:, None] - xyz[None, :], axis=2)
+    i, j = np.where(np.triu(d < r, 1))
+
+    return pair_set(i, j)
+
+
+@pytest.mark.parametrize('share', [0.02, 0.05, 0.5])
+def test_update_rebuild(share):
+    """Queries after moving some atoms, with the tree of the moved atoms or
+    rebuilt, are those of an index built of the new coordinates.
+    """
+    xyz, atoms, rng = structure()
+    index = SpatialIndex(xyz, atoms)
+    new = xyz
+
+    for _ in range(2):
+        idx = rng.choice(len(xyz), int(share * len(xyz)), replace=False)
+        new = moved(rng, index, idx)
+
+    fresh = SpatialIndex(new, atoms)
+    points = rng.uniform(0, 3, (30, 3))
+    mask = index.select(chains='A')
+    a, b = index.select(chains='A'), index.select(chains='B')
+
+    assert (index.overlay is None) == (share > 0.1)
+    assert pair_set(*index.query(points, 0.4)) \
+        == pair_set(*fresh.query(points, 0.4))
+    assert pair_set(*index.query(points, 0.4, mask)) \
+        == pair_set(*fresh.query(points, 0.4, mask))
+    assert pair_set(*index.pairs(0.3)) == brute_pairs(new, 0.3)
+    assert pair_set(*index.pairs(0.3, mask)) == pair_set(*fresh.pairs(0.3,
+        mask))
+    assert np.array_equal(index.within(points, 0.4), fresh.within(points,
+        0.4))
+
+    for m, f in zip(index.contacts(a, b, 0.3), fresh.contacts(a, b, 0.3)):
+        assert np.array_equal(m, f)
+
+    d, i = index.nearest(points, 3)
+    d_, i_ = fresh.nearest(points, 3)
+
+    assert np.array_equal(i, i_)
+    assert d == pytest.approx(d_)
+
+
+def test_nearest_missing():
+    """Fewer atoms in the mask than asked for are padded with inf and -1.
+    """
+    xyz, atoms, _ = structure(20)
+    index = SpatialIndex(xyz, atoms)
+    mask = np.zeros(20, dtype=bool)
+    mask[[3, 7]] = True
+    d, i = index.nearest(xyz[[3]], 3, mask)
+
+    assert i[0].tolist() == [3, 7, -1]
+    assert d[0, 0] == 0 and d[0, 2] == np.inf
+
+
+def test_select():
+    """Chains and residues, with an empty chain matching all chains.
+    """
+    xyz, atoms, _ = structure(40)
+    index = SpatialIndex(xyz, atoms)
+
+    assert index.select(chains='B').sum() == 20
+    assert np.where(index.select(residues=[('A', 2)]))[0].tolist() \
+        == list(range(10, 20))
+    assert index.select(residues=[('', 3)]).sum() == 10
+    assert index.residues_of(index.select(chains='A', residues=[('', 2),
+        ('', 3)])) == {('A', '2')}
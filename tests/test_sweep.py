@@ -0,0 +1,75 @@
+import pytest
+
+pytest.importorskip('pymol')
+
+from ccpbsa.sweep import graph, nodes, STAGES
+
+
+def settings(tmp_path, name, gropbe='epsIn=2\n', ff='oplsaa', disco='-n=3',
+    **options):
+    """Generator options with a flags file and a gropbe parameter file of
+    their own.
+    """
+    prm = tmp_path / (name + '_gropbe.txt')
+    prm.write_text(gropbe)
+    flags = tmp_path / (name + '_flags.txt')
+    flags.write_text('[dist]\n<<<=1\n\n[disco]\n%s\n\n[pdb2gmx]\n-ff=%s\n'
+        '-ignh\n\n[gropbe]\n%s\n' % (disco, ff, prm))
+
+    generator = dict(flags=str(flags), pb='gropbe', minimizer='mdrun')
+    generator.update(options)
+
+    return name, generator
+
+
+@pytest.fixture
+def table(tmp_path):
+    wildtype = tmp_path / 'wt.pdb'
+    wildtype.write_text('ATOM\n')
+    variants = [
+        settings(tmp_path, 'base'),
+        settings(tmp_path, 'copy'),
+        settings(tmp_path, 'gropbe', gropbe='epsIn=4\n'),
+        settings(tmp_path, 'pb', pb='internal'),
+        settings(tmp_path, 'ff', ff='amber99sb'),
+        settings(tmp_path, 'disco', disco='-n=5'),
+    ]
+
+    return graph(variants, str(wildtype))
+
+
+def shared(table, a, b):
+    """The stages a and b share the node of.
+    """
+    return [s for s, _, _ in STAGES if table.loc[a, s] == table.loc[b, s]]
+
+
+def test_stages(table):
+    """Settings share the nodes of the stages before the first one that
+    depends on what they differ in.
+    """
+    assert shared(table, 'base', 'copy') == ['concoord', 'minimization',
+        'energy']
+    assert shared(table, 'base', 'gropbe') == ['concoord', 'minimization']
+    assert shared(table, 'base', 'pb') == ['concoord', 'minimization']
+    assert shared(table, 'base', 'ff') == ['concoord']
+    assert shared(table, 'base', 'disco') == []
+
+
+def test_nodes(table):
+    """Each node runs once, with the first variant that needs it.
+    """
+    assert [v for v, _ in nodes(table, 'concoord')] == ['base', 'disco']
+    assert [v for v, _ in nodes(table, 'minimization')] == ['base', 'ff',
+        'disco']
+    assert len(nodes(table, 'energy')) == 5
+
+
+def test_inputs(tmp_path, table):
+    """Other structures split every stage.
+    """
+    other = tmp_path / 'other.pdb'
+    other.write_text('HETATM\n')
+    keys = graph([settings(tmp_path, 'base')], str(other))
+
+    assert (keys.loc['base'] != table.loc['base']).all()
@@ -0,0 +1,248 @@
+import os
+import socket
+import subprocess
+import sys
+import types
+import numpy as np
+import pytest
+
+pytest.importorskip('pymol')
+
+import ccpbsa.CCPBSA as ccpbsa
+from ccpbsa.CCPBSA import DataGenerator, ToolError, read_pdb, read_gro, \
+    write_gro, make_template, from_template, topology_key, rebuild
+from ccpbsa.clustering import CLUSTERS
+from ccpbsa.trajectory import Frame, pack_trr, trajectory
+
+PDB = os.path.join(os.path.dirname(__file__), os.pardir, 'input-data',
+    '1pga.pdb')
+
+
+def rotation(seed=0):
+    q, _ = np.linalg.qr(np.random.default_rng(seed).normal(size=(3, 3)))
+
+    return q * np.sign(np.linalg.det(q))
+
+
+def moved(pdb, fname, R, t, noise=None):
+    """Write the atoms of pdb rotated by R and shifted by t (nm), after
+    adding noise (nm, one row per atom).
+    """
+    n = 0
+
+    with open(pdb, 'r') as src, open(fname, 'w') as dst:
+
+        for l in src:
+
+            if l[:6] in ('ATOM  ', 'HETATM'):
+                x = np.array([l[30:38], l[38:46], l[46:54]], dtype=float)
+                x = R @ (x + (0 if noise is None else 10 * noise[n])) + 10 * t
+                n += 1
+                l = l[:30] + '%8.3f%8.3f%8.3f' % tuple(x) + l[54:]
+
+            dst.write(l)
+
+
+def protonate(pdb):
+    """The atoms of pdb with a hydrogen added to each CA and N, placed from
+    the bonded heavy atoms as pdb2gmx does. Returns the atom records and
+    coordinates in the order of a .gro file.
+    """
+    atoms, xyz = read_pdb(pdb)
+    index = dict((a[:2] + (a[3],), n) for n, a in enumerate(atoms))
+    groatoms, groxyz = [], []
+
+    def unit(v):
+        return v / np.linalg.norm(v)
+
+    for n, a in enumerate(atoms):
+        groatoms.append((int(a[1]), a[2], a[3]))
+        groxyz.append(xyz[n])
+
+        if a[3] == 'CA':
+            N, C = xyz[index[a[:2] + ('N',)]], xyz[index[a[:2] + ('C',)]]
+            h = xyz[n] + 0.109 * unit(2 * xyz[n] - N - C)
+
+        elif a[3] == 'N' and (a[0], str(int(a[1]) - 1), 'C') in index:
+            C = xyz[index[(a[0], str(int(a[1]) - 1), 'C')]]
+            CA = xyz[index[a[:2] + ('CA',)]]
+            h = xyz[n] + 0.101 * unit(2 * xyz[n] - C - CA)
+
+        else:
+            continue
+
+        groatoms.append((int(a[1]), a[2], 'H' + a[3]))
+        groxyz.append(h)
+
+    return groatoms, np.array(groxyz)
+
+
+def test_template_rebuild(tmp_path):
+    """The hydrogens of a structure are rebuilt from the template on the
+    structure itself and on a rigidly moved copy, to the precision of the
+    .gro file.
+    """
+    atoms, xyz = protonate(PDB)
+    conf = str(tmp_path / 'conf.gro')
+    write_gro(conf, 'pdb2gmx', atoms, xyz, [3.0, 3.0, 3.0])
+    template = str(tmp_path / 'template.npz')
+
+    assert make_template(PDB, conf, template)
+
+    R, t = rotation(), np.array([1.0, -2.0, 0.5])
+    moved(PDB, str(tmp_path / 'moved.pdb'), R, t)
+
+    for pdb, ref in ((PDB, xyz), (str(tmp_path / 'moved.pdb'),
+        xyz @ R.T + t)):
+        gro = str(tmp_path / 'out.gro')
+
+        assert from_template(template, pdb, gro, [])
+
+        title, groatoms, groxyz, _ = read_gro(gro)
+
+        assert title == 'pdb2gmx'
+        assert groatoms == atoms
+        assert groxyz == pytest.approx(ref, abs=3e-3)
+
+    assert not from_template(template, PDB, gro, ['-princ'])
+
+
+def generator(tmp_path):
+    """What DataGenerator.topology needs of a DataGenerator.
+    """
+    return types.SimpleNamespace(flags={'pdb2gmx': []},
+        input={'pdb2gmx': None}, topologies=str(tmp_path / '.topologies'),
+        pipe={})
+
+
+@pytest.fixture
+def pdb2gmx(monkeypatch):
+    """Replaces gmx by a pdb2gmx that writes the protonated structure, and
+    records its calls.
+    """
+    calls = []
+
+    def gmx(prog, cwd=None, **kwargs):
+        calls.append(cwd)
+        atoms, xyz = protonate(PDB)
+        write_gro(cwd + '/conf.gro', 'pdb2gmx', atoms, xyz, [3.0, 3.0, 3.0])
+
+    monkeypatch.setattr(ccpbsa, 'gmx', gmx)
+
+    return calls
+
+
+def test_topology_cached(tmp_path, pdb2gmx):
+    """pdb2gmx runs once per structure, the template is made from its
+    output.
+    """
+    gen = generator(tmp_path)
+    top = DataGenerator.topology(gen, PDB)
+
+    assert top == gen.topologies + '/' + topology_key(PDB, [], None)
+    assert os.path.exists(top + '/done')
+    assert os.path.exists(top + '/template.npz')
+    assert DataGenerator.topology(gen, PDB) == top
+    assert pdb2gmx == [top]
+
+
+def test_topology_failed(tmp_path, monkeypatch):
+    """A failed pdb2gmx still finishes the directory, without a template.
+    """
+    def gmx(prog, **kwargs):
+        raise ToolError("pdb2gmx exited with 1")
+
+    monkeypatch.setattr(ccpbsa, 'gmx', gmx)
+    top = DataGenerator.topology(generator(tmp_path), PDB)
+
+    assert os.path.exists(top + '/done')
+    assert not os.path.exists(top + '/template.npz')
+
+
+def test_topology_stale(tmp_path, pdb2gmx):
+    """A directory without done of a process that is gone is made again.
+    """
+    gen = generator(tmp_path)
+    top = gen.topologies + '/' + topology_key(PDB, [], None)
+    os.makedirs(top)
+    gone = subprocess.Popen([sys.executable, '-c', ''])
+    gone.wait()
+
+    with open(top + '/owner', 'w') as owner:
+        owner.write('%s %d\n' % (socket.gethostname(), gone.pid))
+
+    assert DataGenerator.topology(gen, PDB, wait=5) == top
+    assert os.path.exists(top + '/template.npz')
+    assert pdb2gmx == [top]
+
+    with open(top + '/owner', 'r') as owner:
+        assert owner.read().split() == [socket.gethostname(),
+            str(os.getpid())]
+
+
+def test_topology_timeout(tmp_path, pdb2gmx):
+    """Waiting for a directory of a process that is still running times
+    out.
+    """
+    gen = generator(tmp_path)
+    top = gen.topologies + '/' + topology_key(PDB, [], None)
+    os.makedirs(top)
+
+    with open(top + '/owner', 'w') as owner:
+        owner.write('%s %d\n' % (socket.gethostname(), os.getpid()))
+
+    with pytest.raises(ToolError):
+        DataGenerator.topology(gen, PDB, wait=1)
+
+    assert pdb2gmx == []
+
+
+@pytest.mark.parametrize('fits', [True, False])
+def test_cluster_frames(tmp_path, fits):
+    """A frame per member: the minimized center displaced by the member.
+    Members that differ by a rigid motion get the same frame. Without a
+    template each member is the center.
+    """
+    ensemble = tmp_path / 'wt'
+    noise = np.random.default_rng(0).normal(0, 0.02, (len(read_pdb(PDB)[1]),
+        3))
+
+    for i, (R, t, e) in enumerate([(np.eye(3), np.zeros(3), None),
+        (np.eye(3), np.zeros(3), noise), (rotation(), np.ones(3), noise)]):
+        (ensemble / str(i+1)).mkdir(parents=True)
+        moved(PDB, str(ensemble / str(i+1) / ('%d.pdb' % (i+1))), R, t, e)
+
+    (ensemble / CLUSTERS).write_text("MEMBER,CLUSTER,RMSD\n1,1,0\n2,1,0\n"
+        "3,1,0\n")
+    atoms, xyz = protonate(PDB)
+    write_gro(str(tmp_path / 'conf.gro'), 'pdb2gmx', atoms, xyz, [3.0] * 3)
+
+    if fits:
+        make_template(PDB, str(tmp_path / 'conf.gro'),
+            str(tmp_path / 'template.npz'))
+
+    x = (xyz + 0.01).astype(np.float32)
+    (ensemble / '1' / 'traj.trr').write_bytes(pack_trr(Frame(5, 5.0,
+        np.eye(3, dtype=np.float32) * 3, x)))
+    gen = types.SimpleNamespace(topology=lambda pdb: str(tmp_path))
+    fname = str(tmp_path / 'trajout.trr')
+
+    assert DataGenerator.cluster_frames(gen, str(ensemble), [1], fname) == 3
+
+    t = trajectory(fname)
+    frames = [t.frame(i).x for i in range(3)]
+
+    assert frames[0] == pytest.approx(x, abs=1e-5)
+    assert frames[2] == pytest.approx(frames[1], abs=1e-3)
+
+    if fits:
+        member = rebuild(str(tmp_path / 'template.npz'),
+            str(ensemble / '2' / '2.pdb'))
+        deviation = np.linalg.norm(frames[1] - x, axis=1)
+
+        assert deviation.mean() > 0.01
+        assert deviation == pytest.approx(np.linalg.norm(member - xyz,
+            axis=1), abs=0.01)
+
+    else:
+        assert frames[1] == pytest.approx(x, abs=1e-5)
@@ -0,0 +1,193 @@
+import struct
+import numpy as np
+import pytest
+
+pytest.importorskip('pymol')
+
+from ccpbsa.CCPBSA import write_gro
+from ccpbsa.trajectory import Frame, trajectory, last_frames, pack_trr, \
+    concatenate, XTC_MAGIC, XTC_MAGICINTS
+
+
+def frames(n, natoms, seed=0):
+    """n frames of random coordinates in a triclinic box.
+    """
+    rng = np.random.default_rng(seed)
+    box = np.array([[3, 0, 0], [0.5, 3, 0], [0.5, 0.5, 3]], dtype=np.float32)
+
+    return [Frame(100 * i, 0.5 * i, box,
+        rng.uniform(0, 3, (natoms, 3)).astype(np.float32)) for i in range(n)]
+
+
+def test_trr_round_trip(tmp_path):
+    """Frames written by pack_trr come back in any order, a frame cut off
+    at the end is left out.
+    """
+    written = frames(4, 7)
+    data = b''.join(pack_trr(f) for f in written)
+    fname = str(tmp_path / 'a.trr')
+
+    with open(fname, 'wb') as trr:
+        trr.write(data + pack_trr(written[0])[:-5])
+
+    t = trajectory(fname)
+
+    assert len(t) == 4
+
+    for i in (2, 0, -1):
+        f = t.frame(i)
+        assert (f.step, f.time) == (written[i].step, written[i].time)
+        assert np.array_equal(f.box, written[i].box)
+        assert np.array_equal(f.x, written[i].x)
+
+
+def test_concatenate(tmp_path):
+    """The frames of all files one after another, with their steps.
+    """
+    written = frames(5, 3)
+    files = []
+
+    for i, part in enumerate((written[:2], written[2:])):
+        files.append(str(tmp_path / ('%d.trr' % i)))
+
+        with open(files[-1], 'wb') as trr:
+            trr.write(b''.join(pack_trr(f) for f in part))
+
+    assert concatenate(files, str(tmp_path / 'all.trr')) == 5
+
+    t = trajectory(str(tmp_path / 'all.trr'))
+
+    assert [t.frame(i).step for i in range(len(t))] == [0, 100, 200, 300, 400]
+    assert np.array_equal(np.stack(list(t)), np.stack([f.x for f in written]))
+
+
+def test_gro_round_trip(tmp_path):
+    """Coordinates written by write_gro, to their three decimals.
+    """
+    f = frames(1, 12)[0]
+    atoms = [(i // 3 + 1, 'ALA', 'CA') for i in range(12)]
+    box = [3.0, 3.0, 3.0, 0.0, 0.0, 0.5, 0.0, 0.5, 0.5]
+    write_gro(str(tmp_path / 'a.gro'), 'title t= 2.5 step= 7', atoms, f.x, box)
+    frame = trajectory(str(tmp_path / 'a.gro')).frame(0)
+
+    assert (frame.step, frame.time) == (7, 2.5)
+    assert frame.x == pytest.approx(f.x, abs=5e-4)
+    assert np.array_equal(frame.box, f.box)
+
+
+class BitWriter:
+    """Writes bits most significant first, as Bits reads them.
+    """
+    def __init__(self):
+        self.bits = []
+
+
+    def write(self, value, n):
+        self.bits.extend((value >> k) & 1 for k in reversed(range(n)))
+
+
+    def ints(self, nbits, sizes, values):
+        """Three integers packed into one number, its bytes least
+        significant first.
+        """
+        n = (values[0] * sizes[1] + values[1]) * sizes[2] + values[2]
+
+        while nbits > 8:
+            self.write(n & 0xff, 8)
+            n >>= 8
+            nbits -= 8
+
+        if nbits > 0:
+            self.write(n, nbits)
+
+
+    def bytes(self):
+        bits = self.bits + [0] * (-len(self.bits) % 8)
+
+        return bytes(int(''.join(map(str, bits[k:k+8])), 2)
+            for k in range(0, len(bits), 8))
+
+
+def pack_xtc(frame, precision=1000.0, smallidx=12):
+    """A compressed .xtc frame. The last two atoms are written as a run, the
+    last one in full and the one before as a small difference to it, which
+    comes first after decoding.
+    """
+    x = np.rint(frame.x * precision).astype(int)
+    minint, maxint = x.min(axis=0), x.max(axis=0)
+    sizes = maxint - minint + 1
+    bitsize = int(np.prod(sizes)).bit_length()
+    smallnum = XTC_MAGICINTS[smallidx] // 2
+    bits = BitWriter()
+
+    for a in x[:-2]:
+        bits.ints(bitsize, sizes, a - minint)
+        bits.write(0, 1)
+
+    bits.ints(bitsize, sizes, x[-1] - minint)
+    bits.write(1, 1)
+    bits.write(4, 5) # a run of one atom, the small size kept
+    bits.ints(smallidx, [XTC_MAGICINTS[smallidx]] * 3,
+        x[-2] - x[-1] + smallnum)
+    data = bits.bytes()
+
+    return struct.pack('>3if9fifiiiiiiii', XTC_MAGIC, len(x), frame.step,
+        frame.time, *frame.box.ravel(), len(x), precision, *minint, *maxint,
+        smallidx, len(data)) + data + b'\0' * (-len(data) % 4)
+
+
+def test_xtc_compressed(tmp_path):
+    """Compressed frames, with a run of small differences, to the
+    precision.
+    """
+    rng = np.random.default_rng(5)
+    written = frames(3, 12)
+
+    for f in written:
+        f.x[-2] = f.x[-1] + rng.uniform(-0.005, 0.005, 3)
+
+    with open(str(tmp_path / 'a.xtc'), 'wb') as xtc:
+        xtc.write(b''.join(pack_xtc(f) for f in written))
+
+    t = trajectory(str(tmp_path / 'a.xtc'))
+
+    assert len(t) == 3
+
+    for i in (1, 2, 0):
+        f = t.frame(i)
+        assert (f.step, f.time) == (written[i].step, written[i].time)
+        assert np.array_equal(f.box, written[i].box)
+        assert f.x == pytest.approx(written[i].x, abs=5e-4 + 1e-6)
+
+
+def test_xtc_few_atoms(tmp_path):
+    """Up to nine atoms are stored uncompressed.
+    """
+    f = frames(1, 4)[0]
+
+    with open(str(tmp_path / 'a.xtc'), 'wb') as xtc:
+        xtc.write(struct.pack('>3if9fi', XTC_MAGIC, 4, f.step, f.time,
+            *f.box.ravel(), 4) + f.x.astype('>f4').tobytes())
+
+    assert np.array_equal(trajectory(str(tmp_path / 'a.xtc'))[0], f.x)
+
+
+def test_last_frames(tmp_path):
+    """The last frames of members stacked into a preallocated array, frames
+    without coordinates skipped.
+    """
+    written = frames(3, 6)
+    empty = pack_trr(Frame(9, 9.0, None, np.zeros((0, 3))))
+    files = []
+
+    for i in range(3):
+        files.append(str(tmp_path / ('%d.trr' % i)))
+
+        with open(files[-1], 'wb') as trr:
+            trr.write(pack_trr(written[i]) + empty)
+
+    out = np.empty((3, 6, 3), dtype=np.float32)
+
+    assert last_frames(files, out) is out
+    assert np.array_equal(out, np.stack([f.x for f in written]))
+    assert np.array_equal(last_frames(files), out)
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('pymol')
+
+from ccpbsa.triage import select, merge
+
+
+@pytest.fixture
+def ddG():
+    return pd.DataFrame({
+        'CALC': [5.0, -8.0, 1.2, 0.9, np.nan, 0.1],
+        'SOLV': [1.0, 2.0, 3.0, 4.0, np.nan, 6.0],
+    }, index=['A', 'B', 'C', 'D', 'E', 'F'])
+
+
+def test_select(ddG):
+    """The largest effects, the borderline ones and the chosen ones, each
+    with the first reason that applies. Failed variants are not escalated.
+    """
+    reasons = select(ddG, top=2, threshold=1.0, margin=0.25, chosen=['F'])
+
+    assert reasons.to_dict() == dict(F='selected', B='top', A='top',
+        C='borderline', D='borderline')
+    assert select(ddG, top=1, chosen=['B']).to_dict() == dict(B='selected')
+    assert select(ddG, top=10).index.tolist() == ['B', 'A', 'C', 'D', 'F']
+    assert len(select(ddG)) == 0
+
+
+def test_select_unknown(ddG):
+    with pytest.raises(ValueError):
+        select(ddG, chosen=['A', 'Z'])
+
+
+def test_merge(ddG):
+    """Values of the full ensembles replace the screened ones, only for
+    variants of the screen.
+    """
+    full = pd.DataFrame({'CALC': [7.0, 2.0], 'SOLV': [np.nan, 0.5]},
+        index=['B', 'Z'])
+    table = merge(ddG, full)
+
+    assert table.index.tolist() == ddG.index.tolist()
+    assert table.loc['B', 'CALC'] == 7.0
+    assert np.isnan(table.loc['B', 'SOLV'])
+    assert table['FIDELITY'].tolist() == ['screen', 'ensemble'] \
+        + ['screen'] * 4
+    assert table.drop('B')[['CALC', 'SOLV']].equals(ddG.drop('B'))
+    assert 'FIDELITY' not in ddG
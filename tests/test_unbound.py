@@ -0,0 +1,200 @@
+import os
+import threading
+import multiprocessing.pool
+import numpy as np
+import pytest
+
+pytest.importorskip('pymol')
+
+import ccpbsa.CCPBSA as ccpbsa
+from ccpbsa.CCPBSA import AffinityGenerator, AffinityCollector, read_pdb, \
+    split_pdb, pipes, write_gro, read_index
+
+PDB = os.path.join(os.path.dirname(__file__), os.pardir, 'input-data',
+    '1pga.pdb')
+
+
+def complex(fname):
+    """1pga as chain A and a copy of it as chains B and C, split after
+    residue 30.
+    """
+    with open(PDB, 'r') as src:
+        atoms = [l for l in src if l.startswith('ATOM')]
+
+    with open(fname, 'w') as dst:
+        dst.write('CRYST1   30.000   30.000   30.000  90.00  90.00  90.00\n')
+        dst.writelines(atoms)
+        dst.write('TER\n')
+
+        for l in atoms:
+            dst.write(l[:21] + ('B' if int(l[22:26]) <= 30 else 'C') + l[22:])
+
+        dst.write('END\n')
+
+
+def test_split_pdb(tmp_path):
+    complex(str(tmp_path / 'complex.pdb'))
+    split_pdb(str(tmp_path / 'complex.pdb'), 'BC', str(tmp_path / 'BC.pdb'))
+    atoms, xyz = read_pdb(str(tmp_path / 'BC.pdb'))
+    _, ref = read_pdb(PDB)
+    lines = (tmp_path / 'BC.pdb').read_text().splitlines()
+
+    assert set(a[0] for a in atoms) == {'B', 'C'}
+    assert (xyz == ref).all()
+    assert lines[0].startswith('CRYST1') and lines[-1] == 'END'
+
+
+@pytest.fixture
+def generator(tmp_path, monkeypatch):
+    """An AffinityGenerator of chain group A against BC in tmp_path, with
+    the bound complex and the programs replaced by records of their calls.
+    The bound complex and both groups have to get to their first program
+    together, or the barrier breaks.
+    """
+    monkeypatch.chdir(tmp_path)
+    complex('complex.pdb')
+    (tmp_path / 'gropbe.prm').write_text('eps(1)\n')
+    gen = AffinityGenerator.__new__(AffinityGenerator)
+    gen.grp1, gen.grp2 = 'A', 'BC'
+    gen.pb, gen.energygroups, gen.spmdp = 'gropbe', False, 'sp.mdp'
+    gen.flags = {'grompp': ['-f', 'min.mdp'], 'gropbe': ['gropbe.prm']}
+    gen.input = {'grompp': None}
+    gen.pipe = pipes(0)
+    gen.calls = []
+    barrier = threading.Barrier(3, timeout=10)
+
+    def gmx(prog, **kwargs):
+        gen.calls.append(prog)
+
+    def execute(args, **kwargs):
+        gen.calls.append(args + [kwargs['input']])
+
+    def prepare(pdb, gro):
+        barrier.wait()
+        gen.calls.append(['prepare', pdb])
+
+        return pdb[:-4] + '.top'
+
+    def do_minimization(d):
+        barrier.wait()
+        gen.calls.append(['bound', d])
+
+    monkeypatch.setattr(ccpbsa, 'gmx', gmx)
+    monkeypatch.setattr(ccpbsa, 'execute', execute)
+    gen.prepare = prepare
+    gen.topol = lambda pdb, fn: fn + '.top'
+    gen.index = lambda pdb, fn: []
+    gen.do_minimization = do_minimization
+    gen.terms = lambda: gen.calls.append(['terms'])
+
+    return gen
+
+
+@pytest.mark.parametrize('energygroups', [False, True])
+def test_concurrent(tmp_path, generator, energygroups):
+    """The bound complex and the two groups run at the same time in one
+    directory, each group on its own files. With energy groups the groups
+    have no Lennard-Jones run of their own.
+    """
+    generator.energygroups = energygroups
+    d = str(tmp_path / 'complex')
+    pool = multiprocessing.pool.ThreadPool(3)
+    list(pool.imap_unordered(lambda grp: generator.energy(d, grp),
+        [None, 'A', 'BC']))
+    pool.close()
+    calls = generator.calls
+
+    assert ['bound', d] in calls and ['terms'] in calls
+
+    for grp in ('A', 'BC'):
+        ours = [c for c in calls if any(str(a).startswith((grp + '.',
+            grp + '_')) for a in c)]
+        grompp = [c for c in ours if c[0] == 'grompp']
+
+        assert set(a[0] for a in read_pdb(grp + '.pdb')[0]) == set(grp)
+        assert ['prepare', grp + '.pdb'] in ours
+        assert [c[c.index('-po') + 1] for c in grompp] \
+            == [grp + '_mdout.mdp'] * 2
+        assert ['gropbe', grp + '_gropbe.prm',
+            bytes(",".join(str(i) for i in range(len(grp))), 'utf-8')] in ours
+        assert (tmp_path / (grp + '_gropbe.prm')).read_text() \
+            == 'eps(1)\nin(tpr,%s_sp.tpr)' % grp
+        assert any(c[0] == 'mdrun' for c in ours) != energygroups
+
+
+def test_group_index(tmp_path, generator):
+    """With energy groups the bound complex gets a group per chain group,
+    the unbound groups get none.
+    """
+    generator.energygroups = True
+    atoms, xyz = read_pdb('complex.pdb')
+    write_gro('out.gro', 'complex', [(int(a[1]), a[2], a[3]) for a in atoms],
+        xyz, [3.0] * 3)
+    generator.index = lambda pdb, fn: []
+
+    assert AffinityGenerator.index(generator, 'complex.pdb', 'out') \
+        == ['-n', 'out.ndx']
+    assert AffinityGenerator.index(generator, 'A.pdb', 'A') == []
+
+    groups = read_index('out.ndx')
+    chains = np.array([a[0] for a in atoms])
+
+    assert list(groups) == ['System', 'chains_A', 'chains_BC']
+    assert (groups['System'] == np.arange(len(atoms))).all()
+    assert (groups['chains_A'] == np.where(chains == 'A')[0]).all()
+    assert (groups['chains_BC'] == np.where(chains != 'A')[0]).all()
+
+
+def test_groups_local():
+    with pytest.raises(ValueError):
+        AffinityGenerator(PDB, None, None, 'A', None, local=1.0,
+            energygroups=True)
+
+
+@pytest.mark.parametrize('energygroups', [True, False])
+def test_search_lj(tmp_path, monkeypatch, energygroups):
+    """The unbound terms are those within each chain group of the complex,
+    or those of the unbound runs. A member without its energies is NaN.
+    """
+    names = ['LJ-14', 'LJ (SR)']
+    pairs = ['chains_A-chains_A', 'chains_A-chains_BC', 'chains_BC-chains_BC']
+    names += [t + p for p in pairs for t in ('LJ-14:', 'LJ-SR:')]
+
+    def table(offset):
+        t = np.zeros(2, dtype=[(n, 'f8') for n in names])
+
+        for i, n in enumerate(names):
+            t[n] = [offset + i, offset + i + 2]
+
+        return t
+
+    tables = {}
+
+    def read_edrs(files):
+        return dict((f, tables.get(f)) for f in files)
+
+    d = str(tmp_path) + '/1pga/'
+    tables[d + 'sp.edr'] = table(0)
+    tables[d + 'A_sp.edr'] = table(100)
+    tables[d + 'BC_sp.edr'] = table(200)
+    monkeypatch.setattr(ccpbsa, 'read_edrs', read_edrs)
+    col = AffinityCollector.__new__(AffinityCollector)
+    col.maindir, col.n, col.lj_group = str(tmp_path), 0, None
+    col.energygroups, col.grp1, col.grp2 = energygroups, 'A', 'BC'
+    col.G_bound, col.G_grp1, col.G_grp2 = [ccpbsa.pd.DataFrame(0.0,
+        columns=['LJ (1-4)', 'LJ (SR)'], index=['1pga', 'D22A'])
+        for _ in range(3)]
+    col.search_lj()
+
+    assert col.G_bound.loc['1pga'].tolist() == [1, 2]
+
+    if energygroups:
+        assert col.G_grp1.loc['1pga'].tolist() == [3, 4]
+        assert col.G_grp2.loc['1pga'].tolist() == [7, 8]
+
+    else:
+        assert col.G_grp1.loc['1pga'].tolist() == [101, 102]
+        assert col.G_grp2.loc['1pga'].tolist() == [201, 202]
+
+    for G in (col.G_bound, col.G_grp1, col.G_grp2):
+        assert G.loc['D22A'].isna().all()
@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('pymol')
+
+from ccpbsa.uncertainty import draws, differences, fitted
+
+
+def table(values):
+    """Member values of ensembles, given as {ensemble: values}, indexed
+    like the G tables of the collectors, with unit weights.
+    """
+    frames = dict((e, pd.DataFrame({'G': v}, index=range(1, len(v)+1)))
+        for e, v in values.items())
+    T = pd.concat(frames)
+    weights = pd.Series(1.0, index=T.index)
+
+    return T, weights
+
+
+def test_draws_follow_weights():
+    """A cluster of three members is drawn three times as often as one of a
+    single member, as often as the ensemble had members.
+    """
+    idx = draws(np.array([3.0, 1.0]), 20000, np.random.default_rng(0))
+
+    assert idx.shape == (20000, 4)
+    assert (idx == 0).mean() == pytest.approx(0.75, abs=0.01)
+
+
+def test_differences_standard_error():
+    """The spread of the replicates is the standard error of the mean
+    difference, sqrt(var_wt / n_wt + var_mut / n_mut).
+    """
+    rng = np.random.default_rng(1)
+    wt, mut = rng.normal(0, 1, 50), rng.normal(2, 3, 40)
+    T, w = table({'wt': wt, 'mut': mut})
+    R = differences(T, w, 'wt', ['mut'], n=20000)
+    se = np.sqrt(wt.var() / len(wt) + mut.var() / len(mut))
+
+    assert R.shape == (1, 20000, 1)
+    assert R[0, :, 0].mean() == pytest.approx(mut.mean() - wt.mean(), abs=0.02)
+    assert R[0, :, 0].std() == pytest.approx(se, rel=0.03)
+
+
+def test_differences_paired():
+    """Pairs that differ by the same amount give no spread, however much
+    the members vary.
+    """
+    wt = np.random.default_rng(2).normal(0, 5, 30)
+    T, w = table({'wt': wt, 'mut': wt + 1.5})
+    R = differences(T, w, 'wt', ['mut'], paired=True, n=500)
+
+    assert R == pytest.approx(np.full((1, 500, 1), 1.5))
+
+
+def test_fitted():
+    """CALC is the parameters times the sums of their terms.
+    """
+    columns = ['CALC', 'SOLV', 'COUL', 'LJ (1-4)', 'LJ (SR)', 'SAS', '-TS']
+    R = np.array([[0.0, 1.0, 2.0, 3.0, 4.0, 5.0, 6.0]])
+    parameters = dict(alpha=0.5, beta=0.1, gamma=2.0, tau=0.3)
+
+    assert fitted(R, columns, 'stability', parameters) == \
+        pytest.approx([0.5 * 3 + 0.1 * 7 + 2.0 * 5 + 0.3 * 6])
@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('pymol')
+
+from ccpbsa.warehouse import connect, ingest, query, sites, PROVENANCE
+
+
+def run(d, protein, forcefield, calc):
+    """A stability run in d with the fitted ddG calc of two variants, the
+    member energies and timings.
+    """
+    d.mkdir()
+    pd.Series(dict(protein=protein, kind='stability', flags_hash='abc',
+        forcefield=forcefield, ensemble_size='2', **{'fit:alpha': 0.5}),
+        dtype=object).to_csv(str(d / PROVENANCE), header=False)
+    variants = ['A_K17A', 'A_K17A+B_E108A']
+    pd.DataFrame({'CALC': calc, 'EXP': [np.nan, 1.0]}, index=variants) \
+        .to_csv(str(d / 'ddG_fit.csv'))
+    pd.DataFrame({'COUL': [1.0, 2.0, 3.0, 4.0]},
+        index=pd.MultiIndex.from_product([[protein, variants[0]], [1, 2]])) \
+        .to_csv(str(d / 'G_fold.csv'))
+    (d / 'timings.csv').write_text(
+        "energy,100,2,1800.000,0\nenergy,100,2,1800.000,1\n")
+
+    return str(d)
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = connect(str(tmp_path / 'ccpbsa.db'))
+    ingest(db, run(tmp_path / 'r1', '1pga', 'oplsaa', [1.5, -0.5]), 'c1')
+    ingest(db, run(tmp_path / 'r2', '1pga', 'amber99sb', [2.5, 0.5]), 'c1')
+    ingest(db, run(tmp_path / 'r3', '1bxi', 'oplsaa', [3.5, 1.5]), 'c2')
+
+    return db
+
+
+def test_sites():
+    assert sites('A_K17A+B_E108A') == [('A', '17', 'K', 'A'),
+        ('B', '108', 'E', 'A')]
+    assert sites('H-5AG') == [('', '-5A', 'H', 'G')]
+    assert sites('1pga') == []
+
+
+def test_query(db):
+    """Filters on the runs and on the mutated sites of the variants.
+    Missing values are NULL.
+    """
+    table = query(db)
+
+    assert len(table) == 6
+    assert sorted(query(db, protein='1bxi')['value']) == [1.5, 3.5]
+    assert sorted(query(db, forcefield='oplsaa', residue='108')['value']) \
+        == [-0.5, 1.5]
+    assert query(db, campaign='c1', chain='B', protein='1pga')['variant'] \
+        .unique().tolist() == ['A_K17A+B_E108A']
+    assert query(db, term='EXP')['value'].isna().sum() == 3
+
+
+def test_query_members(db):
+    """Member tables keep the member numbers.
+    """
+    table = query(db, tab='G_fold', term='COUL', forcefield='amber99sb')
+
+    assert table[['variant', 'member', 'value']].values.tolist() == [
+        ['1pga', 1, 1.0], ['1pga', 2, 2.0], ['A_K17A', 1, 3.0],
+        ['A_K17A', 2, 4.0]]
+
+
+def test_reingest(db, tmp_path):
+    """Ingesting a run again replaces it.
+    """
+    d = tmp_path / 'r1'
+    pd.DataFrame({'CALC': [9.0, 9.0]}, index=['A_K17A', 'A_K17A+B_E108A']) \
+        .to_csv(str(d / 'ddG_fit.csv'))
+    ingest(db, str(d), 'c1')
+
+    assert len(query(db)) == 6
+    assert db.execute('SELECT COUNT(*) FROM runs').fetchone()[0] == 3
+    assert sorted(query(db, forcefield='oplsaa', protein='1pga')['value']) \
+        == [9.0, 9.0]
+
+
+def test_provenance(db):
+    """Fit parameters, settings and core hours of all tasks.
+    """
+    assert db.execute('SELECT DISTINCT name, value FROM parameters') \
+        .fetchall() == [('alpha', 0.5)]
+    assert db.execute('SELECT core_hours, ensemble_size FROM runs') \
+        .fetchall() == [(1.0, 2)] * 3
+    assert db.execute('SELECT tasks, failed FROM timings').fetchall() \
+        == [(2, 1)] * 3
+
+
+def test_errors(db, tmp_path):
+    (tmp_path / 'empty').mkdir()
+
+    with pytest.raises(ValueError):
+        ingest(db, str(tmp_path / 'empty'))
+
+    with pytest.raises(ValueError):
+        query(db, variant='A_K17A')